@@ -0,0 +1,190 @@
+"""
+Socket handling driver using asyncio. Unlike selectdriver, which runs a selector thread alongside
+connect, queue, ping, and reconnect threads for every network, this driver runs all of these as
+callbacks and coroutines on one event loop.
+
+This driver is opt-in: set "driver: asyncio" in the pylink: block of the config to use it.
+"""
+
+import asyncio
+import ssl
+import threading
+import time
+
+from pylinkirc import structures, world
+from pylinkirc.log import log
+
+__all__ = ['loop', 'in_loop', 'run_in_loop', 'run_coroutine', 'wait_readable', 'wait_writable',
+           'do_handshake', 'register', 'unregister', 'call_later', 'call_every', 'finish_on_shutdown',
+           'wakeup', 'start']
+
+loop = asyncio.new_event_loop()
+
+# Tasks that are allowed to finish when the loop stops, instead of being cancelled right away.
+_finishing_tasks = set()
+# How long (in seconds) the loop waits for these tasks when stopping.
+SHUTDOWN_TIMEOUT = 10
+
+def in_loop():
+    """Returns whether the caller is running inside the driver's event loop."""
+    try:
+        return asyncio.get_running_loop() is loop
+    except RuntimeError:
+        return False
+
+def run_in_loop(func, *args):
+    """
+    Runs func(*args) on the event loop: immediately if called from the loop, or as soon as
+    possible otherwise. This is the only thread-safe way to touch loop objects from other threads.
+    """
+    if in_loop():
+        func(*args)
+    else:
+        loop.call_soon_threadsafe(func, *args)
+
+def run_coroutine(coro):
+    """
+    Schedules the given coroutine on the event loop, returning a concurrent.futures.Future.
+
+    This is safe to call from any thread, including before the loop is started.
+    """
+    return asyncio.run_coroutine_threadsafe(coro, loop)
+
+async def _wait_for_fd(sock, writable):
+    """Waits until the given socket is readable or writable."""
+    fut = loop.create_future()
+
+    def _ready():
+        if not fut.done():
+            fut.set_result(None)
+
+    if writable:
+        loop.add_writer(sock, _ready)
+    else:
+        loop.add_reader(sock, _ready)
+    try:
+        await fut
+    finally:
+        if writable:
+            loop.remove_writer(sock)
+        else:
+            loop.remove_reader(sock)
+
+async def wait_readable(sock):
+    """Waits until the given (not yet registered) socket is readable."""
+    await _wait_for_fd(sock, False)
+
+async def wait_writable(sock):
+    """Waits until the given socket is writable."""
+    await _wait_for_fd(sock, True)
+
+async def do_handshake(sock):
+    """Runs the TLS handshake on a non-blocking SSLSocket created with do_handshake_on_connect=False."""
+    while True:
+        try:
+            sock.do_handshake()
+        except ssl.SSLWantReadError:
+            await wait_readable(sock)
+        except ssl.SSLWantWriteError:
+            await wait_writable(sock)
+        else:
+            return
+
+def register(irc):
+    """
+    Registers a network's socket for reads on the event loop.
+    """
+    log.debug('asynciodriver: registering %s for network %s', irc._socket, irc.name)
+    run_in_loop(loop.add_reader, irc._socket, _read_callback, irc)
+
+def unregister(irc):
+    """
+    Removes a network's socket from the event loop.
+    """
+    if irc._socket.fileno() != -1:
+        log.debug('asynciodriver: de-registering %s for network %s', irc._socket, irc.name)
+        run_in_loop(loop.remove_reader, irc._socket)
+    else:
+        log.debug('asynciodriver: skipping de-registering %s for network %s', irc._socket, irc.name)
+
+def _run_timer(handle):
+    """Runs a job scheduled with call_later() or call_every(), rescheduling periodic jobs."""
+    if handle.cancelled:
+        return
+    if handle.interval:
+        loop.call_later(handle.interval, _run_timer, handle)
+    handle.run()
+
+def call_later(delay, func, *args):
+    """
+    Schedules func(*args) to run once on the event loop after the given delay (in seconds).
+    Returns a structures.TimerHandle, like selectdriver.call_later(). This is safe to call from any thread.
+    """
+    handle = structures.TimerHandle(time.monotonic() + delay, func, args)
+    run_in_loop(loop.call_later, delay, _run_timer, handle)
+    return handle
+
+def call_every(interval, func, *args):
+    """
+    Schedules func(*args) to run on the event loop every interval seconds, starting interval
+    seconds from now. This is safe to call from any thread.
+    """
+    handle = structures.TimerHandle(time.monotonic() + interval, func, args, interval=interval)
+    run_in_loop(loop.call_later, interval, _run_timer, handle)
+    return handle
+
+def finish_on_shutdown(task):
+    """
+    Lets the given task (e.g. a send queue writing out its last lines) finish when the loop stops
+    for shutdown, instead of cancelling it. This must be called from the event loop.
+    """
+    _finishing_tasks.add(task)
+    task.add_done_callback(_finishing_tasks.discard)
+
+def wakeup():
+    """Wakes up the event loop so that it notices shutdown right away."""
+    try:
+        loop.call_soon_threadsafe(_check_shutdown)
+    except RuntimeError:  # Loop is already closed
+        pass
+
+def _read_callback(irc):
+    """Reader callback which passes incoming data on to the network."""
+    try:
+        if not irc._aborted.is_set():
+            irc._run_irc()
+    except:
+        log.exception('Error in asyncio driver loop:')
+
+def _check_shutdown():
+    """Stops the event loop once PyLink is shutting down."""
+    if world.shutting_down.is_set():
+        log.debug('asynciodriver: stopping event loop due to shutdown')
+        # Use call_soon so that any disconnects already queued by shutdown() run first.
+        loop.call_soon(loop.stop)
+
+def _run_loop():
+    """Main loop thread target."""
+    asyncio.set_event_loop(loop)
+    loop.call_soon(_check_shutdown)
+    try:
+        loop.run_forever()
+
+        if _finishing_tasks:
+            log.debug('asynciodriver: waiting for %s task(s) to finish', len(_finishing_tasks))
+            loop.run_until_complete(asyncio.wait(set(_finishing_tasks), timeout=SHUTDOWN_TIMEOUT))
+
+        # Cancel and reap any coroutines (send queues, reconnects) still pending.
+        tasks = asyncio.all_tasks(loop)
+        for task in tasks:
+            task.cancel()
+        loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+    finally:
+        loop.close()
+
+def start():
+    """
+    Starts a thread running the event loop.
+    """
+    t = threading.Thread(target=_run_loop, name="Asyncio driver loop")
+    t.start()
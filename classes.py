@@ -7,8 +7,11 @@ connections and objects used to represent IRC servers, users, and channels.
 Here be dragons.
 """
 
+import asyncio
 import collections
 import collections.abc
+import contextlib
+import contextvars
 import functools
 import hashlib
 import ipaddress
@@ -20,17 +23,46 @@ import string
 import textwrap
 import threading
 import time
+from types import MappingProxyType
 
-from . import __version__, conf, selectdriver, structures, utils, world
-from .log import log, PyLinkChannelLogger
+from . import __version__, asynciodriver, conf, connector, selectdriver, structures, utils, world
+from .log import log, PyLinkChannelLogger, _update_log_level
 from .utils import ProtocolError  # Compatibility with PyLink 1.x
 
 __all__ = ['ChannelState', 'User', 'UserMapping', 'PyLinkNetworkCore',
            'PyLinkNetworkCoreWithUtils', 'IRCNetwork', 'Server', 'Channel',
-           'PUIDGenerator', 'ProtocolError']
+           'PUIDGenerator', 'ProtocolError', 'SENDQ_CONTROL', 'SENDQ_INTERACTIVE',
+           'SENDQ_BULK', 'send_priority', 'ModeTable']
 
 QUEUE_FULL = queue.Full
 
+# Send queue priority classes, from highest to lowest priority:
+# - SENDQ_CONTROL is for link upkeep (PING, PONG), which must never wait behind other data.
+#   Other link level lines like SQUIT stay in the bulk class, as they must come after lines
+#   from the clients they remove.
+# - SENDQ_INTERACTIVE is for command replies that don't depend on earlier output (callers opt in
+#   using reply()'s priority argument)
+# - SENDQ_BULK is for everything else (bursts, relay spawns and messages). Lines that depend on
+#   each other (e.g. a new client and its first message) must share a class to stay in order,
+#   which is why this is the default.
+SENDQ_CONTROL = 'control'
+SENDQ_INTERACTIVE = 'interactive'
+SENDQ_BULK = 'bulk'
+
+_send_priority = contextvars.ContextVar('send_priority', default=SENDQ_BULK)
+
+@contextlib.contextmanager
+def send_priority(priority):
+    """
+    Context manager setting the default send queue priority class for lines sent in its body,
+    e.g. when calling protocol methods that don't take a priority argument themselves.
+    """
+    token = _send_priority.set(priority)
+    try:
+        yield
+    finally:
+        _send_priority.reset(token)
+
 
 ### Internal classes (users, servers, channels)
 
@@ -292,6 +324,7 @@ class PyLinkNetworkCore(structures.CamelCaseToSnakeCase):
                 handler = PyLinkChannelLogger(self, channel, level=level)
                 self.loghandlers.append(handler)
                 log.addHandler(handler)
+            _update_log_level()
 
     def _init_vars(self):
         """
@@ -387,32 +420,55 @@ class PyLinkNetworkCore(structures.CamelCaseToSnakeCase):
         # Always make sure TS is sent.
         if 'ts' not in parsed_args:
             parsed_args['ts'] = int(time.time())
-        hook_cmd = command
-        hook_map = self.hook_map
-
         # If the hook name is present in the protocol module's hook_map, then we
         # should set the hook name to the name that points to instead.
         # For example, plugins will read SETHOST as CHGHOST, EOS (end of sync)
         # as ENDBURST, etc.
-        if command in hook_map:
-            hook_cmd = hook_map[command]
-
         # However, individual handlers can also return a 'parse_as' key to send
         # their payload to a different hook. An example of this is "/join 0"
         # being interpreted as leaving all channels (PART).
-        hook_cmd = parsed_args.get('parse_as') or hook_cmd
+        hook_cmd = parsed_args.get('parse_as') or self.hook_map.get(command, command)
 
-        log.debug('(%s) Raw hook data: [%r, %r, %r] received from %s handler '
-                  '(calling hook %s)', self.name, numeric, hook_cmd, parsed_args,
-                  command, hook_cmd)
+        handlers = world.hooks.get(hook_cmd)
+        if not handlers:
+            return
 
-        # Iterate over registered hook functions, catching errors accordingly.
-        for hook_pair in world.hooks[hook_cmd].copy():
-            hook_func = hook_pair[1]
+        debug = log.debug_enabled
+        if debug:
+            log.debug('(%s) Raw hook data: [%r, %r, %r] received from %s handler '
+                      '(calling hook %s)', self.name, numeric, hook_cmd, parsed_args,
+                      command, hook_cmd)
+
+        # Iterate over registered hook functions, catching errors accordingly. The handlers tuple
+        # is never changed in place, so this needs no copy.
+        is_channel_event = None
+        timing = world.hook_timing
+        for _, hook_func, channels_only, networks, executor, _ in handlers:
+            if networks is not None and self.name not in networks:
+                continue
+            if channels_only:
+                if is_channel_event is None:
+                    target = parsed_args.get('target') or parsed_args.get('channel')
+                    is_channel_event = isinstance(target, str) and self.is_channel(target)
+                if not is_channel_event:
+                    continue
             try:
-                log.debug('(%s) Calling hook function %s from plugin "%s"', self.name,
-                          hook_func, hook_func.__module__)
-                retcode = hook_func(self, numeric, command, parsed_args)
+                if executor is not None:
+                    # Pooled hooks run in order per network and target (falling back to the sender).
+                    target = parsed_args.get('target') or parsed_args.get('channel') or numeric
+                    if isinstance(target, str):
+                        target = self.to_lower(target)
+                    utils._get_hook_pool().submit((self.name, target), self._call_pooled_hook, hook_func,
+                                                  hook_cmd, numeric, command, parsed_args.copy())
+                    continue
+
+                if debug:
+                    log.debug('(%s) Calling hook function %s from plugin "%s"', self.name,
+                              hook_func, hook_func.__module__)
+                if timing:
+                    retcode = self._call_timed_hook(hook_func, hook_cmd, numeric, command, parsed_args)
+                else:
+                    retcode = hook_func(self, numeric, command, parsed_args)
 
                 if retcode is False:
                     log.debug('(%s) Stopping hook loop for %r (command=%r)', self.name,
@@ -427,6 +483,44 @@ class PyLinkNetworkCore(structures.CamelCaseToSnakeCase):
                           hook_args)
                 continue
 
+    def _call_pooled_hook(self, hook_func, hook_cmd, numeric, command, parsed_args):
+        """Calls a hook function from the hook worker pool."""
+        try:
+            if world.hook_timing:
+                self._call_timed_hook(hook_func, hook_cmd, numeric, command, parsed_args)
+            else:
+                hook_func(self, numeric, command, parsed_args)
+        except Exception:
+            log.exception('(%s) Unhandled exception caught in pooled hook %r from plugin "%s"',
+                          self.name, hook_func, hook_func.__module__)
+            log.error('(%s) The offending hook data was: %s', self.name,
+                      [numeric, command, parsed_args])
+
+    def _call_timed_hook(self, hook_func, hook_cmd, numeric, command, parsed_args):
+        """
+        Calls a hook function, recording its run time in world.hook_stats (when hook profiling is
+        enabled) and logging it if it takes longer than the slow hook threshold.
+        """
+        start = time.perf_counter()
+        failed = True
+        try:
+            retcode = hook_func(self, numeric, command, parsed_args)
+            failed = False
+            return retcode
+        finally:
+            elapsed = time.perf_counter() - start
+            if world.hook_profiling:
+                key = (hook_func.__module__, hook_cmd)
+                stats = world.hook_stats.get(key)
+                if stats is None:
+                    stats = world.hook_stats.setdefault(key, structures.HookStats())
+                stats.add(elapsed)
+                if failed:
+                    stats.exceptions += 1
+            if world.slow_hook_threshold and elapsed >= world.slow_hook_threshold:
+                log.warning('(%s) Slow hook: %s from plugin "%s" took %.3f seconds on hook %s',
+                            self.name, hook_func, hook_func.__module__, elapsed, hook_cmd)
+
     def call_command(self, source, text):
         """
         Calls a PyLink bot command. source is the caller's UID, and text is the
@@ -434,9 +528,12 @@ class PyLinkNetworkCore(structures.CamelCaseToSnakeCase):
         """
         world.services['pylink'].call_cmd(self, source, text)
 
-    def msg(self, target, text, notice=None, source=None, loopback=True, wrap=True):
+    def msg(self, target, text, notice=None, source=None, loopback=True, wrap=True, priority=None):
         """Handy function to send messages/notices to clients. Source
-        is optional, and defaults to the main PyLink client if not specified."""
+        is optional, and defaults to the main PyLink client if not specified.
+
+        priority optionally sets the send queue priority class (e.g. SENDQ_INTERACTIVE) of the
+        outgoing messages."""
         if not text:
             return
 
@@ -446,12 +543,13 @@ class PyLinkNetworkCore(structures.CamelCaseToSnakeCase):
         source = source or self.pseudoclient.uid
 
         def _msg(text):
-            if notice:
-                self.notice(source, target, text)
-                cmd = 'PYLINK_SELF_NOTICE'
-            else:
-                self.message(source, target, text)
-                cmd = 'PYLINK_SELF_PRIVMSG'
+            with send_priority(priority or _send_priority.get()):
+                if notice:
+                    self.notice(source, target, text)
+                    cmd = 'PYLINK_SELF_NOTICE'
+                else:
+                    self.message(source, target, text)
+                    cmd = 'PYLINK_SELF_PRIVMSG'
 
             # Determines whether we should send a hook for this msg(), to forward things like services
             # replies across relay.
@@ -466,10 +564,14 @@ class PyLinkNetworkCore(structures.CamelCaseToSnakeCase):
             _msg(text)
 
     def _reply(self, text, notice=None, source=None, private=None, force_privmsg_in_private=False,
-            loopback=True, wrap=True):
+            loopback=True, wrap=True, priority=None):
         """
         Core of the reply() function - replies to the last caller in the right context
         (channel or PM).
+
+        priority optionally sets the send queue priority class of the reply. Replies default to
+        the caller's class, so that they stay in order with what the command sent before (e.g.
+        spawning the client the reply comes from).
         """
         if private is None:
             # Allow using private replies as the default, if no explicit setting was given.
@@ -486,7 +588,8 @@ class PyLinkNetworkCore(structures.CamelCaseToSnakeCase):
         else:
             target = self.called_in
 
-        self.msg(target, text, notice=notice, source=source, loopback=loopback, wrap=wrap)
+        self.msg(target, text, notice=notice, source=source, loopback=loopback, wrap=wrap,
+                 priority=priority)
 
     def reply(self, *args, **kwargs):
         """
@@ -587,10 +690,14 @@ class PyLinkNetworkCore(structures.CamelCaseToSnakeCase):
             log.error("(%s) Configuration error: %s", self.name, e)
             raise
 
-    def _run_autoconnect(self):
-        """Blocks for the autoconnect time and returns True if autoconnect is enabled."""
+    def _get_autoconnect_delay(self):
+        """
+        Returns the delay before the next autoconnect attempt, or None if autoconnect is disabled.
+
+        This also grows the autoconnect multiplier for the attempt after this one.
+        """
         if world.shutting_down.is_set():
-            log.debug('(%s) _run_autoconnect: aborting autoconnect attempt since we are shutting down.', self.name)
+            log.debug('(%s) _get_autoconnect_delay: aborting autoconnect attempt since we are shutting down.', self.name)
             return
 
         autoconnect = self.serverdata.get('autoconnect')
@@ -603,30 +710,20 @@ class PyLinkNetworkCore(structures.CamelCaseToSnakeCase):
         autoconnect_multiplier = max(autoconnect_multiplier, 1)
         autoconnect_max = max(autoconnect_max, 1)
 
-        log.debug('(%s) _run_autoconnect: Autoconnect delay set to %s seconds.', self.name, autoconnect)
+        log.debug('(%s) _get_autoconnect_delay: Autoconnect delay set to %s seconds.', self.name, autoconnect)
         if autoconnect is not None and autoconnect >= 1:
-            log.debug('(%s) _run_autoconnect: Multiplying autoconnect delay %s by %s.', self.name, autoconnect, self.autoconnect_active_multiplier)
+            log.debug('(%s) _get_autoconnect_delay: Multiplying autoconnect delay %s by %s.', self.name, autoconnect, self.autoconnect_active_multiplier)
             autoconnect *= self.autoconnect_active_multiplier
             # Add a cap on the max. autoconnect delay, so that we don't go on forever...
             autoconnect = min(autoconnect, autoconnect_max)
 
-            log.info('(%s) _run_autoconnect: Going to auto-reconnect in %s seconds.', self.name, autoconnect)
-            # Continue when either self._aborted is set or the autoconnect time passes.
-            # Compared to time.sleep(), this allows us to stop connections quicker if we
-            # break while while for autoconnect.
-            self._aborted.clear()
-            self._aborted.wait(autoconnect)
+            log.info('(%s) _get_autoconnect_delay: Going to auto-reconnect in %s seconds.', self.name, autoconnect)
 
             # Store in the local state what the autoconnect multiplier currently is.
             self.autoconnect_active_multiplier *= autoconnect_multiplier
-
-            if self not in world.networkobjects.values():
-                log.debug('(%s) _run_autoconnect: Stopping stale connect loop', self.name)
-                return
-            return True
-
+            return autoconnect
         else:
-            log.debug('(%s) _run_autoconnect: Stopping connect loop (autoconnect value %r is < 1).', self.name, autoconnect)
+            log.debug('(%s) _get_autoconnect_delay: Stopping connect loop (autoconnect value %r is < 1).', self.name, autoconnect)
             return
 
     def _pre_disconnect(self):
@@ -643,6 +740,7 @@ class PyLinkNetworkCore(structures.CamelCaseToSnakeCase):
         log.debug('(%s) _pre_disconnect: Removing channel logging handlers due to disconnect.', self.name)
         while self.loghandlers:
             log.removeHandler(self.loghandlers.pop())
+        _update_log_level()
 
     def _post_disconnect(self):
         """
@@ -749,6 +847,140 @@ class PyLinkNetworkCore(structures.CamelCaseToSnakeCase):
 
 structures._BLACKLISTED_COPY_TYPES.append(PyLinkNetworkCore)
 
+class ModeTable():
+    """
+    An immutable, compiled view of a network's supported modes (cmodes or umodes), and for
+    channels, its prefix modes. This provides direct lookups for what would otherwise be searches
+    over the "*A".."*D" strings and name -> char dicts:
+
+    - types: mode char -> mode type ('A', 'B', 'C', or 'D' as in RPL_ISUPPORT CHANMODES)
+    - names: mode char -> tuple of the mode names using it, in definition order
+    - chars: mode name -> mode char
+    - list_modes: a string of all type A (list) mode chars
+    - prefix_rank: prefix mode char -> rank, where 0 is the highest (e.g. {'o': 0, 'v': 1})
+    - prefixes: prefix char -> prefix mode char (e.g. {'@': 'o', '+': 'v'})
+
+    Networks compile these when their supported modes are set up, and recompile them whenever
+    these change (e.g. once 005 or CAPAB has been received): see
+    PyLinkNetworkCoreWithUtils._update_mode_tables().
+    """
+    __slots__ = ('_source', '_prefix_source', 'types', 'names', 'chars', 'list_modes',
+                 'prefix_rank', 'prefixes')
+
+    def __init__(self, supported_modes, prefixmodes=None):
+        prefixmodes = dict(prefixmodes or {})
+        set_attr = super().__setattr__
+        set_attr('_source', dict(supported_modes))
+        set_attr('_prefix_source', prefixmodes)
+
+        types = {}
+        # Fill these in reverse so that if a mode is listed twice, the type with an argument wins.
+        for mtype in 'DCBA':
+            types.update(dict.fromkeys(supported_modes.get('*' + mtype, ''), mtype))
+
+        names = {}
+        chars = {}
+        for name, char in supported_modes.items():
+            if name.startswith('*'):
+                continue
+            chars[name] = char
+            names[char] = names.get(char, ()) + (name,)
+
+        set_attr('types', MappingProxyType(types))
+        set_attr('names', MappingProxyType(names))
+        set_attr('chars', MappingProxyType(chars))
+        set_attr('list_modes', supported_modes.get('*A', ''))
+        set_attr('prefix_rank', MappingProxyType({char: rank for rank, char in enumerate(prefixmodes)}))
+        set_attr('prefixes', MappingProxyType({prefix: char for char, prefix in prefixmodes.items()}))
+
+    def __setattr__(self, attr, value):
+        raise AttributeError('ModeTable objects are immutable')
+
+    def __repr__(self):
+        return 'ModeTable(%r, %r)' % (self._source, self._prefix_source)
+
+class _ModeList():
+    """
+    A mode list (a set of (mode char, argument) pairs) that mode changes are applied onto in place.
+
+    Besides the set itself, this keeps an index of each mode character's arguments and a case
+    folded index of mode pairs, so that each mode change only costs a few lookups instead of a
+    pass over the whole list. The indexes are only built once a mode change needs them: adding
+    list modes (e.g. a burst of bans) never does.
+    """
+    __slots__ = ('modes', 'args', 'casemap', 'mode_types', 'to_lower')
+
+    def __init__(self, modes, mode_types, to_lower):
+        self.modes = set(modes)
+        self.mode_types = mode_types
+        self.to_lower = to_lower
+        self.args = None
+        self.casemap = None
+
+    def _build_index(self):
+        to_lower = self.to_lower
+        self.args = args = {}
+        self.casemap = casemap = {}
+        for modepair in self.modes:
+            args.setdefault(modepair[0], set()).add(modepair[1])
+            casemap.setdefault((modepair[0], to_lower(modepair[1])), modepair)
+
+    def get_args(self, char):
+        """Returns the set of arguments the given mode is set with."""
+        if self.args is None:
+            self._build_index()
+        return self.args.get(char, set())
+
+    def find(self, char, arg):
+        """Returns the mode pair matching the given mode and argument case insensitively, if any."""
+        if self.casemap is None:
+            self._build_index()
+        return self.casemap.get((char, self.to_lower(arg)))
+
+    def _discard(self, modepair):
+        self.modes.discard(modepair)
+        self.args[modepair[0]].discard(modepair[1])
+        lowered = (modepair[0], self.to_lower(modepair[1]))
+        if self.casemap.get(lowered) == modepair:
+            del self.casemap[lowered]
+
+    def add(self, char, arg):
+        """Sets the given mode."""
+        modepair = (char, arg)
+        if self.args is None:
+            if self.mode_types.get(char) == 'A':
+                # List modes are never replaced, so there's nothing to look up.
+                self.modes.add(modepair)
+                return
+            self._build_index()
+
+        existing = self.args.get(char)
+        if existing and self.mode_types.get(char) != 'A':
+            # The mode we're setting is not a list mode (like +beI). Therefore, only one version
+            # of it can exist at a time, and we must remove any old modepairs using the same
+            # letter. Otherwise, we'll get duplicates when, for example, someone sets mode
+            # "+l 30" on a channel already set "+l 25".
+            for oldvalue in list(existing):
+                self._discard((char, oldvalue))
+
+        self.modes.add(modepair)
+        self.args.setdefault(char, set()).add(arg)
+        self.casemap.setdefault((char, self.to_lower(arg)), modepair)
+
+    def remove(self, char, arg):
+        """Unsets the given mode."""
+        if self.mode_types.get(char) in ('A', 'B'):
+            # Mode requires argument for removal (case insensitive)
+            modepair = self.find(char, arg)
+            if modepair is not None:
+                self._discard(modepair)
+        else:
+            # Mode does not require argument for removal - remove all modes entries with the same character
+            lowered = self.to_lower(arg)
+            for oldvalue in list(self.get_args(char)):
+                if arg is None or lowered == self.to_lower(oldvalue):
+                    self._discard((char, oldvalue))
+
 class PyLinkNetworkCoreWithUtils(PyLinkNetworkCore):
 
     def __init__(self, *args, **kwargs):
@@ -756,6 +988,10 @@ class PyLinkNetworkCoreWithUtils(PyLinkNetworkCore):
         # Lock for updateTS to make sure only one thread can change the channel TS at one time.
         self._ts_lock = threading.Lock()
 
+    def _init_vars(self, *args, **kwargs):
+        super()._init_vars(*args, **kwargs)
+        self._update_mode_tables()
+
     @functools.lru_cache(maxsize=8192)
     def to_lower(self, text):
         """
@@ -833,6 +1069,35 @@ class PyLinkNetworkCoreWithUtils(PyLinkNetworkCore):
         else:
             return sname  # Fall back to given text instead of None
 
+    def _snapshot_channel(self, channel, command):
+        """
+        Returns a snapshot of the given channel's state for a hook payload's "channeldata" field,
+        or None if none of the hooks bound to the hook the given command is sent to asked for it
+        (using add_hook(..., wants_channeldata=True)).
+        """
+        for handler in world.hooks[self.hook_map.get(command, command)]:
+            if handler.wants_channeldata:
+                return self._channels[channel].snapshot()
+        return None
+
+    def _get_prefix_table(self, prefix_aliases=None):
+        """
+        Returns a dict mapping each prefix character (e.g. "@") to its prefix mode character
+        (e.g. "o"), for parsing nicklists like those in SJOIN.
+
+        prefix_aliases optionally maps protocol-specific prefix characters to the ones listed in
+        the prefixmodes table.
+        """
+        table = self.cmode_table.prefixes
+        if prefix_aliases:
+            table = dict(table)
+            aliased = {alias: table[prefix] for alias, prefix in prefix_aliases.items()
+                       if prefix in table}
+            for alias in prefix_aliases:
+                table.pop(alias, None)
+            table.update(aliased)
+        return table
+
     def _get_UID(self, target):
         """
         Converts a nick argument to its matching UID. This differs from nick_to_uid()
@@ -907,12 +1172,32 @@ class PyLinkNetworkCoreWithUtils(PyLinkNetworkCore):
                 'uplink': uplink, 'nicks': affected_nicks, 'serverdata': serverdata,
                 'channeldata': old_channels, 'affected_servers': affected_servers}
 
+    def _update_mode_tables(self):
+        """
+        Compiles the ModeTables for this network's channel modes (cmodes and prefixmodes) and user
+        modes, stored as cmode_table and umode_table.
+
+        Protocol modules must call this whenever they are done changing cmodes, umodes, or
+        prefixmodes, e.g. after receiving 005 or CAPAB. This is already done after post_connect().
+        """
+        log.debug('(%s) Compiling mode tables', self.name)
+        self.cmode_table = ModeTable(self.cmodes, self.prefixmodes)
+        self.umode_table = ModeTable(self.umodes)
+
+    def _get_mode_table(self, supported_modes):
+        """Returns the ModeTable for the given supported modes dict."""
+        if supported_modes is self.cmodes:
+            return self.cmode_table
+        elif supported_modes is self.umodes:
+            return self.umode_table
+        return ModeTable(supported_modes)
+
     @staticmethod
     def _log_debug_modes(*args, **kwargs):
         """
         Log debug info related to mode parsing if enabled.
         """
-        if conf.conf['pylink'].get('log_mode_parsers'):
+        if log.debug_enabled and conf.conf['pylink'].get('log_mode_parsers'):
             log.debug(*args, **kwargs)
 
     def _parse_modes(self, args, existing, supported_modes, is_channel=False, prefixmodes=None,
@@ -935,14 +1220,11 @@ class PyLinkNetworkCoreWithUtils(PyLinkNetworkCore):
         modestring = args[0]
         args = args[1:]
 
-        existing = set(existing)
-        existing_casemap = {}
-        for modepair in existing:
-            arg = modepair[1]
-            if arg is not None:
-                existing_casemap[(modepair[0], self.to_lower(arg))] = modepair
-            else:
-                existing_casemap[modepair] = modepair
+        mode_types = self._get_mode_table(supported_modes).types
+        # The "existing" mode list is tentatively updated as each mode is parsed. This is so queries
+        # like +b-b *!*@example.com *!*@example.com behave correctly
+        # (we can't rely on the original mode list to check whether a mode currently exists)
+        existing = _ModeList(existing, mode_types, self.to_lower)
 
         res = []
         for mode in modestring:
@@ -952,6 +1234,7 @@ class PyLinkNetworkCoreWithUtils(PyLinkNetworkCore):
                 if not prefix:
                     prefix = '+'
                 arg = None
+                mtype = mode_types.get(mode)
                 self._log_debug_modes('Current mode: %s%s; args left: %s', prefix, mode, args)
                 try:
                     if prefixmodes and mode in self.prefixmodes:
@@ -965,34 +1248,33 @@ class PyLinkNetworkCoreWithUtils(PyLinkNetworkCore):
                                                   'target doesn\'t seem to exist!', self.name,
                                                   mode, arg)
                             continue
-                    elif mode in (supported_modes['*A'] + supported_modes['*B']):
+                    elif mtype in ('A', 'B'):
                         # Must have parameter.
                         self._log_debug_modes('Mode %s: This mode must have parameter.', mode)
                         arg = args.pop(0)
                         if prefix == '-':
-                            if mode in supported_modes['*B'] and arg == '*':
+                            if mtype == 'B' and arg == '*':
                                 # Charybdis allows unsetting +k without actually
                                 # knowing the key by faking the argument when unsetting
                                 # as a single "*".
                                 # We'd need to know the real argument of +k for us to
                                 # be able to unset the mode.
-                                oldarg = dict(existing).get(mode)
-                                if oldarg:
+                                oldargs = existing.get_args(mode)
+                                if oldargs:
                                     # Set the arg to the old one on the channel.
-                                    arg = oldarg
+                                    arg = next(iter(oldargs))
                                     self._log_debug_modes("Mode %s: coersing argument of '*' to %r.", mode, arg)
 
-                            self._log_debug_modes('(%s) parse_modes: checking if +%s %s is in old modes list: %s; existing_casemap=%s', self.name, mode, arg, existing, existing_casemap)
+                            self._log_debug_modes('(%s) parse_modes: checking if +%s %s is in old modes list: %s', self.name, mode, arg, existing.modes)
 
-                            arg = self.to_lower(arg)
-                            casefolded_modepair = existing_casemap.get((mode, arg))  # Case fold arguments as needed
-                            if casefolded_modepair not in existing:
+                            casefolded_modepair = existing.find(mode, arg)  # Case fold arguments as needed
+                            if casefolded_modepair is None:
                                 # Ignore attempts to unset parameter modes that don't exist.
-                                self._log_debug_modes("(%s) parse_modes: ignoring removal of non-existent list mode +%s %s; casefolded_modepair=%s", self.name, mode, arg, casefolded_modepair)
+                                self._log_debug_modes("(%s) parse_modes: ignoring removal of non-existent list mode +%s %s", self.name, mode, arg)
                                 continue
                             arg = casefolded_modepair[1]
 
-                    elif prefix == '+' and mode in supported_modes['*C']:
+                    elif prefix == '+' and mtype == 'C':
                         # Only has parameter when setting.
                         self._log_debug_modes('Mode %s: Only has parameter when setting.', mode)
                         arg = args.pop(0)
@@ -1002,19 +1284,15 @@ class PyLinkNetworkCoreWithUtils(PyLinkNetworkCore):
                             'argument but none was found. (modestring: %r)',
                             self.name, mode, modestring)
                     continue  # Skip this mode; don't error out completely.
-                newmode = (prefix + mode, arg)
-                res.append(newmode)
-
-                # Tentatively apply the new mode to the "existing" mode list. This is so queries
-                # like +b-b *!*@example.com *!*@example.com behave correctly
-                # (we can't rely on the original mode list to check whether a mode currently exists)
-                existing = self._apply_modes(existing, [newmode], is_channel=is_channel)
-
-                lowered_mode = (newmode[0][-1], self.to_lower(newmode[1]) if newmode[1] else newmode[1])
-                if prefix == '+' and lowered_mode not in existing_casemap:
-                    existing_casemap[lowered_mode] = (mode, arg)
-                elif prefix == '-' and lowered_mode in existing_casemap:
-                    del existing_casemap[lowered_mode]
+                res.append((prefix + mode, arg))
+
+                if is_channel and mode in self.prefixmodes:
+                    # Prefix modes aren't tracked in the mode list.
+                    continue
+                elif prefix == '+':
+                    existing.add(mode, arg)
+                else:
+                    existing.remove(mode, arg)
         return res
 
     def parse_modes(self, target, args, ignore_missing_args=False):
@@ -1053,76 +1331,52 @@ class PyLinkNetworkCoreWithUtils(PyLinkNetworkCore):
         """
         Takes a list of parsed IRC modes, and applies them onto the given target mode list.
         """
-        modelist = set(old_modelist)
-        mapping = collections.defaultdict(set)
+        table = self.cmode_table if is_channel else self.umode_table
+        modelist = _ModeList(old_modelist, table.types, self.to_lower)
 
-        if is_channel:
-            supported_modes = self.cmodes
+        if is_channel and prefixmodes is not None:
+            # We only handle +qaohv for now. Map each prefix mode supported by the IRCd to the
+            # corresponding prefix mode list (e.g. c.prefixmodes['op'] for ops).
+            chars = table.chars
+            prefix_lists = {chars[pmode]: pmodelist for pmode, pmodelist in prefixmodes.items()
+                            if pmode in chars}
         else:
-            supported_modes = self.umodes
-
-        for modepair in modelist:  # Make a mapping of mode chars to values
-            mapping[modepair[0]].add(modepair[1])
+            prefix_lists = {}
 
         for mode in changedmodes:
             # Chop off the +/- part that parse_modes gives; it's meaningless for a mode list.
-            try:
-                real_mode = (mode[0][1], mode[1])
-            except IndexError:
-                real_mode = mode
+            if len(mode[0]) == 2:
+                adding = mode[0][0] != '-'
+                char = mode[0][1]
+            else:  # Assume add if no explicit +/- is given
+                adding = True
+                char = mode[0]
+            arg = mode[1]
 
             if is_channel:
-                if prefixmodes is not None:
-                    # We only handle +qaohv for now. Iterate over every supported mode:
-                    # if the IRCd supports this mode and it is the one being set, add/remove
-                    # the person from the corresponding prefix mode list (e.g. c.prefixmodes['op']
-                    # for ops).
-                    for pmode, pmodelist in prefixmodes.items():
-                        if pmode in supported_modes and real_mode[0] == supported_modes[pmode]:
-                            if mode[0][0] == '+':
-                                pmodelist.add(mode[1])
-                            else:
-                                pmodelist.discard(mode[1])
-
-                if real_mode[0] in self.prefixmodes:
+                pmodelist = prefix_lists.get(char)
+                if pmodelist is not None:
+                    # Add/remove the person from the corresponding prefix mode list
+                    if adding:
+                        pmodelist.add(arg)
+                    else:
+                        pmodelist.discard(arg)
+
+                if char in table.prefix_rank:
                     # Don't add prefix modes to Channel.modes; they belong in the
                     # prefixmodes mapping handled above.
                     self._log_debug_modes('(%s) Not adding mode %s to Channel.modes because '
                                           'it\'s a prefix mode.', self.name, str(mode))
                     continue
 
-            if mode[0][0] != '-':  # Adding a mode; assume add if no explicit +/- is given
-                self._log_debug_modes('(%s) Adding mode %r on %s', self.name, real_mode, modelist)
-                existing = mapping.get(real_mode[0])
-                if existing and real_mode[0] not in supported_modes['*A']:
-                    # The mode we're setting takes a parameter, but is not a list mode (like +beI).
-                    # Therefore, only one version of it can exist at a time, and we must remove
-                    # any old modepairs using the same letter. Otherwise, we'll get duplicates when,
-                    # for example, someone sets mode "+l 30" on a channel already set "+l 25".
-                    self._log_debug_modes('(%s) Old modes for mode %r exist in %s, removing them: %s',
-                              self.name, real_mode, modelist, str(existing))
-                    while existing:
-                        oldvalue = existing.pop()
-                        modelist.discard((real_mode[0], oldvalue))
-
-                modelist.add(real_mode)
-                mapping[real_mode[0]].add(real_mode[1])
+            if adding:
+                self._log_debug_modes('(%s) Adding mode %r on %s', self.name, (char, arg), modelist.modes)
+                modelist.add(char, arg)
             else:  # Removing a mode
-                self._log_debug_modes('(%s) Removing mode %r from %s', self.name, real_mode, modelist)
-
-                existing = mapping.get(real_mode[0])
-                arg = real_mode[1]
-                # Mode requires argument for removal (case insensitive)
-                if real_mode[0] in (supported_modes['*A'] + supported_modes['*B']):
-                    modelist.discard((real_mode[0], self.to_lower(arg)))
-                # Mode does not require argument for removal - remove all modes entries with the same character
-                else:
-                    while existing:
-                        oldvalue = existing.pop()
-                        if arg is None or self.to_lower(arg) == self.to_lower(oldvalue):
-                            modelist.discard((real_mode[0], oldvalue))
-        self._log_debug_modes('(%s) Final modelist: %s', self.name, modelist)
-        return modelist
+                self._log_debug_modes('(%s) Removing mode %r from %s', self.name, (char, arg), modelist.modes)
+                modelist.remove(char, arg)
+        self._log_debug_modes('(%s) Final modelist: %s', self.name, modelist.modes)
+        return modelist.modes
 
     def apply_modes(self, target, changedmodes):
         """Takes a list of parsed IRC modes, and applies them on the given target.
@@ -1191,22 +1445,20 @@ class PyLinkNetworkCoreWithUtils(PyLinkNetworkCore):
         if self.is_channel(target):
             c = oldobj or self._channels[target]
             oldmodes = c.modes.copy()
-            possible_modes = self.cmodes.copy()
-            # For channels, this also includes the list of prefix modes.
-            possible_modes['*A'] += ''.join(self.prefixmodes)
+            table = self.cmode_table
             for name, userlist in c.prefixmodes.items():
                 try:
                     # Add prefix modes to the list of old modes
-                    oldmodes |= {(self.cmodes[name], u) for u in userlist}
+                    oldmodes |= {(table.chars[name], u) for u in userlist}
                 except KeyError:
                     continue
         else:
             oldmodes = set(self.users[target].modes)
-            possible_modes = self.umodes
+            table = self.umode_table
+        mode_types = table.types
+        prefix_rank = table.prefix_rank
 
         oldmodes_mapping = dict(oldmodes)
-        oldmodes_lower = {(modepair[0], self.to_lower(modepair[1]) if modepair[1] else modepair[1])
-                          for modepair in oldmodes}
 
         newmodes = []
         self._log_debug_modes('(%s) reverse_modes: old/current mode list for %s is: %s', self.name,
@@ -1218,7 +1470,9 @@ class PyLinkNetworkCoreWithUtils(PyLinkNetworkCore):
             # C = Mode that changes a setting and only has a parameter when set.
             # D = Mode that changes a setting and never has a parameter.
             mchar = char[-1]
-            if mchar in possible_modes['*B'] + possible_modes['*C']:
+            # For channels, prefix modes are treated as list modes.
+            mtype = 'A' if mchar in prefix_rank else mode_types.get(mchar)
+            if mtype in ('B', 'C'):
                 # We need to look at the current mode list to reset modes that take arguments
                 # For example, trying to bounce +l 30 on a channel that had +l 50 set should
                 # give "+l 50" and not "-l".
@@ -1230,7 +1484,7 @@ class PyLinkNetworkCoreWithUtils(PyLinkNetworkCore):
                 else:  # Not found, flip the mode then.
 
                     # Mode takes no arguments when unsetting.
-                    if mchar in possible_modes['*C'] and char[0] != '-':
+                    if mtype == 'C' and char[0] != '-':
                         arg = None
                     mpair = (self._flip(char), arg)
             else:
@@ -1243,7 +1497,7 @@ class PyLinkNetworkCoreWithUtils(PyLinkNetworkCore):
                 self._log_debug_modes("(%s) reverse_modes: skipping reversing '%s %s' with %s since we're "
                                       "setting a mode that's already set.", self.name, char, arg, mpair)
                 continue
-            elif char[0] == '-' and (mchar, arg) not in oldmodes and mchar in possible_modes['*A']:
+            elif char[0] == '-' and (mchar, arg) not in oldmodes and mtype == 'A':
                 # We're unsetting a list or prefix mode that was never set - don't set it in response!
                 # TS6 IRCds lacks server-side verification for this and can cause annoying mode floods.
                 self._log_debug_modes("(%s) reverse_modes: skipping reversing '%s %s' with %s since it "
@@ -1625,59 +1879,102 @@ class PyLinkNetworkCoreWithUtils(PyLinkNetworkCore):
         # mode origin is us     |   OVERWRITE  |   MERGE  |    IGNORE
         # mode origin is uplink |    IGNORE    |   MERGE  |   OVERWRITE
 
-        if modes is None:
-            modes = []
+        # Use a lock so only one thread can change a channel's TS at once: this prevents race
+        # conditions that would otherwise desync channel modes.
+        with self._ts_lock:
+            if self._resolve_ts(sender, channel, their_ts, modes) and modes:
+                log.debug("(%s) Applying modes on channel %s (TS ok)", self.name,
+                          channel)
+                self.apply_modes(channel, modes)
+
+    def _resolve_ts(self, sender, channel, their_ts, modes=None):
+        """
+        Resolves the channel TS given the remote TS: when the remote TS is lower, this lowers the
+        channel's TS and clears its local modes. Returns whether the remote's modes should be
+        applied. This should be called with _ts_lock held.
+        """
+        our_ts = self._channels[channel].ts
+        assert isinstance(our_ts, int), "Wrong type for our_ts (expected int, got %s)" % type(our_ts)
+        assert isinstance(their_ts, int), "Wrong type for their_ts (expected int, got %s)" % type(their_ts)
+
+        # Check if we're the mode sender based on the UID / SID given.
+        our_mode = self.is_internal_client(sender) or self.is_internal_server(sender)
 
-        def _clear():
+        log.debug("(%s/%s) our_ts: %s; their_ts: %s; is the mode origin us? %s", self.name,
+                  channel, our_ts, their_ts, our_mode)
+
+        if their_ts == our_ts:
+            log.debug("(%s/%s) remote TS of %s is equal to our %s; mode query %s",
+                      self.name, channel, their_ts, our_ts, modes)
+            # Their TS is equal to ours. Merge modes.
+            return True
+
+        elif (their_ts < our_ts):
+            if their_ts < 750000:
+                if their_ts != 0:  # Sometimes unreal sends SJOIN with 0, don't warn for those
+                    if self.serverdata.get('ignore_ts_errors'):
+                        log.debug('(%s) Silently ignoring bogus TS %s on channel %s', self.name, their_ts, channel)
+                    else:
+                        log.warning('(%s) Possible desync? Not setting bogus TS %s on channel %s', self.name, their_ts, channel)
+            else:
+                log.debug('(%s) Resetting channel TS of %s from %s to %s (remote has lower TS)',
+                          self.name, channel, our_ts, their_ts)
+                self._channels[channel].ts = their_ts
+
+            # Remote TS was lower and we're receiving modes. Clear the modelist and apply theirs.
             log.debug("(%s) Clearing local modes from channel %s due to TS change", self.name,
                       channel)
-            self._channels[channel].modes.clear()
-            for p in self._channels[channel].prefixmodes.values():
+            chanobj = self._channels[channel]
+            chanobj.modes.clear()
+            for p in chanobj.prefixmodes.values():
                 for user in p.copy():
                     if not self.is_internal_client(user):
                         p.discard(user)
+            return True
+        return False
 
-        def _apply():
-            if modes:
-                log.debug("(%s) Applying modes on channel %s (TS ok)", self.name,
-                          channel)
-                self.apply_modes(channel, modes)
+    def join_users(self, sender, channel, members, their_ts, modes=None):
+        """
+        IRC specific: Joins many users to a channel at once, e.g. for SJOIN, FJOIN, or BURST.
+
+        members is an iterable of (UID, prefix mode characters) pairs, like ('001AAAAAB', 'ov').
+        modes is an optional list of other channel modes as returned by parse_modes(). The TS is
+        resolved once for the whole batch, as in updateTS(): the users' prefix modes and the
+        given modes are only applied if the remote TS is lower than or equal to ours.
+
+        Returns the list of UIDs joined, skipping ones that don't exist.
+        """
+        users = self.users
+        chanobj = self._channels[channel]
+        namelist = []
+        prefixed = []
+        for uid, prefixes in members:
+            if uid not in users:
+                log.debug('(%s) join_users: tried to join user %s not in our user list to %s, ignoring...',
+                          self.name, uid, channel)
+                continue
+            namelist.append(uid)
+            users[uid].channels.add(channel)
+            if prefixes:
+                prefixed.append((uid, prefixes))
+        chanobj.users.update(namelist)
 
-        # Use a lock so only one thread can change a channel's TS at once: this prevents race
-        # conditions that would otherwise desync channel modes.
         with self._ts_lock:
-            our_ts = self._channels[channel].ts
-            assert isinstance(our_ts, int), "Wrong type for our_ts (expected int, got %s)" % type(our_ts)
-            assert isinstance(their_ts, int), "Wrong type for their_ts (expected int, got %s)" % type(their_ts)
-
-            # Check if we're the mode sender based on the UID / SID given.
-            our_mode = self.is_internal_client(sender) or self.is_internal_server(sender)
-
-            log.debug("(%s/%s) our_ts: %s; their_ts: %s; is the mode origin us? %s", self.name,
-                      channel, our_ts, their_ts, our_mode)
-
-            if their_ts == our_ts:
-                log.debug("(%s/%s) remote TS of %s is equal to our %s; mode query %s",
-                          self.name, channel, their_ts, our_ts, modes)
-                # Their TS is equal to ours. Merge modes.
-                _apply()
-
-            elif (their_ts < our_ts):
-                if their_ts < 750000:
-                    if their_ts != 0:  # Sometimes unreal sends SJOIN with 0, don't warn for those
-                        if self.serverdata.get('ignore_ts_errors'):
-                            log.debug('(%s) Silently ignoring bogus TS %s on channel %s', self.name, their_ts, channel)
-                        else:
-                            log.warning('(%s) Possible desync? Not setting bogus TS %s on channel %s', self.name, their_ts, channel)
-                else:
-                    log.debug('(%s) Resetting channel TS of %s from %s to %s (remote has lower TS)',
-                              self.name, channel, our_ts, their_ts)
-                    self._channels[channel].ts = their_ts
+            if not self._resolve_ts(sender, channel, their_ts, modes):
+                return namelist
 
-                # Remote TS was lower and we're receiving modes. Clear the modelist and apply theirs.
+            if modes:
+                self.apply_modes(channel, modes)
 
-                _clear()
-                _apply()
+            # Map prefix mode characters to the channel's prefix mode sets, and fill them in bulk.
+            chars = self.cmode_table.chars
+            prefix_lists = {chars[name]: uids for name, uids in chanobj.prefixmodes.items()
+                            if name in chars}
+            for uid, prefixes in prefixed:
+                for char in prefixes:
+                    if char in prefix_lists:
+                        prefix_lists[char].add(uid)
+        return namelist
 
     def _check_nick_collision(self, nick):
         """
@@ -1717,6 +2014,18 @@ class PyLinkNetworkCoreWithUtils(PyLinkNetworkCore):
 # next cycle. Effectively the ping timeout is: pingfreq * (KEEPALIVE_MAX_MISSED + 1)
 KEEPALIVE_MAX_MISSED = 2
 
+# Default amount of bytes to read from the socket at once, configurable per server using the
+# "recv_size" option. A larger default ("burst_recv_size") is used until the network finishes bursting.
+RECV_SIZE = 4096
+BURST_RECV_SIZE = 65536
+
+# Default maximum amount of bytes the send queue will combine into one socket write, configurable
+# per server using the "send_batch_bytes" option. 16384 is the largest TLS record size.
+SEND_BATCH_BYTES = 16384
+
+# How long (in seconds) disconnect() waits for the send queue to write out what's left.
+QUEUE_DRAIN_TIMEOUT = 10
+
 class IRCNetwork(PyLinkNetworkCoreWithUtils):
     S2S_BUFSIZE = 510
 
@@ -1726,9 +2035,28 @@ class IRCNetwork(PyLinkNetworkCoreWithUtils):
         self._queue = None
         self._ping_timer = None
         self._socket = None
-        self._buffer = bytearray()
-        self._reconnect_thread = None
+        self._framer = structures.LineFramer()
+        self._reconnect_timer = None
         self._queue_thread = None
+        self._dispatch_thread = None
+
+        # Used instead of the above thread when running on the asyncio driver.
+        self._queue_task = None
+        self._queue_event = None
+        self._write_lock = None
+
+        # connector.ConnectAttempt objects describing the last connect
+        self.connect_attempts = []
+
+    @property
+    def _driver(self):
+        """Returns the socket driver module in use (selectdriver unless configured otherwise)."""
+        return world.driver or selectdriver
+
+    @property
+    def _is_async(self):
+        """Returns whether this network runs on the asyncio driver."""
+        return self._driver is asynciodriver
 
     def _init_vars(self, *args, **kwargs):
         super()._init_vars(*args, **kwargs)
@@ -1737,8 +2065,38 @@ class IRCNetwork(PyLinkNetworkCoreWithUtils):
         self.lastping = time.time()  # This actually tracks the last message received as of 2.0-alpha4
         self.pingfreq = self.serverdata.get('pingfreq') or 90
 
+        # Each send queue priority class has its own maximum depth; the bulk and interactive
+        # classes default to "maxsendq".
         self.maxsendq = self.serverdata.get('maxsendq', 4096)
-        self._queue = queue.Queue(self.maxsendq)
+        self._queue = structures.PrioritySendQueue([
+            (SENDQ_CONTROL, self.serverdata.get('maxsendq_control', 512)),
+            (SENDQ_INTERACTIVE, self.serverdata.get('maxsendq_interactive', self.maxsendq)),
+            (SENDQ_BULK, self.maxsendq)])
+
+        # Counters for socket writes made by the send queue, used to measure how well
+        # outgoing lines are batched.
+        self.write_stats = {'writes': 0, 'lines': 0, 'bytes': 0, 'max_lines': 0, 'max_bytes': 0}
+
+        # Send rate limiter, built from the server block by _get_throttle()
+        self._throttle = None
+        self._throttle_conf = None
+
+        # Output the socket couldn't take yet (selectdriver only). This is written out when the
+        # driver reports the socket as writable, and the send queue waits for it to drain.
+        self._outbuf = bytearray()
+        self._outbuf_lock = threading.Lock()
+        self._outbuf_drained = threading.Event()
+        self._outbuf_drained.set()
+        self._want_write = False
+
+        # When dispatch workers are enabled, incoming lines are handed over to a per-network
+        # thread, so that slow handlers (on this or any other network) never hold up reads.
+        self._dispatch_queue = None
+        if self.serverdata.get('dispatch_worker', conf.conf['pylink'].get('dispatch_workers', False)):
+            self._dispatch_queue = queue.SimpleQueue()
+        # Counters for the dispatch worker: lines processed, and how long the last line (and the
+        # slowest line) waited in the queue.
+        self.dispatch_stats = {'lines': 0, 'lag': 0, 'max_lag': 0}
 
     def _schedule_ping(self):
         """Schedules periodic pings in a loop."""
@@ -1753,10 +2111,7 @@ class IRCNetwork(PyLinkNetworkCoreWithUtils):
             self.disconnect()
             return
 
-        self._ping_timer = threading.Timer(self.pingfreq, self._schedule_ping)
-        self._ping_timer.daemon = True
-        self._ping_timer.name = 'Ping timer loop for %s' % self.name
-        self._ping_timer.start()
+        self._ping_timer = self._driver.call_later(self.pingfreq, self._schedule_ping)
 
         log.debug('(%s) Ping scheduled at %s', self.name, time.time())
 
@@ -1791,9 +2146,9 @@ class IRCNetwork(PyLinkNetworkCoreWithUtils):
 
         return context
 
-    def _setup_ssl(self):
+    def _setup_ssl(self, **kwargs):
         """
-        Initializes SSL/TLS for this network.
+        Initializes SSL/TLS for this network. Keyword arguments are passed on to wrap_socket().
         """
         log.info('(%s) Using TLS/SSL for this connection...', self.name)
         cafile = self.serverdata.get('ssl_cafile')
@@ -1813,7 +2168,7 @@ class IRCNetwork(PyLinkNetworkCoreWithUtils):
                                self.name)
                  raise
 
-        self._socket = context.wrap_socket(self._socket, server_hostname=self.serverdata.get('ip'))
+        self._socket = context.wrap_socket(self._socket, server_hostname=self.serverdata.get('ip'), **kwargs)
 
     def _verify_ssl(self):
         """
@@ -1853,6 +2208,87 @@ class IRCNetwork(PyLinkNetworkCoreWithUtils):
                          ' option in your server block.', self.name,
                          hashtype, fp)
 
+    def _get_dns_family(self):
+        """
+        Returns the address family to resolve the uplink's address with, based on the
+        "bindhost" and "ipv6" options.
+        """
+        if 'bindhost' in self.serverdata:
+            # Try detecting the socket type from the bindhost if specified.
+            force_ipv6 = utils.get_hostname_type(self.serverdata['bindhost']) == 2
+        else:
+            force_ipv6 = self.serverdata.get("ipv6")  # ternary value (None = use system default)
+
+        if force_ipv6 is True:
+            return socket.AF_INET6
+        elif force_ipv6 is False:
+            return socket.AF_INET
+        return socket.AF_UNSPEC
+
+    def _make_socket(self, family):
+        """
+        Creates a socket for the given address family to connect the network with, binding it
+        if applicable.
+        """
+        sock = socket.socket(family)
+        try:
+            self._set_socket_options(sock)
+
+            # Set the socket bind if applicable.
+            if 'bindhost' in self.serverdata:
+                sock.bind((self.serverdata['bindhost'], 0))
+        except:
+            sock.close()
+            raise
+        return sock
+
+    def _set_socket_options(self, sock):
+        """
+        Applies the socket options configured in the server block to the given socket: buffer
+        sizes, TCP_NODELAY, and TCP keepalive.
+        """
+        options = []
+        if self.serverdata.get('sndbuf'):
+            options.append((socket.SOL_SOCKET, socket.SO_SNDBUF, self.serverdata['sndbuf']))
+        if self.serverdata.get('rcvbuf'):
+            options.append((socket.SOL_SOCKET, socket.SO_RCVBUF, self.serverdata['rcvbuf']))
+        if 'tcp_nodelay' in self.serverdata:
+            options.append((socket.IPPROTO_TCP, socket.TCP_NODELAY, int(bool(self.serverdata['tcp_nodelay']))))
+        if 'tcp_keepalive' in self.serverdata:
+            options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, int(bool(self.serverdata['tcp_keepalive']))))
+
+            # Keepalive timings are only tunable on some platforms (e.g. Linux).
+            for confkey, optname in (('tcp_keepalive_idle', 'TCP_KEEPIDLE'),
+                                     ('tcp_keepalive_interval', 'TCP_KEEPINTVL'),
+                                     ('tcp_keepalive_count', 'TCP_KEEPCNT')):
+                if confkey not in self.serverdata:
+                    continue
+                elif hasattr(socket, optname):
+                    options.append((socket.IPPROTO_TCP, getattr(socket, optname), self.serverdata[confkey]))
+                else:
+                    log.warning('(%s) Ignoring option %s as it is not supported on this platform',
+                                self.name, confkey)
+
+        for level, optname, value in options:
+            try:
+                sock.setsockopt(level, optname, value)
+            except OSError:
+                log.warning('(%s) Failed to set socket option %s to %s', self.name, optname, value,
+                            exc_info=True)
+
+    def _warn_plaintext(self, ip):
+        """Warns about plain text connections to anywhere but localhost."""
+        if not ipaddress.ip_address(ip).is_loopback:
+            log.warning('(%s) This connection will be made via plain text, which is vulnerable '
+                        'to man-in-the-middle (MITM) attacks and passive eavesdropping. Consider '
+                        'enabling TLS/SSL with either certificate validation or fingerprint '
+                        'pinning to better secure your network traffic.', self.name)
+
+    def _log_connect_attempts(self, remote, port):
+        """Logs the timings of the connection attempts made by the last connect."""
+        for attempt in self.connect_attempts:
+            log.debug('(%s) Connection attempt to %s:%s: %s', self.name, remote, port, attempt)
+
     def _connect(self):
         """
         Connects to the network.
@@ -1861,121 +2297,176 @@ class IRCNetwork(PyLinkNetworkCoreWithUtils):
 
         remote = self.serverdata["ip"]
         port = self.serverdata["port"]
+        self.connect_attempts = attempts = []
         try:
-            if 'bindhost' in self.serverdata:
-                # Try detecting the socket type from the bindhost if specified.
-                force_ipv6 = utils.get_hostname_type(self.serverdata['bindhost']) == 2
-            else:
-                force_ipv6 = self.serverdata.get("ipv6")  # ternary value (None = use system default)
-
-            if force_ipv6 is True:
-                dns_stype = socket.AF_INET6
-            elif force_ipv6 is False:
-                dns_stype = socket.AF_INET
-            else:
-                dns_stype = socket.AF_UNSPEC
+            dns_stype = self._get_dns_family()
+            addrinfos = connector.resolve(remote, port, family=dns_stype, timeout=self.pingfreq)
 
-            dns_result = socket.getaddrinfo(remote, port, family=dns_stype)[0]
-            ip = dns_result[-1][0]
+            log.debug('(%s) Resolving address %s to %s (family=%s)', self.name, remote,
+                      [addrinfo[-1][0] for addrinfo in addrinfos], dns_stype)
+            log.info("Connecting to network %r on %s:%s", self.name, remote, port)
 
-            log.debug('(%s) Resolving address %s to %s (force_ipv6=%s)', self.name, remote, ip, force_ipv6)
+            # Race the resolved addresses, keeping whichever connects first.
+            self._socket, address = connector.connect(addrinfos, self._make_socket, self.pingfreq,
+                                                      attempts=attempts)
+            self._log_connect_attempts(remote, port)
+            ip = address[0]
+            log.info("(%s) Connected to %s:%s", self.name, ip, port)
 
-            # Create the actual socket.
-            self._socket = socket.socket(dns_result[0])
-
-            # Set the socket bind if applicable.
-            if 'bindhost' in self.serverdata:
-                self._socket.bind((self.serverdata['bindhost'], 0))
+            self._socket.settimeout(self.pingfreq)
 
-            # Enable SSL if set to do so.
+            # Enable SSL if set to do so. The handshake runs as part of wrapping the socket.
             self.ssl = self.serverdata.get('ssl')
             if self.ssl:
                 self._setup_ssl()
-            elif not ipaddress.ip_address(ip).is_loopback:
-                log.warning('(%s) This connection will be made via plain text, which is vulnerable '
-                            'to man-in-the-middle (MITM) attacks and passive eavesdropping. Consider '
-                            'enabling TLS/SSL with either certificate validation or fingerprint '
-                            'pinning to better secure your network traffic.', self.name)
+            else:
+                self._warn_plaintext(ip)
 
-            log.info("Connecting to network %r on %s:%s", self.name, ip, port)
+            self._finish_connect()
 
-            self._socket.settimeout(self.pingfreq)
+        # _run_irc() or the protocol module it called raised an exception, meaning we've disconnected
+        except:
+            if not any(attempt.succeeded for attempt in attempts):
+                self._log_connect_attempts(remote, port)
+            self._log_connection_error('(%s) Disconnected from IRC:', self.name, exc_info=True)
+            if not self._aborted.is_set():
+                self.disconnect()
 
-            # Start the actual connection
-            self._socket.connect((ip, port))
+    async def _connect_async(self):
+        """
+        Connects to the network (asyncio driver version of _connect()).
+        """
+        self._pre_connect()
 
-            if self not in world.networkobjects.values():
-                log.debug("(%s) _connect: disconnecting socket %s as the network was removed",
-                          self.name, self._socket)
-                try:
-                    self._socket.shutdown(socket.SHUT_RDWR)
-                finally:
-                    self._socket.close()
-                return
+        remote = self.serverdata["ip"]
+        port = self.serverdata["port"]
+        self.connect_attempts = attempts = []
+        try:
+            async with connector.get_async_limiter():
+                dns_stype = self._get_dns_family()
+                addrinfos = await asyncio.wait_for(
+                    connector.resolve_async(remote, port, family=dns_stype), self.pingfreq)
+
+                log.debug('(%s) Resolving address %s to %s (family=%s)', self.name, remote,
+                          [addrinfo[-1][0] for addrinfo in addrinfos], dns_stype)
+                log.info("Connecting to network %r on %s:%s", self.name, remote, port)
+
+                self._socket, address = await connector.connect_async(
+                    addrinfos, self._make_socket, self.pingfreq, attempts=attempts)
+                self._log_connect_attempts(remote, port)
+                ip = address[0]
+                log.info("(%s) Connected to %s:%s", self.name, ip, port)
+
+                # asyncio's socket functions don't take SSLSockets, so TLS is set up after connecting.
+                self.ssl = self.serverdata.get('ssl')
+                if self.ssl:
+                    self._setup_ssl(do_handshake_on_connect=False)
+                    await asyncio.wait_for(asynciodriver.do_handshake(self._socket), self.pingfreq)
+                else:
+                    self._warn_plaintext(ip)
 
-            # Make sure future reads never block, since select doesn't always guarantee this.
-            self._socket.setblocking(False)
+            self._finish_connect()
 
-            selectdriver.register(self)
+        except asyncio.CancelledError:
+            raise
+        except:
+            if not any(attempt.succeeded for attempt in attempts):
+                self._log_connect_attempts(remote, port)
+            self._log_connection_error('(%s) Disconnected from IRC:', self.name, exc_info=True)
+            if not self._aborted.is_set():
+                self.disconnect()
 
-            if self.ssl:
-                self._verify_ssl()
+    def _finish_connect(self):
+        """
+        Sets up a freshly connected socket: starts the send queue, and lets the protocol
+        module introduce our server.
+        """
+        if self not in world.networkobjects.values():
+            log.debug("(%s) _connect: disconnecting socket %s as the network was removed",
+                      self.name, self._socket)
+            try:
+                self._socket.shutdown(socket.SHUT_RDWR)
+            finally:
+                self._socket.close()
+            return
 
+        # Make sure future reads never block, since select doesn't always guarantee this.
+        self._socket.setblocking(False)
+
+        if self._dispatch_queue is not None:
+            self._dispatch_thread = threading.Thread(name="Dispatch thread for %s" % self.name,
+                                                     target=self._process_dispatch,
+                                                     args=(self._dispatch_queue,), daemon=True)
+            self._dispatch_thread.start()
+
+        self._driver.register(self)
+
+        if self.ssl:
+            self._verify_ssl()
+
+        if self._is_async:
+            self._queue_event = asyncio.Event()
+            self._write_lock = asyncio.Lock()
+            self._queue_task = asynciodriver.loop.create_task(self._process_queue_async())
+        else:
             self._queue_thread = threading.Thread(name="Queue thread for %s" % self.name,
-                                                 target=self._process_queue, daemon=True)
+                                                  target=self._process_queue, daemon=True)
             self._queue_thread.start()
 
-            self.sid = self.serverdata.get("sid")
-            # All our checks passed, get the protocol module to connect and run the listen
-            # loop. This also updates any SID values should the protocol module do so.
-            self.post_connect()
+        self.sid = self.serverdata.get("sid")
+        # All our checks passed, get the protocol module to connect and run the listen
+        # loop. This also updates any SID values should the protocol module do so.
+        self.post_connect()
+        self._update_mode_tables()
 
-            log.info('(%s) Enumerating our own SID %s', self.name, self.sid)
-            host = self.hostname()
+        log.info('(%s) Enumerating our own SID %s', self.name, self.sid)
+        host = self.hostname()
 
-            self.servers[self.sid] = Server(self, None, host, internal=True,
-                                            desc=self.serverdata.get('serverdesc')
-                                            or conf.conf['pylink']['serverdesc'])
+        self.servers[self.sid] = Server(self, None, host, internal=True,
+                                        desc=self.serverdata.get('serverdesc')
+                                        or conf.conf['pylink']['serverdesc'])
 
-            log.info('(%s) Starting ping schedulers....', self.name)
-            self._schedule_ping()
-            log.info('(%s) Server ready; listening for data.', self.name)
-            self.autoconnect_active_multiplier = 1  # Reset any extra autoconnect delays
-
-        # _run_irc() or the protocol module it called raised an exception, meaning we've disconnected
-        except:
-            self._log_connection_error('(%s) Disconnected from IRC:', self.name, exc_info=True)
-            if not self._aborted.is_set():
-                self.disconnect()
+        log.info('(%s) Starting ping schedulers....', self.name)
+        self._schedule_ping()
+        log.info('(%s) Server ready; listening for data.', self.name)
+        self.autoconnect_active_multiplier = 1  # Reset any extra autoconnect delays
 
     def connect(self):
         """
-        Starts a thread to connect the network.
+        Schedules the network to connect: in the shared connect thread pool, or as a coroutine
+        on the asyncio driver.
         """
-        connect_thread = threading.Thread(target=self._connect, daemon=True,
-                                          name="Connect thread for %s" %
-                                          self.name)
-        connect_thread.start()
+        if self._is_async:
+            asynciodriver.run_coroutine(self._connect_async())
+            return
+
+        connector.submit(self._connect)
 
     def disconnect(self):
         """Handle disconnects from the remote server."""
+        if self._is_async and not asynciodriver.in_loop():
+            # Socket and timer state is owned by the event loop, so hand this over to it.
+            asynciodriver.run_in_loop(self.disconnect)
+            return
+
         if self._aborted.is_set():
             return
 
         self._pre_disconnect()
 
-        # Stop the queue thread.
+        # Stop the queue thread, waking it up if it is waiting for the socket. The asyncio queue
+        # coroutine writes out what's still queued first, since it can't hold up disconnect().
         if self._queue is not None:
-            try:
-                # XXX: queue.Queue.queue isn't actually documented, so this is probably not reliable in the long run.
-                with self._queue.mutex:
-                    self._queue.queue[0] = None
-            except IndexError:
-                self._queue.put(None)
+            self._queue.stop(drain=self._is_async)
+        self._outbuf_drained.set()
+
+        # Stop the dispatch thread.
+        if self._dispatch_queue is not None:
+            self._dispatch_queue.put(None)
 
         if self._socket is not None:
             try:
-                selectdriver.unregister(self)
+                self._driver.unregister(self)
             except KeyError:
                 pass
             try:
@@ -1984,17 +2475,27 @@ class IRCNetwork(PyLinkNetworkCoreWithUtils):
             except:
                 log.debug('(%s) Error on socket shutdown:', self.name, exc_info=True)
 
-            log.debug('(%s) disconnect: waiting for write half of socket %s to shutdown', self.name, self._socket)
-            # Wait for the write half to shut down when applicable.
-            if self._queue_thread is None or self._aborted_send.wait(10):
-                log.debug('(%s) disconnect: closing socket %s', self.name, self._socket)
-                self._socket.close()
+            if self._is_async:
+                # We can't block the event loop waiting for the queue to finish, so the queue
+                # coroutine closes the socket once it's done.
+                if self._queue_task is not None and not self._queue_task.done():
+                    self._wake_queue()
+                    asynciodriver.finish_on_shutdown(self._queue_task)
+                else:
+                    log.debug('(%s) disconnect: closing socket %s', self.name, self._socket)
+                    self._socket.close()
+            else:
+                log.debug('(%s) disconnect: waiting for write half of socket %s to shutdown', self.name, self._socket)
+                # Wait for the write half to shut down when applicable.
+                if self._queue_thread is None or self._aborted_send.wait(10):
+                    log.debug('(%s) disconnect: closing socket %s', self.name, self._socket)
+                    self._socket.close()
 
         # Stop the ping timer.
         if self._ping_timer:
             log.debug('(%s) Canceling pingTimer at %s due to disconnect() call', self.name, time.time())
             self._ping_timer.cancel()
-        self._buffer.clear()
+        self._framer.clear()
         self._post_disconnect()
 
         # Clear old sockets.
@@ -2002,31 +2503,41 @@ class IRCNetwork(PyLinkNetworkCoreWithUtils):
 
         self._start_reconnect()
 
+    def _reconnect(self):
+        """Reconnects to the network once the autoconnect delay has passed."""
+        self._reconnect_timer = None
+        if self not in world.networkobjects.values():
+            log.debug('(%s) _reconnect: Stopping stale connect loop', self.name)
+            return
+        # connect() doesn't block, so this is fine to run from the driver loop.
+        self.connect()
+
     def _start_reconnect(self):
         """Schedules a reconnection to the network."""
-        def _reconnect():
-            # _run_autoconnect() will block and return True after the autoconnect
-            # delay has passed, if autoconnect is disabled. We do not want it to
-            # block whatever is calling disconnect() though, so we run it in a new
-            # thread.
-            if self._run_autoconnect():
-                self.connect()
-
         if self not in world.networkobjects.values():
             log.debug('(%s) _start_reconnect: Stopping reconnect timer as the network was removed', self.name)
+            if self._reconnect_timer is not None:
+                self._reconnect_timer.cancel()
+                self._reconnect_timer = None
             return
-        elif self._reconnect_thread is None or not self._reconnect_thread.is_alive():
-            self._reconnect_thread = threading.Thread(target=_reconnect, name="Reconnecting network %s" % self.name)
-            self._reconnect_thread.start()
-        else:
+        elif self._reconnect_timer is not None:
             log.debug('(%s) Ignoring attempt to reschedule reconnect as one is in progress.', self.name)
+            return
+
+        autoconnect = self._get_autoconnect_delay()
+        if autoconnect is not None:
+            # Clear the aborted flag while waiting, so that disconnect() calls (e.g. when the
+            # network is removed) still go through and cancel the reconnect.
+            self._aborted.clear()
+            self._reconnect_timer = self._driver.call_later(autoconnect, self._reconnect)
 
     def handle_events(self, line):
         raise NotImplementedError
 
     def parse_irc_command(self, line):
         """Sends a command to the protocol module."""
-        log.debug("(%s) <- %s", self.name, line)
+        if log.debug_enabled:
+            log.debug("(%s) <- %s", self.name, line)
         if not line:
             log.warning("(%s) Got empty line %r from IRC?", self.name, line)
             return
@@ -2048,6 +2559,26 @@ class IRCNetwork(PyLinkNetworkCoreWithUtils):
 
         return hook_args
 
+    def _process_dispatch(self, dispatch_queue):
+        """Loop to process incoming lines queued by _run_irc(), when dispatch workers are enabled."""
+        stats = self.dispatch_stats
+        while True:
+            item = dispatch_queue.get()
+            if item is None:
+                log.debug('(%s) Stopping dispatch thread due to getting None as item', self.name)
+                break
+            elif self._aborted.is_set() or dispatch_queue is not self._dispatch_queue:
+                # Lines left over from a connection that's gone are of no use anymore.
+                log.debug('(%s) Stopping dispatch thread since the connection is dead', self.name)
+                break
+
+            received, line = item
+            lag = time.monotonic() - received
+            stats['lines'] += 1
+            stats['lag'] = lag
+            stats['max_lag'] = max(stats['max_lag'], lag)
+            self.parse_irc_command(line)
+
     def _run_irc(self):
         """
         Message handler, called when select() has data to read.
@@ -2056,9 +2587,17 @@ class IRCNetwork(PyLinkNetworkCoreWithUtils):
             log.debug('(%s) Ignoring attempt to read data because self._socket is None', self.name)
             return
 
-        data = bytearray()
+        # Use a larger receive size while bursting, when the uplink sends us lots of data at once.
+        if self.connected.is_set():
+            recv_size = self.serverdata.get('recv_size', RECV_SIZE)
+        else:
+            recv_size = self.serverdata.get('burst_recv_size', BURST_RECV_SIZE)
+
         try:
-            data = self._socket.recv(2048)
+            count = self._framer.recv_from(self._socket, recv_size)
+            # TLS sockets may have decrypted data left over that select() won't tell us about.
+            while count and self.ssl and self._socket.pending():
+                count = self._framer.recv_from(self._socket, max(self._socket.pending(), recv_size))
         except (BlockingIOError, ssl.SSLWantReadError, ssl.SSLWantWriteError):
             log.debug('(%s) No data to read, trying again later...', self.name, exc_info=True)
             return
@@ -2069,24 +2608,31 @@ class IRCNetwork(PyLinkNetworkCoreWithUtils):
                 return
             raise
 
-        self._buffer += data
-        if not data:
+        if not count:
             self._log_connection_error('(%s) Connection lost, disconnecting.', self.name)
             self.disconnect()
             return
 
-        while b'\n' in self._buffer:
-            line, self._buffer = self._buffer.split(b'\n', 1)
-            line = line.strip(b'\r')
-            line = line.decode(self.encoding, "replace")
-            self.parse_irc_command(line)
+        if self._dispatch_queue is not None:
+            received = time.monotonic()
+            for line in self._framer.get_lines(self.encoding):
+                self._dispatch_queue.put((received, line))
+        else:
+            for line in self._framer.get_lines(self.encoding):
+                if self._aborted.is_set():
+                    # Stop if a line caused us to disconnect.
+                    break
+                self.parse_irc_command(line)
 
         # Update the last message received time
         self.lastping = time.time()
 
-    def _send(self, data):
-        """Sends raw text to the uplink server."""
-        if self._aborted.is_set() or self._socket is None:
+    def _encode_line(self, data, check_alive=True):
+        """
+        Encodes a line of outgoing text, returning None if the connection is dead (unless
+        check_alive is False).
+        """
+        if check_alive and (self._aborted.is_set() or self._socket is None):
             log.debug("(%s) Not sending message %r since the connection is dead", self.name, data)
             return
 
@@ -2098,64 +2644,257 @@ class IRCNetwork(PyLinkNetworkCoreWithUtils):
             encoded_data = encoded_data[:self.S2S_BUFSIZE]
         encoded_data += b"\r\n"
 
-        log.debug("(%s) -> %s", self.name, data)
+        if log.debug_enabled:
+            log.debug("(%s) -> %s", self.name, data)
+        return encoded_data
 
-        while True:
+    def _encode_lines(self, lines):
+        """
+        Encodes the given lines into one chunk of bytes, returning None if the connection is dead.
+        """
+        encoded_data = bytearray()
+        for line in lines:
+            encoded_line = self._encode_line(line)
+            if encoded_line is None:
+                return
+            encoded_data += encoded_line
+        return encoded_data
+
+    def _record_write(self, lines, nbytes):
+        """Updates the write statistics for one socket write."""
+        stats = self.write_stats
+        stats['writes'] += 1
+        stats['lines'] += lines
+        stats['bytes'] += nbytes
+        stats['max_lines'] = max(stats['max_lines'], lines)
+        stats['max_bytes'] = max(stats['max_bytes'], nbytes)
+
+    def _set_want_write(self, enabled):
+        """Tells the socket driver whether we have output waiting. Must be called with _outbuf_lock held."""
+        if enabled != self._want_write:
+            self._want_write = enabled
+            self._driver.set_write_interest(self, enabled)
+
+    def _write(self, data):
+        """
+        Writes data to the socket without blocking. Anything the socket can't take right now is
+        buffered and written once the driver reports the socket as writable.
+        """
+        with self._outbuf_lock:
             try:
-                self._socket.send(encoded_data)
-            except (BlockingIOError, ssl.SSLWantReadError, ssl.SSLWantWriteError):
-                # The send attempt failed, wait a little bit.
-                # I would prefer using a blocking socket and MSG_DONTWAIT in recv()'s flags
-                # but SSLSocket doesn't support that...
-                throttle_time = self.serverdata.get('throttle_time', 0)
-                if self._aborted.wait(throttle_time):
-                    break
-                continue
+                sent = 0
+                if not self._outbuf:
+                    try:
+                        sent = self._socket.send(data)
+                    except (BlockingIOError, ssl.SSLWantReadError, ssl.SSLWantWriteError):
+                        pass
+                if sent < len(data):
+                    # Non-blocking sockets may only take part of the data.
+                    self._outbuf += memoryview(data)[sent:]
+                    self._outbuf_drained.clear()
+                    self._set_want_write(True)
+                return True
             except:
-                log.exception("(%s) Failed to send message %r; aborting!", self.name, data)
-                self.disconnect()
+                log.exception("(%s) Failed to send data; aborting!", self.name)
+        self.disconnect()
+        return False
+
+    def _flush_outbuf(self):
+        """Writes out buffered output. This is called by the driver when the socket is writable."""
+        with self._outbuf_lock:
+            try:
+                if self._outbuf:
+                    sent = self._socket.send(self._outbuf)
+                    del self._outbuf[:sent]
+            except (BlockingIOError, ssl.SSLWantWriteError):
+                return
+            except ssl.SSLWantReadError:
+                # The TLS layer needs to read first, so retry once there is data to read instead
+                # of repeatedly waking up on a writable socket.
+                self._set_want_write(False)
+                return
+            except:
+                log.exception("(%s) Failed to send data; aborting!", self.name)
+            else:
+                if not self._outbuf:
+                    self._set_want_write(False)
+                    self._outbuf_drained.set()
                 return
+        self.disconnect()
+
+    def _send_lines(self, lines):
+        """Sends the given lines of raw text to the uplink server in one write."""
+        if self._is_async:
+            # The event loop owns the socket, so write through it instead.
+            asynciodriver.run_coroutine(self._send_lines_async(lines))
+            return
+
+        encoded_data = self._encode_lines(lines)
+        if encoded_data is None:
+            return
+
+        if self._write(encoded_data):
+            self._record_write(len(lines), len(encoded_data))
+
+    def _send(self, data):
+        """Sends raw text to the uplink server."""
+        self._send_lines([data])
+
+    async def _send_lines_async(self, lines):
+        """Sends the given lines of raw text in one write (asyncio driver version of _send_lines())."""
+        encoded_data = self._encode_lines(lines)
+        if encoded_data is None:
+            return
+
+        try:
+            await self._write_async(self._socket, encoded_data)
+        except:
+            log.exception("(%s) Failed to send message(s) %r; aborting!", self.name, lines)
+            self.disconnect()
+            return
+        self._record_write(len(lines), len(encoded_data))
+
+    async def _write_async(self, sock, data):
+        """
+        Writes all of data to the given socket (asyncio driver only). Writes are serialized, so
+        that data from different coroutines is never interleaved when the socket can't take all
+        of it at once.
+        """
+        async with self._write_lock:
+            view = memoryview(data)
+            while view:
+                try:
+                    sent = sock.send(view)
+                except (BlockingIOError, ssl.SSLWantWriteError):
+                    # Wait until the socket is writable instead of retrying on a timer.
+                    await asynciodriver.wait_writable(sock)
+                except ssl.SSLWantReadError:
+                    # Renegotiation in progress; the reader callback will drive it along.
+                    await asyncio.sleep(0.01)
+                else:
+                    view = view[sent:]
+
+    def _get_throttle(self):
+        """
+        Returns the SendThrottle limiting this network's send queue, or None if sending is
+        not rate limited. The throttle is rebuilt whenever the server block changes (e.g. on rehash).
+        """
+        if self._throttle_conf is not self.serverdata:
+            self._throttle_conf = self.serverdata
+            lines_per_sec = self.serverdata.get('throttle_lines_per_sec')
+            bytes_per_sec = self.serverdata.get('throttle_bytes_per_sec')
+
+            throttle_time = self.serverdata.get('throttle_time')
+            if throttle_time and not lines_per_sec:
+                # Legacy option: send one line every throttle_time seconds.
+                lines_per_sec = 1 / throttle_time
+
+            if lines_per_sec or bytes_per_sec:
+                log.debug('(%s) Throttling sends to %s lines/sec and %s bytes/sec', self.name,
+                          lines_per_sec, bytes_per_sec)
+                self._throttle = structures.SendThrottle(lines_per_sec, bytes_per_sec,
+                                                         burst=self.serverdata.get('throttle_burst', 1),
+                                                         burst_bytes=self.serverdata.get('throttle_burst_bytes'))
             else:
+                self._throttle = None
+        return self._throttle
+
+    def _get_throttle_delay(self):
+        """Returns how long (in seconds) the send queue must wait before sending its next line."""
+        throttle = self._get_throttle()
+        if throttle is None:
+            return 0
+        return throttle.get_delay()
+
+    def _get_send_batch(self, first):
+        """
+        Returns a tuple of (lines, stop): the given first line plus any other lines queued right
+        now, up to the "send_batch_bytes" budget, and whether the queue was told to stop.
+
+        When sending is throttled, the batch also stops once the rate limit is used up.
+        """
+        lines = [first]
+        throttle = self._get_throttle()
+        if throttle:
+            throttle.consume(len(first) + 2)
+
+        budget = self.serverdata.get('send_batch_bytes', SEND_BATCH_BYTES) - len(first)
+        while budget > 0 and not (throttle and throttle.get_delay()):
+            try:
+                data = self._queue.get_nowait()
+            except queue.Empty:
                 break
+            if data is None:
+                return lines, True
+            elif data:
+                lines.append(data)
+                # This counts characters, not bytes, but that's close enough for a budget.
+                budget -= len(data) + 2
+                if throttle:
+                    throttle.consume(len(data) + 2)
+        return lines, False
 
-    def send(self, data, queue=True):
-        """send() wrapper with optional queueing support."""
+    def _wake_queue(self):
+        """Wakes up the asyncio send queue coroutine."""
+        if self._queue_event is not None:
+            asynciodriver.run_in_loop(self._queue_event.set)
+
+    def send(self, data, queue=True, priority=None):
+        """
+        send() wrapper with optional queueing support.
+
+        priority sets the send queue priority class for queued data (one of SENDQ_CONTROL,
+        SENDQ_INTERACTIVE, SENDQ_BULK), and defaults to the one set by send_priority() or
+        SENDQ_BULK.
+        """
         if self._aborted.is_set():
             log.debug('(%s) refusing to queue data %r as self._aborted is set', self.name, data)
             return
         if queue:
+            priority = priority or _send_priority.get()
             # XXX: we don't really know how to handle blocking queues yet, so
             # it's better to not expose that yet.
             try:
-                self._queue.put_nowait(data)
+                self._queue.put_nowait(data, priority)
             except QUEUE_FULL:
-                log.error('(%s) Max SENDQ exceeded (%s), disconnecting!', self.name, self._queue.maxsize)
+                log.error('(%s) Max SENDQ exceeded (%s lines in the %s queue), disconnecting!', self.name,
+                          self._queue.maxsizes[priority], priority)
                 self.disconnect()
                 raise
+            if self._is_async:
+                self._wake_queue()
         else:
             self._send(data)
 
     def _process_queue(self):
         """Loop to process outgoing queue data."""
-        while True:
-            throttle_time = self.serverdata.get('throttle_time', 0)
-            if not self._aborted.wait(throttle_time):
-                data = self._queue.get()
-                if data is None:
-                    log.debug('(%s) Stopping queue thread due to getting None as item', self.name)
-                    break
-                elif self not in world.networkobjects.values():
-                    log.debug('(%s) Stopping stale queue thread; no longer matches world.networkobjects', self.name)
+        while not self._aborted.is_set():
+            data = self._queue.get()
+            if data is None:
+                log.debug('(%s) Stopping queue thread due to getting None as item', self.name)
+                break
+            elif self not in world.networkobjects.values():
+                log.debug('(%s) Stopping stale queue thread; no longer matches world.networkobjects', self.name)
+                break
+            elif self._aborted.is_set():
+                # The _aborted flag may have changed while we were waiting for an item,
+                # so check for it again.
+                log.debug('(%s) Stopping queue thread since the connection is dead', self.name)
+                break
+            elif data:
+                # Don't pile up more output while the socket is still busy with the last batch.
+                self._outbuf_drained.wait()
+                delay = self._get_throttle_delay()
+                if (delay and self._aborted.wait(delay)) or self._aborted.is_set():
                     break
-                elif self._aborted.is_set():
-                    # The _aborted flag may have changed while we were waiting for an item,
-                    # so check for it again.
-                    log.debug('(%s) Stopping queue thread since the connection is dead', self.name)
+                lines, stop = self._get_send_batch(data)
+                self._send_lines(lines)
+                if stop:
+                    log.debug('(%s) Stopping queue thread due to getting None as item', self.name)
                     break
-                elif data:
-                    self._send(data)
-            else:
-                break
+
+        if self._outbuf:
+            log.debug('(%s) _process_queue: dropping %s bytes of unsent output', self.name, len(self._outbuf))
 
         # Once we're done here, shut down the write part of the socket.
         if self._socket:
@@ -2163,6 +2902,81 @@ class IRCNetwork(PyLinkNetworkCoreWithUtils):
             self._socket.shutdown(socket.SHUT_WR)
         self._aborted_send.set()
 
+    async def _process_queue_async(self):
+        """Coroutine to process outgoing queue data (asyncio driver version of _process_queue())."""
+        # Keep our own references, since disconnect() clears them before we're done.
+        sendq, sock = self._queue, self._socket
+        # Lines taken from the queue but not sent when we stopped
+        leftover = []
+        while not self._aborted.is_set():
+            try:
+                data = sendq.get_nowait()
+            except queue.Empty:
+                # Sleep until send() tells us there is more data.
+                self._queue_event.clear()
+                await self._queue_event.wait()
+                continue
+
+            if data is None:
+                log.debug('(%s) Stopping queue coroutine due to getting None as item', self.name)
+                break
+            elif self not in world.networkobjects.values():
+                log.debug('(%s) Stopping stale queue coroutine; no longer matches world.networkobjects', self.name)
+                leftover.append(data)
+                break
+            elif data:
+                delay = self._get_throttle_delay()
+                if delay:
+                    await asyncio.sleep(delay)
+                    if self._aborted.is_set():
+                        leftover.append(data)
+                        break
+                lines, stop = self._get_send_batch(data)
+                await self._send_lines_async(lines)
+                if stop:
+                    log.debug('(%s) Stopping queue coroutine due to getting None as item', self.name)
+                    break
+
+        if self._aborted.is_set() or leftover:
+            # We're disconnecting (or the network was removed): write out anything still queued
+            # (e.g. SQUIT or QUIT messages), then close the socket.
+            try:
+                await asyncio.wait_for(self._drain_queue_async(sendq, sock, leftover),
+                                       QUEUE_DRAIN_TIMEOUT)
+            except asyncio.TimeoutError:
+                log.debug('(%s) _process_queue_async: timed out writing out the send queue', self.name)
+            except Exception:
+                log.debug('(%s) _process_queue_async: failed to write out the send queue', self.name,
+                          exc_info=True)
+            finally:
+                log.debug('(%s) _process_queue_async: closing socket %s', self.name, sock)
+                sock.close()
+        self._aborted_send.set()
+
+    async def _drain_queue_async(self, sendq, sock, lines):
+        """
+        Writes the given lines and those left in the send queue to the socket, up to the stop
+        marker that disconnect() placed after them.
+        """
+        while True:
+            try:
+                data = sendq.get_nowait()
+            except queue.Empty:
+                break
+            if data is None:
+                break
+            elif data:
+                lines.append(data)
+        if not lines:
+            return
+
+        log.debug('(%s) _process_queue_async: writing out %s queued line(s) before disconnecting',
+                  self.name, len(lines))
+        encoded_data = b''.join(self._encode_line(line, check_alive=False) for line in lines)
+        await self._write_async(sock, encoded_data)
+        self._record_write(len(lines), len(encoded_data))
+        sock.shutdown(socket.SHUT_WR)
+
     def wrap_message(self, source, target, text):
         """
         Wraps the given message text into multiple lines, and returns these as a list.
@@ -2255,6 +3069,18 @@ class Channel(TSObject, structures.CamelCaseToSnakeCase, structures.CopyWrapper)
     def __repr__(self):
         return 'Channel(%s)' % self.name
 
+    def snapshot(self):
+        """
+        Returns a copy of the channel's state. This is equivalent to deepcopy() on a standard
+        channel object, but much faster on large channels since it just copies the member, mode,
+        and prefix mode sets.
+        """
+        newobj = self.copy()
+        newobj.users = self.users.copy()
+        newobj.modes = self.modes.copy()
+        newobj.prefixmodes = {mode: uids.copy() for mode, uids in self.prefixmodes.items()}
+        return newobj
+
     def remove_user(self, target):
         """Removes a user from a channel."""
         for s in self.prefixmodes.values():
@@ -18,7 +18,7 @@ from collections import defaultdict
 from . import world
 
 __all__ = ['ConfigurationError', 'conf', 'confname', 'validate', 'load_conf',
-           'get_database_name']
+           'get_shard_suffix', 'get_database_name']
 
 
 class ConfigurationError(RuntimeError):
@@ -138,6 +138,16 @@ def load_conf(filename, errors_fatal=True, logger=None):
     else:
         return conf
 
+def get_shard_suffix():
+    """
+    Returns '-shard<number>' if this process is a shard worker (see shards.py), and an empty
+    string otherwise. This is appended to the names of databases and log files, so that shard
+    workers don't overwrite each others' files.
+    """
+    # This is set by the supervisor when starting workers (shards.ENV_SHARD).
+    shard = os.environ.get('PYLINK_SHARD')
+    return '' if shard is None else '-shard%s' % shard
+
 def get_database_name(dbname):
     """
     Returns a database filename with the given base DB name appropriate for the
@@ -146,8 +156,10 @@ def get_database_name(dbname):
     This returns '<dbname>.db' if the running config name is PyLink's default
     (pylink.yml), and '<dbname>-<config name>.db' for anything else. For example,
     if this is called from an instance running as 'pylink testing.yml', it
-    would return '<dbname>-testing.db'."""
+    would return '<dbname>-testing.db'. Shard workers get their own databases,
+    e.g. '<dbname>-shard1.db'."""
     if confname != 'pylink':
         dbname += '-%s' % confname
+    dbname += get_shard_suffix()
     dbname += '.db'
     return dbname
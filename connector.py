@@ -0,0 +1,327 @@
+"""
+connector.py - Outgoing connection helpers: parallel DNS resolution and "Happy Eyeballs"
+(RFC 8305) connection racing, with a global cap on concurrent connects.
+
+Both drivers share the same algorithm: selectdriver runs the blocking versions here in a bounded
+thread pool, while asynciodriver uses the coroutine versions on its event loop.
+"""
+
+import asyncio
+import concurrent.futures
+import errno
+import os
+import selectors
+import socket
+import threading
+import time
+
+from pylinkirc import conf
+
+__all__ = ['ConnectAttempt', 'interleave_addrinfo', 'resolve', 'resolve_async', 'connect',
+           'connect_async', 'submit', 'get_async_limiter']
+
+# RFC 8305 timings: how long to wait for AAAA results once A results are in, and how long to give
+# each connection attempt before starting the next one in parallel.
+RESOLUTION_DELAY = 0.05
+CONNECT_ATTEMPT_DELAY = 0.25
+
+DEFAULT_MAX_CONNECTS = 8
+
+_pool_lock = threading.Lock()
+_connect_pool = None
+_resolver_pool = None
+_async_limiter = None
+
+class ConnectAttempt():
+    """Records the timing and outcome of one connection attempt to one address."""
+    __slots__ = ('family', 'address', 'started', 'elapsed', 'error')
+
+    def __init__(self, family, address):
+        self.family = family
+        self.address = address
+        self.started = time.monotonic()
+        self.elapsed = None
+        self.error = None
+
+    def finish(self, error=None):
+        """Marks this attempt as finished, with the given exception if it failed."""
+        self.elapsed = time.monotonic() - self.started
+        self.error = error
+
+    @property
+    def succeeded(self):
+        return self.elapsed is not None and self.error is None
+
+    def __str__(self):
+        if self.elapsed is None:
+            status = 'pending'
+        elif self.error is None:
+            status = 'ok'
+        else:
+            status = getattr(self.error, 'strerror', None) or type(self.error).__name__
+        elapsed = '%.1fms' % (self.elapsed * 1000) if self.elapsed is not None else '?'
+        return '%s (%s, %s)' % (self.address[0], status, elapsed)
+
+    __repr__ = __str__
+
+def _get_max_connects():
+    return max(conf.conf['pylink'].get('max_concurrent_connects', DEFAULT_MAX_CONNECTS), 1)
+
+def submit(func, *args):
+    """
+    Runs func(*args) in the shared connect thread pool, which caps how many networks can be
+    connecting at once (pylink::max_concurrent_connects). Returns a concurrent.futures.Future.
+    """
+    global _connect_pool, _resolver_pool
+    with _pool_lock:
+        if _connect_pool is None:
+            max_connects = _get_max_connects()
+            _connect_pool = concurrent.futures.ThreadPoolExecutor(
+                max_workers=max_connects, thread_name_prefix='Connect thread')
+            # Each connect does up to two lookups at once; keeping these in a separate pool
+            # prevents connects from starving their own lookups.
+            _resolver_pool = concurrent.futures.ThreadPoolExecutor(
+                max_workers=max_connects * 2, thread_name_prefix='Resolver thread')
+    return _connect_pool.submit(func, *args)
+
+def get_async_limiter():
+    """
+    Returns the asyncio.Semaphore capping concurrent connects on the asyncio driver.
+    """
+    global _async_limiter
+    if _async_limiter is None:
+        _async_limiter = asyncio.Semaphore(_get_max_connects())
+    return _async_limiter
+
+def interleave_addrinfo(addrinfos):
+    """
+    Sorts getaddrinfo() results for connecting as RFC 8305 section 4 suggests: alternating between
+    address families, starting with the family of the first result.
+    """
+    by_family = {}
+    for addrinfo in addrinfos:
+        by_family.setdefault(addrinfo[0], []).append(addrinfo)
+
+    result = []
+    families = list(by_family.values())
+    while families:
+        for addrs in families:
+            result.append(addrs.pop(0))
+        families = [addrs for addrs in families if addrs]
+    return result
+
+def _dedupe(addrinfos):
+    """Removes duplicate addresses from getaddrinfo() results, keeping the first of each."""
+    seen = set()
+    result = []
+    for addrinfo in addrinfos:
+        if addrinfo[4] not in seen:
+            seen.add(addrinfo[4])
+            result.append(addrinfo)
+    return result
+
+def _collect(results):
+    """
+    Merges finished lookups given as (family, result or exception) pairs, IPv6 first. Raises the
+    first error if no lookup succeeded.
+    """
+    addrinfos = []
+    errors = []
+    for _, result in results:
+        if isinstance(result, BaseException):
+            errors.append(result)
+        else:
+            addrinfos += result
+    if not addrinfos:
+        raise errors[0] if errors else socket.gaierror(socket.EAI_NONAME, 'No addresses found')
+    return interleave_addrinfo(_dedupe(addrinfos))
+
+def resolve(host, port, family=socket.AF_UNSPEC, timeout=None):
+    """
+    Resolves the given host, returning getaddrinfo() results ordered for connect().
+
+    When no family is given, A and AAAA lookups run in parallel. Once the A results arrive, AAAA
+    results are only waited on for RESOLUTION_DELAY seconds.
+    """
+    if family != socket.AF_UNSPEC:
+        return _collect([(family, socket.getaddrinfo(host, port, family, socket.SOCK_STREAM))])
+    if _resolver_pool is None:  # Not running inside submit(), e.g. in tests
+        return _collect([(family, socket.getaddrinfo(host, port, family, socket.SOCK_STREAM))])
+
+    # The timeout covers the whole resolution, not each wait below.
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    futures = {fam: _resolver_pool.submit(socket.getaddrinfo, host, port, fam, socket.SOCK_STREAM)
+               for fam in (socket.AF_INET6, socket.AF_INET)}
+    concurrent.futures.wait(futures.values(), timeout, return_when=concurrent.futures.FIRST_COMPLETED)
+    if futures[socket.AF_INET].done() and not futures[socket.AF_INET6].done():
+        concurrent.futures.wait([futures[socket.AF_INET6]], RESOLUTION_DELAY)
+    elif not futures[socket.AF_INET].done():
+        remaining = max(deadline - time.monotonic(), 0) if deadline is not None else None
+        concurrent.futures.wait(futures.values(), remaining)
+
+    results = []
+    for fam, future in futures.items():
+        if future.done():
+            results.append((fam, future.exception() or future.result()))
+        else:
+            future.cancel()
+    if not results:
+        raise socket.timeout('Timed out resolving %s' % host)
+    return _collect(results)
+
+async def resolve_async(host, port, family=socket.AF_UNSPEC):
+    """
+    Coroutine version of resolve(), using the running event loop's resolver.
+    """
+    loop = asyncio.get_running_loop()
+    if family != socket.AF_UNSPEC:
+        return _collect([(family, await loop.getaddrinfo(host, port, family=family,
+                                                         type=socket.SOCK_STREAM))])
+
+    tasks = {fam: asyncio.ensure_future(loop.getaddrinfo(host, port, family=fam, type=socket.SOCK_STREAM))
+             for fam in (socket.AF_INET6, socket.AF_INET)}
+    try:
+        await asyncio.wait(tasks.values(), return_when=asyncio.FIRST_COMPLETED)
+        if tasks[socket.AF_INET].done() and not tasks[socket.AF_INET6].done():
+            await asyncio.wait([tasks[socket.AF_INET6]], timeout=RESOLUTION_DELAY)
+        elif not tasks[socket.AF_INET].done():
+            await asyncio.wait(tasks.values())
+    finally:
+        for task in tasks.values():
+            task.cancel()
+
+    return _collect([(fam, task.exception() or task.result()) for fam, task in tasks.items()
+                     if task.done() and not task.cancelled()])
+
+def _connect_error(attempts, timeout=False):
+    """Returns the exception to raise when every connection attempt failed."""
+    if timeout:
+        return socket.timeout('Connection timed out (attempts: %s)' % attempts)
+    errors = [attempt.error for attempt in attempts if attempt.error]
+    if len(errors) == 1:
+        return errors[0]
+    return OSError('All connection attempts failed: %s' % attempts)
+
+def connect(addrinfos, make_socket, timeout, attempts=None, attempt_delay=CONNECT_ATTEMPT_DELAY):
+    """
+    Connects to the first address in addrinfos that answers, racing addresses RFC 8305 style: a
+    new attempt starts whenever the previous one fails or hasn't finished within attempt_delay
+    seconds, and the first attempt to succeed wins.
+
+    make_socket(family) should return a new socket for an attempt. Each attempt is recorded into
+    the attempts list if one is given. Returns a (socket, address) tuple; the socket is left in
+    non-blocking mode.
+    """
+    if attempts is None:
+        attempts = []
+    pending = list(addrinfos)
+    deadline = time.monotonic() + timeout
+    next_start = 0
+    selector = selectors.DefaultSelector()
+    try:
+        while pending or selector.get_map():
+            now = time.monotonic()
+            if now >= deadline:
+                raise _connect_error(attempts, timeout=True)
+
+            if pending and (now >= next_start or not selector.get_map()):
+                family, _, _, _, address = pending.pop(0)
+                attempt = ConnectAttempt(family, address)
+                attempts.append(attempt)
+                sock = None
+                try:
+                    sock = make_socket(family)
+                    sock.setblocking(False)
+                    err = sock.connect_ex(address)
+                    if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+                        raise OSError(err, os.strerror(err))
+                except OSError as e:
+                    attempt.finish(e)
+                    if sock is not None:
+                        sock.close()
+                    continue
+                selector.register(sock, selectors.EVENT_WRITE, attempt)
+                next_start = now + attempt_delay
+
+            if not selector.get_map():
+                continue
+
+            wait = deadline - now
+            if pending:
+                wait = min(wait, max(next_start - now, 0))
+            for key, _ in selector.select(wait):
+                sock, attempt = key.fileobj, key.data
+                selector.unregister(sock)
+                err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                if err:
+                    attempt.finish(OSError(err, os.strerror(err)))
+                    sock.close()
+                    # Start the next attempt right away instead of waiting out the delay.
+                    next_start = 0
+                else:
+                    attempt.finish()
+                    return sock, attempt.address
+
+        raise _connect_error(attempts)
+    finally:
+        for key in list(selector.get_map().values()):
+            key.data.finish(InterruptedError('cancelled'))
+            key.fileobj.close()
+        selector.close()
+
+async def connect_async(addrinfos, make_socket, timeout, attempts=None, attempt_delay=CONNECT_ATTEMPT_DELAY):
+    """
+    Coroutine version of connect(), using the running event loop.
+    """
+    loop = asyncio.get_running_loop()
+    if attempts is None:
+        attempts = []
+    pending = list(addrinfos)
+    tasks = set()
+    deadline = loop.time() + timeout
+
+    async def _attempt(family, address, attempt):
+        sock = None
+        try:
+            sock = make_socket(family)
+            sock.setblocking(False)
+            await loop.sock_connect(sock, address)
+        except BaseException as e:
+            attempt.finish(e)
+            if sock is not None:
+                sock.close()
+            raise
+        attempt.finish()
+        return sock
+
+    try:
+        while pending or tasks:
+            if pending:
+                family, _, _, _, address = pending.pop(0)
+                attempt = ConnectAttempt(family, address)
+                attempts.append(attempt)
+                tasks.add(asyncio.ensure_future(_attempt(family, address, attempt)))
+
+            wait = deadline - loop.time()
+            if wait <= 0:
+                raise _connect_error(attempts, timeout=True)
+            if pending:
+                wait = min(wait, attempt_delay)
+
+            done, tasks = await asyncio.wait(tasks, timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+            winner = None
+            for task in done:
+                if task.exception() is None:
+                    if winner is None:
+                        winner = task.result()
+                    else:  # Lost a tie
+                        task.result().close()
+            if winner is not None:
+                return winner, winner.getpeername()
+
+        raise _connect_error(attempts)
+    finally:
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.wait(tasks)
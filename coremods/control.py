@@ -6,8 +6,9 @@ import os
 import signal
 import threading
 
-from pylinkirc import conf, utils, world  # Do not import classes, it'll import loop
-from pylinkirc.log import _get_console_log_level, _make_file_logger, _stop_file_loggers, log
+from pylinkirc import conf, shards, utils, world  # Do not import classes, it'll import loop
+from pylinkirc.log import (_get_console_log_level, _make_file_logger, _stop_file_loggers, _stop_log_writer,
+                           _update_log_level, _update_log_writer, log)
 
 from . import login
 
@@ -37,19 +38,23 @@ def _remove_pid():
         log.debug('Not removing PID file %s as world._should_remove_pid is False.' % pidfile)
 
 def _kill_plugins(irc=None):
-    if not world.plugins:
-        # No plugins were loaded or we were in a pre-initialized state, ignore.
-        return
-
-    log.info("Shutting down plugins.")
-    for name, plugin in world.plugins.items():
-        # Before closing connections, tell all plugins to shutdown cleanly first.
-        if hasattr(plugin, 'die'):
-            log.debug('coremods.control: Running die() on plugin %s due to shutdown.', name)
-            try:
-                plugin.die(irc=irc)
-            except:  # But don't allow it to crash the server.
-                log.exception('coremods.control: Error occurred in die() of plugin %s, skipping...', name)
+    try:
+        if not world.plugins:
+            # No plugins were loaded or we were in a pre-initialized state, ignore.
+            return
+
+        log.info("Shutting down plugins.")
+        for name, plugin in world.plugins.items():
+            # Before closing connections, tell all plugins to shutdown cleanly first.
+            if hasattr(plugin, 'die'):
+                log.debug('coremods.control: Running die() on plugin %s due to shutdown.', name)
+                try:
+                    plugin.die(irc=irc)
+                except:  # But don't allow it to crash the server.
+                    log.exception('coremods.control: Error occurred in die() of plugin %s, skipping...', name)
+    finally:
+        # Write out any queued log messages; anything logged after this is written directly.
+        _stop_log_writer()
 
 # We use atexit to register certain functions so that when PyLink cleans up after itself if it
 # shuts down because all networks have been disconnected.
@@ -64,9 +69,14 @@ def shutdown(irc=None):
 
     world.shutting_down.set()
 
+    # In sharded mode, shut down the other shards as well.
+    shards.notify_supervisor('shutdown')
+
     # HACK: run the _kill_plugins trigger with the current IRC object. XXX: We should really consider removing this
     # argument, since no plugins actually use it to do anything.
     atexit.unregister(_kill_plugins)
+    # Let pooled hooks finish before plugins are shut down.
+    utils._shutdown_hook_pool()
     _kill_plugins(irc=irc)
 
     # Remove our main PyLink bot as well.
@@ -79,6 +89,10 @@ def shutdown(irc=None):
         except NotImplementedError:
             continue
 
+    # Wake up the socket driver, so that it stops right away instead of on its next event.
+    if world.driver:
+        world.driver.wakeup()
+
     log.info("Waiting for remaining threads to stop; this may take a few seconds. If PyLink freezes "
              "at this stage, press Ctrl-C to force a shutdown.")
     _print_remaining_threads()
@@ -99,6 +113,10 @@ def rehash():
     old_conf = conf.conf.copy()
     fname = conf.fname
     new_conf = conf.load_conf(fname, errors_fatal=False, logger=log)
+    if shards.is_worker():
+        # Only keep the networks belonging to this shard, and rehash the other shards too.
+        new_conf['servers'] = shards.assign_servers(new_conf['servers'])
+        shards.notify_supervisor('rehash')
     conf.conf = new_conf
 
     # Reset any file logger options.
@@ -110,6 +128,9 @@ def rehash():
 
     log.debug('rehash: updating console log level')
     world.console_handler.setLevel(_get_console_log_level())
+    _update_log_level()
+    _update_log_writer()
+    utils._update_hook_profiling()
     login._make_cryptcontext()  # refresh password hashing settings
 
     for network, ircobj in world.networkobjects.copy().items():
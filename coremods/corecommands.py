@@ -94,15 +94,7 @@ def unload(irc, source, args):
                         del world.services['pylink'].commands[cmdname]
 
         # Remove any command hooks set by the plugin.
-        for hookname, hookpairs in world.hooks.copy().items():
-            for hookpair in hookpairs:
-                hookfunc = hookpair[1]
-                if hookfunc.__module__ == modulename:
-                    log.debug('Trying to remove hook func %s (%s) from plugin %s', hookfunc, hookname, modulename)
-                    world.hooks[hookname].remove(hookpair)
-                    # If the hookfuncs list is empty, remove it.
-                    if not hookpairs:
-                        del world.hooks[hookname]
+        utils.remove_hooks(lambda hookfunc: hookfunc.__module__ == modulename)
 
         # Call the die() function in the plugin, if present.
         if hasattr(pl, 'die'):
@@ -164,4 +156,4 @@ def clearqueue(irc, source, args):
 
     Clears the outgoing text queue for the current connection."""
     permissions.check_permissions(irc, source, ['core.clearqueue'])
-    irc._queue.queue.clear()
+    irc._queue.clear()
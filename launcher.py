@@ -20,8 +20,11 @@ args = {}
 def _main():
     conf.load_conf(args.config)
 
-    from pylinkirc.log import log
-    from pylinkirc import classes, utils, coremods, selectdriver
+    from pylinkirc.log import log, _remove_handler, _update_log_writer
+    from pylinkirc import classes, utils, coremods, selectdriver, asynciodriver, shards
+
+    # Shard workers are started by a supervisor (see below), which also owns the PID file.
+    is_shard_worker = shards.start_worker()
 
     # Write and check for an existing PID file unless specifically told not to.
     if not args.no_pid:
@@ -101,7 +104,7 @@ def _main():
             sys.exit(1)
         else:
             log.info('Forking into the background.')
-            log.removeHandler(world.console_handler)
+            _remove_handler(world.console_handler)
 
             # Adapted from https://stackoverflow.com/questions/5975124/
             if os.fork():
@@ -127,6 +130,31 @@ def _main():
         with open(pidfile, 'w') as f:
             f.write(str(os.getpid()))
 
+    # In sharded mode, this process only supervises the worker processes that connect to networks.
+    # The number of shards can't be changed on rehash either.
+    shard_count = shards.get_shard_count()
+    if shard_count > 1 and not is_shard_worker:
+        if os.name != 'posix':
+            log.error('Sharding requires Unix sockets, which are not supported on this platform; '
+                      'running all networks in one process instead.')
+        else:
+            shards.Supervisor(args.config, shard_count).run()
+            return
+
+    # Pick the socket driver. This can't be changed on rehash, so it is only read here.
+    drivername = conf.conf['pylink'].get('driver', 'select')
+    if drivername == 'asyncio':
+        world.driver = asynciodriver
+    else:
+        if drivername != 'select':
+            log.warning('Unknown socket driver %r, falling back to "select"', drivername)
+        world.driver = selectdriver
+    log.debug('Using socket driver %s', world.driver.__name__)
+
+    # Start the log writer thread (if enabled) only after forking, since threads don't survive it.
+    _update_log_writer()
+    utils._update_hook_profiling()
+
     # Load configured plugins
     to_load = conf.conf['plugins']
     utils._reset_module_dirs()
@@ -163,7 +191,7 @@ def _main():
 
     world.started.set()
     log.info("Loaded plugins: %s", ', '.join(sorted(world.plugins.keys())))
-    selectdriver.start()
+    world.driver.start()
 
 def main():
     import argparse
@@ -9,6 +9,8 @@ access the global logger object by importing "log" from this module
 import logging
 import logging.handlers
 import os
+import queue
+import threading
 
 from . import conf, world
 
@@ -17,6 +19,9 @@ __all__ = ['log']
 # Stores a list of active file loggers.
 fileloggers = []
 
+# Stores the asynchronous log writer, if enabled.
+_log_writer = None
+
 # TODO: perhaps make this format configurable?
 _format = '%(asctime)s [%(levelname)s] %(message)s'
 logformatter = logging.Formatter(_format)
@@ -37,10 +42,50 @@ world.console_handler.setLevel(_get_console_log_level())
 log = logging.getLogger('pylinkirc')
 log.addHandler(world.console_handler)
 
-# This is confusing, but we have to set the root logger to accept all events. Only this way
-# can other loggers filter out events on their own, instead of having everything dropped by
-# the root logger. https://stackoverflow.com/questions/16624695
-log.setLevel(1)
+def _get_min_level(handlers):
+    """
+    Returns the lowest level of the given log handlers, or WARNING if there are none.
+    """
+    # Handlers without a level (NOTSET) take everything. Without any handlers, only the
+    # warnings that logging's last resort handler prints are needed.
+    return min((handler.level for handler in handlers), default=logging.WARNING)
+
+def _update_log_level():
+    """
+    Sets the main logger's level to the lowest level of its handlers, so that messages no handler
+    would log are dropped before a log record is even created. This must be called whenever
+    handlers are added or removed, or their levels change.
+
+    This also updates log.debug_enabled, which code in hot paths can check before building
+    expensive debug messages.
+    """
+    if _log_writer:
+        _log_writer.setLevel(_get_min_level(_log_writer.targets))
+    level = _get_min_level(log.handlers)
+    log.setLevel(max(level, 1))
+    log.debug_enabled = log.isEnabledFor(logging.DEBUG)
+
+_update_log_level()
+
+def _add_handler(handler):
+    """
+    Adds a console or file log handler, passing it records through the log writer if enabled.
+    """
+    if _log_writer:
+        _log_writer.add_target(handler)
+    else:
+        log.addHandler(handler)
+    _update_log_level()
+
+def _remove_handler(handler):
+    """
+    Removes a console or file log handler added by _add_handler().
+    """
+    if _log_writer:
+        _log_writer.remove_target(handler)
+    else:
+        log.removeHandler(handler)
+    _update_log_level()
 
 def _make_file_logger(filename, level=None):
     """
@@ -55,8 +100,8 @@ def _make_file_logger(filename, level=None):
     os.makedirs(logdir, exist_ok=True)
 
     # Use log names specific to the current instance, to prevent multiple
-    # PyLink instances from overwriting each others' log files.
-    target = os.path.join(logdir, '%s-%s.log' % (conf.confname, filename))
+    # PyLink instances (or shards) from overwriting each others' log files.
+    target = os.path.join(logdir, '%s%s-%s.log' % (conf.confname, conf.get_shard_suffix(), filename))
 
     logrotconf = logconf.get('filerotation', {})
 
@@ -74,7 +119,7 @@ def _make_file_logger(filename, level=None):
     level = level or _get_console_log_level()
     filelogger.setLevel(level)
 
-    log.addHandler(filelogger)
+    _add_handler(filelogger)
     global fileloggers
     fileloggers.append(filelogger)
 
@@ -85,9 +130,12 @@ def _stop_file_loggers():
     De-initializes all file loggers.
     """
     global fileloggers
+    if _log_writer:
+        # Write out queued messages before closing the files.
+        _log_writer.queue.join()
     for handler in fileloggers.copy():
+        _remove_handler(handler)
         handler.close()
-        log.removeHandler(handler)
         fileloggers.remove(handler)
 
 # Set up file logging now, creating a file logger for each block.
@@ -127,7 +175,7 @@ class PyLinkChannelLogger(logging.Handler):
 
         # HACK: Use setLevel twice to first coerse string log levels to ints,
         # for easier comparison.
-        level = level or log.getEffectiveLevel()
+        level = level or logging.INFO
         self.setLevel(level)
 
         # Log level has to be at least 20 (INFO) to prevent loops due
@@ -160,3 +208,178 @@ class PyLinkChannelLogger(logging.Handler):
                     return
                 else:
                     self.called = False
+
+class PyLinkLogWriter(logging.handlers.QueueHandler):
+    """
+    Log handler that passes records to a background thread through a bounded queue. The thread
+    writes them to the wrapped target handlers, keeping file and console I/O off of the threads
+    doing the logging.
+
+    When the queue is mostly full, DEBUG records are dropped to make room for more important ones;
+    when it is completely full, all records are dropped. Dropped records are counted in
+    self.dropped and reported by the writer thread.
+    """
+    # Max amount of records to write per wakeup of the writer thread.
+    BATCH_SIZE = 256
+
+    def __init__(self, maxsize=10000):
+        super().__init__(queue.Queue(maxsize))
+        self.maxsize = maxsize
+        self.debug_limit = maxsize * 9 // 10
+        # Target handlers are replaced rather than modified, so that the writer thread can
+        # iterate over them without locking.
+        self.targets = ()
+        self.dropped = 0
+        self._reported_dropped = 0
+        self._dropped_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name='PyLink log writer', daemon=True)
+
+    def add_target(self, handler):
+        """Adds a handler to write records to."""
+        self.targets += (handler,)
+
+    def remove_target(self, handler):
+        """Removes a handler to write records to."""
+        self.targets = tuple(target for target in self.targets if target is not handler)
+
+    def prepare(self, record):
+        """
+        Merges the record's message and arguments, so that arguments changed after logging are
+        not seen by the writer thread. Formatting is left to the target handlers.
+        """
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        """
+        Queues a record for the writer thread, dropping it if the queue is full.
+        """
+        if record.levelno <= logging.DEBUG and self.queue.qsize() >= self.debug_limit:
+            self._drop()
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self._drop()
+
+    def _drop(self):
+        with self._dropped_lock:
+            self.dropped += 1
+
+    def _write(self, record):
+        """Writes a record to all target handlers that accept its level."""
+        for handler in self.targets:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+    def _report_dropped(self):
+        """Logs the amount of records dropped since the last report, if any."""
+        dropped = self.dropped - self._reported_dropped
+        if dropped:
+            self._reported_dropped += dropped
+            self._write(log.makeRecord(log.name, logging.WARNING, __file__, 0,
+                                       'Dropped %s log message(s) because the log queue was full '
+                                       '(%s dropped in total)', (dropped, self._reported_dropped), None))
+
+    def _run(self):
+        """Main loop for the writer thread."""
+        running = True
+        while running:
+            batch = [self.queue.get()]
+            try:
+                while len(batch) < self.BATCH_SIZE:
+                    batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+
+            for record in batch:
+                if record is None:  # Sent by stop()
+                    running = False
+                    continue
+                try:
+                    self._write(record)
+                except Exception:
+                    self.handleError(record)
+            self._report_dropped()
+
+            for _ in batch:
+                self.queue.task_done()
+
+    def start(self):
+        """Starts the writer thread."""
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        """
+        Stops the writer thread after it writes all queued records, waiting up to timeout seconds.
+        Records queued after this are written from the calling thread.
+        """
+        if self._thread.is_alive():
+            try:
+                self.queue.put(None, timeout=timeout)
+            except queue.Full:
+                pass
+            else:
+                self._thread.join(timeout)
+
+        # Write out anything that came in after the writer thread stopped.
+        while not self._thread.is_alive():
+            try:
+                record = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if record is not None:
+                self._write(record)
+        self._report_dropped()
+
+def _start_log_writer(maxsize=10000):
+    """
+    Starts writing console and file logs from a background thread.
+    """
+    global _log_writer
+    if _log_writer:
+        return
+    targets = [handler for handler in log.handlers
+               if handler is world.console_handler or handler in fileloggers]
+
+    writer = PyLinkLogWriter(maxsize)
+    for handler in targets:
+        writer.add_target(handler)
+    writer.start()
+
+    log.addHandler(writer)
+    for handler in targets:
+        log.removeHandler(handler)
+    _log_writer = writer
+    _update_log_level()
+    log.debug('log: Started asynchronous log writer with queue size %s', maxsize)
+
+def _stop_log_writer():
+    """
+    Writes out any queued log messages and goes back to logging synchronously.
+    """
+    global _log_writer
+    writer = _log_writer
+    if not writer:
+        return
+
+    # Send new records straight to the handlers, then wait for the queue to drain.
+    for handler in writer.targets:
+        log.addHandler(handler)
+    log.removeHandler(writer)
+    _log_writer = None
+    _update_log_level()
+
+    writer.stop()
+
+def _update_log_writer():
+    """
+    Starts or stops the asynchronous log writer depending on the "logging::async" option.
+    """
+    logconf = conf.conf['logging']
+    maxsize = logconf.get('async_queue_size') or 10000
+    if _log_writer and (_log_writer.maxsize != maxsize or not logconf.get('async')):
+        _stop_log_writer()
+    if logconf.get('async'):
+        _start_log_writer(maxsize)
@@ -5,6 +5,7 @@ import time
 from pylinkirc import __version__, conf, real_version, utils, world
 from pylinkirc.coremods import permissions
 from pylinkirc.coremods.login import pwd_context
+from pylinkirc.log import _update_log_level
 
 default_permissions = {"*!*@*": ['commands.status', 'commands.showuser', 'commands.showchan', 'commands.shownet']}
 
@@ -187,6 +188,9 @@ def shownet(irc, source, args):
 
         if serverdata.get('ip'):
             irc.reply('\x02Server target\x02: \x1f%s:%s' % (serverdata['ip'], serverdata.get('port')))
+        if netobj and getattr(netobj, 'connect_attempts', None):
+            irc.reply('\x02Last connection attempts\x02: %s' %
+                      ', '.join(map(str, netobj.connect_attempts)))
         if serverdata.get('hostname'):
             irc.reply('\x02PyLink hostname\x02: %s; \x02SID:\x02 %s; \x02SID range:\x02 %s' %
                       (serverdata.get('hostname') or _none,
@@ -340,6 +344,7 @@ def loglevel(irc, source, args):
             return
         else:
             world.console_handler.setLevel(loglevel)
+            _update_log_level()
             irc.reply("Done.")
     except IndexError:
         irc.reply(world.console_handler.level)
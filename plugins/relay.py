@@ -6,7 +6,7 @@ import threading
 import time
 from collections import defaultdict
 
-from pylinkirc import conf, structures, utils, world
+from pylinkirc import conf, shards, structures, utils, world
 from pylinkirc.coremods import permissions
 from pylinkirc.log import log
 
@@ -353,8 +353,9 @@ def get_relay_server_sid(irc, remoteirc, spawn_if_missing=True):
     a new server if it doesn't exist and spawn_if_missing is enabled.
     """
 
-    log.debug('(%s) Grabbing spawnlocks_servers[%s] from thread %r in function %r', irc.name, irc.name,
-              threading.current_thread().name, inspect.currentframe().f_code.co_name)
+    if log.debug_enabled:
+        log.debug('(%s) Grabbing spawnlocks_servers[%s] from thread %r in function %r', irc.name, irc.name,
+                  threading.current_thread().name, inspect.currentframe().f_code.co_name)
     with spawnlocks_servers[irc.name]:
         try:
             sid = relayservers[irc.name][remoteirc.name]
@@ -507,8 +508,9 @@ def get_remote_user(irc, remoteirc, user, spawn_if_missing=True, times_tagged=0,
                           user)
                 return
 
-        log.debug('(%s) Grabbing spawnlocks[%s] from thread %r in function %r', irc.name, irc.name,
-                  threading.current_thread().name, inspect.currentframe().f_code.co_name)
+        if log.debug_enabled:
+            log.debug('(%s) Grabbing spawnlocks[%s] from thread %r in function %r', irc.name, irc.name,
+                      threading.current_thread().name, inspect.currentframe().f_code.co_name)
         with spawnlocks[irc.name]:
             # Be sort-of thread safe: lock the user spawns for the current net first.
             u = None
@@ -917,7 +919,7 @@ def relay_joins(irc, channel, users, ts, targetirc=None, **kwargs):
                             modechar = remoteirc.cmodes.get(mode[0])
 
                             if modechar:
-                                if modechar in remoteirc.cmodes['*A'] or modechar in remoteirc.prefixmodes:
+                                if remoteirc.cmode_table.types.get(modechar) == 'A' or modechar in remoteirc.prefixmodes:
                                     log.warning('(%s) Refusing to set modedelta mode %r on %s because it is a list or prefix mode',
                                                 irc.name, modechar, channel)
                                     continue
@@ -1085,188 +1087,183 @@ def get_supported_cmodes(irc, remoteirc, channel, modes):
             prefix = '+'
         arg = modepair[1]
 
-        # Iterate over every mode see whether the remote IRCd supports
-        # this mode, and what its mode char for it is (if it is different).
-        for name, m in irc.cmodes.items():
+        # Iterate over every mode name using this mode char, and see whether the remote IRCd
+        # supports it and what its mode char for it is (if it is different).
+        for name in irc.cmode_table.names.get(modechar, ()):
             mode_parse_aborted = False
-            if name.startswith('*'):
-                # XXX: Okay, we need a better place to store modetypes.
+            if name not in whitelist:
+                log.debug("(%s) relay.get_supported_cmodes: skipping mode (%r, %r) because "
+                          "it isn't a whitelisted (safe) mode for relay.",
+                          irc.name, modechar, arg)
+                break
+
+            supported_char = remoteirc.cmodes.get(name)
+
+            # The mode we requested is an acting extban on the target network.
+            # Basically there are 3 possibilities when handling these extban-like modes:
+            # 1) Both target & source both use a chmode (e.g. ts6 +q). In these cases, the mode is just forwarded as-is.
+            # 2) Forwarding from chmode to extban - this is the case being handled here.
+            # 3) Forwarding from extban to extban (see below)
+            pending_extban_prefixes = []
+            if name in remoteirc.extbans_acting:
+                # We make the assumption that acting extbans can only be used with +b...
+                old_arg = arg
+                supported_char = remoteirc.cmodes['ban']
+                pending_extban_prefixes.append(name)  # Save the extban prefix for joining later
+                log.debug('(%s) relay.get_supported_cmodes: folding mode %s%s %s to %s%s %s%s for %s',
+                          irc.name, prefix, modechar, old_arg, prefix, supported_char,
+                          remoteirc.extbans_acting[name], arg, remoteirc.name)
+            elif supported_char is None:
                 continue
 
-            if modechar == m:
-                if name not in whitelist:
-                    log.debug("(%s) relay.get_supported_cmodes: skipping mode (%r, %r) because "
-                              "it isn't a whitelisted (safe) mode for relay.",
-                              irc.name, modechar, arg)
+            if modechar in irc.prefixmodes:
+                # This is a prefix mode (e.g. +o). We must coerse the argument
+                # so that the target exists on the remote relay network.
+                log.debug("(%s) relay.get_supported_cmodes: coersing argument of (%r, %r) "
+                          "for network %r.",
+                          irc.name, modechar, arg, remoteirc.name)
+
+                if (not irc.has_cap('can-spawn-clients')) and irc.pseudoclient and arg == irc.pseudoclient.uid:
+                    # Skip modesync on the main PyLink client.
+                    log.debug("(%s) relay.get_supported_cmodes: filtering prefix change (%r, %r) on Clientbot relayer",
+                              irc.name, name, arg)
                     break
 
-                supported_char = remoteirc.cmodes.get(name)
+                # If the target is a remote user, get the real target
+                # (original user).
+                arg = get_orig_user(irc, arg, targetirc=remoteirc) or \
+                    get_remote_user(irc, remoteirc, arg, spawn_if_missing=False)
 
-                # The mode we requested is an acting extban on the target network.
-                # Basically there are 3 possibilities when handling these extban-like modes:
-                # 1) Both target & source both use a chmode (e.g. ts6 +q). In these cases, the mode is just forwarded as-is.
-                # 2) Forwarding from chmode to extban - this is the case being handled here.
-                # 3) Forwarding from extban to extban (see below)
-                pending_extban_prefixes = []
-                if name in remoteirc.extbans_acting:
-                    # We make the assumption that acting extbans can only be used with +b...
-                    old_arg = arg
-                    supported_char = remoteirc.cmodes['ban']
-                    pending_extban_prefixes.append(name)  # Save the extban prefix for joining later
-                    log.debug('(%s) relay.get_supported_cmodes: folding mode %s%s %s to %s%s %s%s for %s',
-                              irc.name, prefix, modechar, old_arg, prefix, supported_char,
-                              remoteirc.extbans_acting[name], arg, remoteirc.name)
-                elif supported_char is None:
-                    continue
-
-                if modechar in irc.prefixmodes:
-                    # This is a prefix mode (e.g. +o). We must coerse the argument
-                    # so that the target exists on the remote relay network.
-                    log.debug("(%s) relay.get_supported_cmodes: coersing argument of (%r, %r) "
-                              "for network %r.",
-                              irc.name, modechar, arg, remoteirc.name)
-
-                    if (not irc.has_cap('can-spawn-clients')) and irc.pseudoclient and arg == irc.pseudoclient.uid:
-                        # Skip modesync on the main PyLink client.
-                        log.debug("(%s) relay.get_supported_cmodes: filtering prefix change (%r, %r) on Clientbot relayer",
-                                  irc.name, name, arg)
-                        break
-
-                    # If the target is a remote user, get the real target
-                    # (original user).
-                    arg = get_orig_user(irc, arg, targetirc=remoteirc) or \
-                        get_remote_user(irc, remoteirc, arg, spawn_if_missing=False)
-
-                    if arg is None:
-                        # Relay client for target user doesn't exist yet. Drop the mode.
-                        break
-
-                    log.debug("(%s) relay.get_supported_cmodes: argument found as (%r, %r) "
-                              "for network %r.",
-                              irc.name, modechar, arg, remoteirc.name)
+                if arg is None:
+                    # Relay client for target user doesn't exist yet. Drop the mode.
+                    break
 
-                    oplist = []
-                    if remotechan in remoteirc.channels:
-                        oplist = remoteirc.channels[remotechan].prefixmodes[name]
+                log.debug("(%s) relay.get_supported_cmodes: argument found as (%r, %r) "
+                          "for network %r.",
+                          irc.name, modechar, arg, remoteirc.name)
 
-                    log.debug("(%s) relay.get_supported_cmodes: list of %ss on %r is: %s",
-                              irc.name, name, remotechan, oplist)
+                oplist = []
+                if remotechan in remoteirc.channels:
+                    oplist = remoteirc.channels[remotechan].prefixmodes[name]
 
-                    if prefix == '+' and arg in oplist:
-                        # Don't set prefix modes that are already set.
-                        log.debug("(%s) relay.get_supported_cmodes: skipping setting %s on %s/%s because it appears to be already set.",
-                                  irc.name, name, arg, remoteirc.name)
-                        break
-                elif arg:
-                    # Acting extban case 3: forwarding extban -> extban or mode
-                    # First, we expand extbans from the local IRCd into a named mode and argument pair. Then, we
-                    # can figure out how to relay it.
-                    for extban_name, extban_prefix in irc.extbans_acting.items():
-                        # Acting extbans are generally only supported with +b and +e
-                        if name in {'ban', 'banexception'} and arg.startswith(extban_prefix):
-                            orig_supported_char, old_arg = supported_char, arg
-
-                            if extban_name in remoteirc.cmodes:
-                                # This extban is a mode on the target network. Chop off the extban prefix and set
-                                # the mode character to the target's mode for it.
-                                supported_char = remoteirc.cmodes[extban_name]
-                                arg = arg[len(extban_prefix):]
-                                log.debug('(%s) relay.get_supported_cmodes: expanding acting extban %s%s %s to %s%s %s for %s',
-                                          irc.name, prefix, orig_supported_char, old_arg, prefix,
-                                          supported_char, arg, remoteirc.name)
-                                # Override the mode name so that we're not overly strict about nick!user@host
-                                # conformance. Note: the reverse (cmode->extban) is not done because that would
-                                # also trigger the nick!user@host filter for +b.
-                                name = extban_name
-                            elif extban_name in remoteirc.extbans_acting:
-                                # This is also an extban on the target network.
-                                # Just chop off the local prefix now; we rewrite it later after processing
-                                # any matching extbans.
-                                pending_extban_prefixes.append(extban_name)
-                                arg = arg[len(extban_prefix):]
-                                log.debug('(%s) relay.get_supported_cmodes: expanding acting extban %s%s %s to %s%s %s%s for %s',
-                                          irc.name, prefix, orig_supported_char, old_arg, prefix,
-                                          supported_char, remoteirc.extbans_acting[extban_name], arg,
-                                          remoteirc.name)
-                            else:
-                                # This mode/extban isn't supported, so ignore it.
-                                log.debug('(%s) relay.get_supported_cmodes: blocking acting extban '
-                                          '%s%s %s as target %s doesn\'t support it',
-                                          irc.name, prefix, supported_char, arg, remoteirc.name)
-                                mode_parse_aborted = True  # XXX: nested loops are ugly...
-                            break  # Only one extban per mode pair, so break.
-
-                    # Handle matching extbans such as Charybdis $a, UnrealIRCd ~a, InspIRCd R:, etc.
-                    for extban_name, extban_prefix in irc.extbans_matching.items():
-                        # For matching extbans, we check for the following:
-                        # 1) arg == extban, for extbans like Charybdis $o and $a that are valid without an argument.
-                        # 2) arg starting with extban, the most general case.
-                        # Extbans with and without args have different mode names to prevent ambiguity and
-                        # allow proper forwarding.
-                        old_arg = arg
-                        if arg == extban_prefix:
-                            # This is a matching extban with no arg (case 1).
-                            if extban_name in remoteirc.extbans_matching:
-                                # Replace the ban with the remote's version entirely.
-                                arg = remoteirc.extbans_matching[extban_name]
-                                log.debug('(%s) relay.get_supported_cmodes: mangling static matching extban %s => %s for %s',
-                                          irc.name, old_arg, arg, remoteirc.name)
-                                break
-                            else:
-                                # Unsupported, don't forward it.
-                                log.debug("(%s) relay.get_supported_cmodes: setting mode_parse_aborted as (%r, %r) "
-                                          "(name=%r; extban_name=%r) doesn't match any (static) extban on %s",
-                                          irc.name, supported_char, arg, name, extban_name, remoteirc.name)
-                                mode_parse_aborted = True
-                        elif extban_prefix.endswith(':') and arg.startswith(extban_prefix):
-                            # This is a full extban with a prefix and some data. The assumption: all extbans with data
-                            # have a prefix ending with : (as a delimiter)
-                            if extban_name in remoteirc.extbans_matching:
-                                # Chop off our prefix and apply the remote's.
-                                arg = arg[len(extban_prefix):]
-                                arg = remoteirc.extbans_matching[extban_name] + arg
-                                log.debug('(%s) relay.get_supported_cmodes: mangling matching extban arg %s => %s for %s',
-                                          irc.name, old_arg, arg, remoteirc.name)
-                                break
-                            else:
-                                log.debug("(%s) relay.get_supported_cmodes: setting mode_parse_aborted as (%r, %r) "
-                                          "(name=%r; extban_name=%r) doesn't match any (dynamic) extban on %s",
-                                          irc.name, supported_char, arg, name, extban_name, remoteirc.name)
-                                mode_parse_aborted = True
-                    else:
-                        if name in ('ban', 'banexception', 'invex', 'quiet') and not remoteirc.is_hostmask(arg):
-                            # Don't add unsupported bans that don't match n!u@h syntax.
-                            log.debug("(%s) relay.get_supported_cmodes: skipping unsupported extban/mode (%r, %r) "
-                                      "because it doesn't match nick!user@host. (name=%r)",
-                                      irc.name, supported_char, arg, name)
-                            break
+                log.debug("(%s) relay.get_supported_cmodes: list of %ss on %r is: %s",
+                          irc.name, name, remotechan, oplist)
 
-                    # We broke up an acting extban earlier. Now, rewrite it into a new mode by joining the prefix and data together.
-                    while pending_extban_prefixes:
-                        next_prefix = pending_extban_prefixes.pop()
-                        log.debug("(%s) relay.get_supported_cmodes: readding extban prefix %r (%r) to (%r, %r) for %s",
-                                  irc.name, next_prefix, remoteirc.extbans_acting[next_prefix],
-                                  supported_char, arg, remoteirc.name)
-                        arg = remoteirc.extbans_acting[next_prefix] + arg
-
-                if mode_parse_aborted:
-                    log.debug("(%s) relay.get_supported_cmodes: blocking unsupported extban/mode (%r, %r) for %s (mode_parse_aborted)",
-                              irc.name, supported_char, arg, remoteirc.name)
+                if prefix == '+' and arg in oplist:
+                    # Don't set prefix modes that are already set.
+                    log.debug("(%s) relay.get_supported_cmodes: skipping setting %s on %s/%s because it appears to be already set.",
+                              irc.name, name, arg, remoteirc.name)
                     break
-                final_modepair = (prefix+supported_char, arg)
+            elif arg:
+                # Acting extban case 3: forwarding extban -> extban or mode
+                # First, we expand extbans from the local IRCd into a named mode and argument pair. Then, we
+                # can figure out how to relay it.
+                for extban_name, extban_prefix in irc.extbans_acting.items():
+                    # Acting extbans are generally only supported with +b and +e
+                    if name in {'ban', 'banexception'} and arg.startswith(extban_prefix):
+                        orig_supported_char, old_arg = supported_char, arg
+
+                        if extban_name in remoteirc.cmodes:
+                            # This extban is a mode on the target network. Chop off the extban prefix and set
+                            # the mode character to the target's mode for it.
+                            supported_char = remoteirc.cmodes[extban_name]
+                            arg = arg[len(extban_prefix):]
+                            log.debug('(%s) relay.get_supported_cmodes: expanding acting extban %s%s %s to %s%s %s for %s',
+                                      irc.name, prefix, orig_supported_char, old_arg, prefix,
+                                      supported_char, arg, remoteirc.name)
+                            # Override the mode name so that we're not overly strict about nick!user@host
+                            # conformance. Note: the reverse (cmode->extban) is not done because that would
+                            # also trigger the nick!user@host filter for +b.
+                            name = extban_name
+                        elif extban_name in remoteirc.extbans_acting:
+                            # This is also an extban on the target network.
+                            # Just chop off the local prefix now; we rewrite it later after processing
+                            # any matching extbans.
+                            pending_extban_prefixes.append(extban_name)
+                            arg = arg[len(extban_prefix):]
+                            log.debug('(%s) relay.get_supported_cmodes: expanding acting extban %s%s %s to %s%s %s%s for %s',
+                                      irc.name, prefix, orig_supported_char, old_arg, prefix,
+                                      supported_char, remoteirc.extbans_acting[extban_name], arg,
+                                      remoteirc.name)
+                        else:
+                            # This mode/extban isn't supported, so ignore it.
+                            log.debug('(%s) relay.get_supported_cmodes: blocking acting extban '
+                                      '%s%s %s as target %s doesn\'t support it',
+                                      irc.name, prefix, supported_char, arg, remoteirc.name)
+                            mode_parse_aborted = True  # XXX: nested loops are ugly...
+                        break  # Only one extban per mode pair, so break.
+
+                # Handle matching extbans such as Charybdis $a, UnrealIRCd ~a, InspIRCd R:, etc.
+                for extban_name, extban_prefix in irc.extbans_matching.items():
+                    # For matching extbans, we check for the following:
+                    # 1) arg == extban, for extbans like Charybdis $o and $a that are valid without an argument.
+                    # 2) arg starting with extban, the most general case.
+                    # Extbans with and without args have different mode names to prevent ambiguity and
+                    # allow proper forwarding.
+                    old_arg = arg
+                    if arg == extban_prefix:
+                        # This is a matching extban with no arg (case 1).
+                        if extban_name in remoteirc.extbans_matching:
+                            # Replace the ban with the remote's version entirely.
+                            arg = remoteirc.extbans_matching[extban_name]
+                            log.debug('(%s) relay.get_supported_cmodes: mangling static matching extban %s => %s for %s',
+                                      irc.name, old_arg, arg, remoteirc.name)
+                            break
+                        else:
+                            # Unsupported, don't forward it.
+                            log.debug("(%s) relay.get_supported_cmodes: setting mode_parse_aborted as (%r, %r) "
+                                      "(name=%r; extban_name=%r) doesn't match any (static) extban on %s",
+                                      irc.name, supported_char, arg, name, extban_name, remoteirc.name)
+                            mode_parse_aborted = True
+                    elif extban_prefix.endswith(':') and arg.startswith(extban_prefix):
+                        # This is a full extban with a prefix and some data. The assumption: all extbans with data
+                        # have a prefix ending with : (as a delimiter)
+                        if extban_name in remoteirc.extbans_matching:
+                            # Chop off our prefix and apply the remote's.
+                            arg = arg[len(extban_prefix):]
+                            arg = remoteirc.extbans_matching[extban_name] + arg
+                            log.debug('(%s) relay.get_supported_cmodes: mangling matching extban arg %s => %s for %s',
+                                      irc.name, old_arg, arg, remoteirc.name)
+                            break
+                        else:
+                            log.debug("(%s) relay.get_supported_cmodes: setting mode_parse_aborted as (%r, %r) "
+                                      "(name=%r; extban_name=%r) doesn't match any (dynamic) extban on %s",
+                                      irc.name, supported_char, arg, name, extban_name, remoteirc.name)
+                            mode_parse_aborted = True
+                else:
+                    if name in ('ban', 'banexception', 'invex', 'quiet') and not remoteirc.is_hostmask(arg):
+                        # Don't add unsupported bans that don't match n!u@h syntax.
+                        log.debug("(%s) relay.get_supported_cmodes: skipping unsupported extban/mode (%r, %r) "
+                                  "because it doesn't match nick!user@host. (name=%r)",
+                                  irc.name, supported_char, arg, name)
+                        break
 
-                # Don't set modes that are already set, to prevent floods on TS6
-                # where the same mode can be set infinite times.
-                if prefix == '+' and (remotechan not in remoteirc.channels or final_modepair in remoteirc.channels[remotechan].modes):
-                    log.debug("(%s) relay.get_supported_cmodes: skipping setting mode (%r, %r) on %s%s because it appears to be already set.",
-                              irc.name, supported_char, arg, remoteirc.name, remotechan)
-                    break
+                # We broke up an acting extban earlier. Now, rewrite it into a new mode by joining the prefix and data together.
+                while pending_extban_prefixes:
+                    next_prefix = pending_extban_prefixes.pop()
+                    log.debug("(%s) relay.get_supported_cmodes: readding extban prefix %r (%r) to (%r, %r) for %s",
+                              irc.name, next_prefix, remoteirc.extbans_acting[next_prefix],
+                              supported_char, arg, remoteirc.name)
+                    arg = remoteirc.extbans_acting[next_prefix] + arg
+
+            if mode_parse_aborted:
+                log.debug("(%s) relay.get_supported_cmodes: blocking unsupported extban/mode (%r, %r) for %s (mode_parse_aborted)",
+                          irc.name, supported_char, arg, remoteirc.name)
+                break
+            final_modepair = (prefix+supported_char, arg)
 
-                supported_modes.append(final_modepair)
-                log.debug("(%s) relay.get_supported_cmodes: added modepair (%r, %r) for %s%s",
+            # Don't set modes that are already set, to prevent floods on TS6
+            # where the same mode can be set infinite times.
+            if prefix == '+' and (remotechan not in remoteirc.channels or final_modepair in remoteirc.channels[remotechan].modes):
+                log.debug("(%s) relay.get_supported_cmodes: skipping setting mode (%r, %r) on %s%s because it appears to be already set.",
                           irc.name, supported_char, arg, remoteirc.name, remotechan)
                 break
 
+            supported_modes.append(final_modepair)
+            log.debug("(%s) relay.get_supported_cmodes: added modepair (%r, %r) for %s%s",
+                      irc.name, supported_char, arg, remoteirc.name, remotechan)
+            break
+
     log.debug('(%s) relay.get_supported_cmodes: final modelist (sending to %s%s) is %s', irc.name, remoteirc.name, remotechan, supported_modes)
     return supported_modes
 
@@ -1387,14 +1384,15 @@ def handle_join(irc, numeric, command, args):
                 irc.apply_modes(channel, modes)
 
     relay_joins(irc, channel, users, ts, burst=False)
-utils.add_hook(handle_join, 'JOIN')
+utils.add_hook(handle_join, 'JOIN', wants_channeldata=True)
 utils.add_hook(handle_join, 'PYLINK_SERVICE_JOIN')
 
 def handle_quit(irc, numeric, command, args):
     # Lock the user spawning mechanism before proceeding, since we're going to be
     # deleting client from the relayusers cache.
-    log.debug('(%s) Grabbing spawnlocks[%s] from thread %r in function %r', irc.name, irc.name,
-              threading.current_thread().name, inspect.currentframe().f_code.co_name)
+    if log.debug_enabled:
+        log.debug('(%s) Grabbing spawnlocks[%s] from thread %r in function %r', irc.name, irc.name,
+                  threading.current_thread().name, inspect.currentframe().f_code.co_name)
 
     with spawnlocks[irc.name]:
 
@@ -1859,7 +1857,7 @@ def handle_mode(irc, numeric, command, args):
 
                             # Convert UIDs to nicks when relaying this to clientbot.
                             modepair = (modepair[0], irc.get_friendly_name(modepair[1]))
-                        elif modechar in irc.cmodes['*A'] and irc.is_hostmask(modepair[1]) and \
+                        elif irc.cmode_table.types.get(modechar) == 'A' and irc.is_hostmask(modepair[1]) and \
                                 conf.conf.get('relay', {}).get('clientbot_modesync', 'none').lower() != 'none':
                             # Don't show bans if the ban is a simple n!u@h and modesync is enabled
                             continue
@@ -1927,7 +1925,7 @@ def handle_mode(irc, numeric, command, args):
                                   ((modepair[0][-1] in irc.prefixmodes and not
                                     irc.is_privileged_service(modepair[1]))
                                   # Include all list modes (bans, etc.)
-                                   or modepair[0][-1] in irc.cmodes['*A'])
+                                   or irc.cmode_table.types.get(modepair[0][-1]) == 'A')
                                  ]
             modes.clear()  # Clear the mode list so nothing is relayed below
 
@@ -1936,7 +1934,7 @@ def handle_mode(irc, numeric, command, args):
                       irc.name, str(modepair), str(modedelta_modes))
             modechar = modepair[0][-1]
             if modechar in modedelta_modes:
-                if modechar in irc.cmodes['*A'] or modechar in irc.prefixmodes:
+                if irc.cmode_table.types.get(modechar) == 'A' or modechar in irc.prefixmodes:
                     # Don't enforce invalid modes.
                     log.debug('(%s) relay.handle_mode: Not enforcing invalid modedelta mode %s on %s (list or prefix mode)',
                               irc.name, str(modepair), target)
@@ -1971,7 +1969,7 @@ def handle_mode(irc, numeric, command, args):
     if modes:
         iterate_all(irc, _handle_mode_loop, extra_args=(numeric, command, target, modes))
 
-utils.add_hook(handle_mode, 'MODE')
+utils.add_hook(handle_mode, 'MODE', wants_channeldata=True)
 
 def handle_topic(irc, numeric, command, args):
     channel = args['channel']
@@ -2155,8 +2153,9 @@ def handle_disconnect(irc, numeric, command, args):
 
     # Quit all of our users' representations on other nets, and remove
     # them from our relay clients index.
-    log.debug('(%s) Grabbing spawnlocks[%s] from thread %r in function %r', irc.name, irc.name,
-              threading.current_thread().name, inspect.currentframe().f_code.co_name)
+    if log.debug_enabled:
+        log.debug('(%s) Grabbing spawnlocks[%s] from thread %r in function %r', irc.name, irc.name,
+                  threading.current_thread().name, inspect.currentframe().f_code.co_name)
     with spawnlocks[irc.name]:
         for k, v in relayusers.copy().items():
             if irc.name in v:
@@ -2165,8 +2164,9 @@ def handle_disconnect(irc, numeric, command, args):
                 del relayusers[k]
     # SQUIT all relay pseudoservers spawned for us, and remove them
     # from our relay subservers index.
-    log.debug('(%s) Grabbing spawnlocks_servers[%s] from thread %r in function %r', irc.name, irc.name,
-              threading.current_thread().name, inspect.currentframe().f_code.co_name)
+    if log.debug_enabled:
+        log.debug('(%s) Grabbing spawnlocks_servers[%s] from thread %r in function %r', irc.name, irc.name,
+                  threading.current_thread().name, inspect.currentframe().f_code.co_name)
     with spawnlocks_servers[irc.name]:
 
         def _handle_disconnect_loop(irc, remoteirc):
@@ -2501,7 +2501,13 @@ def link(irc, source, args):
         return
 
     if remotenet not in world.networkobjects:
-        irc.error('No network named %r exists.' % remotenet)
+        remoteshard = shards.get_network_shard(remotenet)
+        if remoteshard is not None and remoteshard != shards.shard:
+            irc.error('Network %r is on shard %s, and relay cannot link networks on different '
+                      'shards. Use the "shard" server option to move both networks onto the '
+                      'same shard.' % (remotenet, remoteshard))
+        else:
+            irc.error('No network named %r exists.' % remotenet)
         return
     localentry = get_relay(irc, localchan)
 
@@ -2957,7 +2963,7 @@ def modedelta(irc, source, args):
 
             mchar = remoteirc.cmodes.get(modename)
             if mchar:
-                if mchar in remoteirc.cmodes['*A'] or mchar in remoteirc.prefixmodes:
+                if remoteirc.cmode_table.types.get(mchar) == 'A' or mchar in remoteirc.prefixmodes:
                     log.warning('(%s) Refusing to set modedelta mode %r on %s because it is a list or prefix mode',
                                 irc.name, mchar, remotechan)
                     continue
@@ -27,6 +27,25 @@ def timediff(before, now):
 # From RFC 2822: https://tools.ietf.org/html/rfc2822.html#section-3.3
 DEFAULT_TIME_FORMAT = "%a, %d %b %Y %H:%M:%S +0000"
 
+def _get_networks(irc, args):
+    """
+    Returns a dict of connected network objects matching the first command argument (a
+    network name or --all), defaulting to the current network.
+    """
+    try:
+        network = args[0]
+    except IndexError:
+        network = irc.name
+
+    if network == '--all':  # XXX: we really need smart argument parsing some time
+        return {k: v for k, v in world.networkobjects.items() if v.connected.is_set()}
+    elif network not in world.networkobjects:
+        irc.error("No such network %r." % network)
+    elif not world.networkobjects[network].connected.is_set():
+        irc.error("Network %s is not connected." % network)
+    else:
+        return {network: world.networkobjects[network]}
+
 @utils.add_cmd
 def uptime(irc, source, args):
     """[<network> / --all]
@@ -35,23 +54,9 @@ def uptime(irc, source, args):
     The --all argument can also be given to show the uptime for all networks."""
     permissions.check_permissions(irc, source, ['stats.uptime'])
 
-    try:
-        network = args[0]
-    except IndexError:
-        network = irc.name
-
-    if network == '--all':  # XXX: we really need smart argument parsing some time
-        # Filter by all connected networks.
-        ircobjs = {k:v for k,v in world.networkobjects.items() if v.connected.is_set()}
-    else:
-        try:
-            ircobjs = {network: world.networkobjects[network]}
-        except KeyError:
-            irc.error("No such network %r." % network)
-            return
-        if not world.networkobjects[network].connected.is_set():
-            irc.error("Network %s is not connected." % network)
-            return
+    ircobjs = _get_networks(irc, args)
+    if ircobjs is None:
+        return
 
     current_time = int(time.time())
     time_format = conf.conf.get('stats', {}).get('time_format', DEFAULT_TIME_FORMAT)
@@ -70,6 +75,133 @@ def uptime(irc, source, args):
                   )
                  )
 
+@utils.add_cmd
+def sendstats(irc, source, args):
+    """[<network> / --all]
+
+    Shows how many lines and bytes the send queue has combined into each socket write on the
+    given network (or the current network if not specified), and how many lines are queued in
+    each priority class."""
+    permissions.check_permissions(irc, source, ['stats.sendstats'])
+
+    ircobjs = _get_networks(irc, args)
+    if ircobjs is None:
+        return
+
+    for network, ircobj in sorted(ircobjs.items()):
+        stats = getattr(ircobj, 'write_stats', None)
+        if stats is None:
+            irc.reply("%s: not supported on this network type" % network)
+            continue
+        writes = stats['writes'] or 1  # Avoid dividing by zero
+        irc.reply("%s: \x02%s\x02 lines / \x02%s\x02 bytes in \x02%s\x02 writes; %.1f lines and "
+                  "%.0f bytes per write on average (max %s lines, %s bytes)" %
+                  (network, stats['lines'], stats['bytes'], stats['writes'],
+                   stats['lines'] / writes, stats['bytes'] / writes, stats['max_lines'],
+                   stats['max_bytes']))
+        if ircobj._queue is not None:
+            irc.reply("%s: queued lines: %s" % (network, ', '.join(
+                      '%s \x02%s\x02' % (lane, len(items)) for lane, items in ircobj._queue.lanes.items())))
+
+@utils.add_cmd
+def burststats(irc, source, args):
+    """[<network> / --all]
+
+    Shows how many burst lines (SJOIN, FJOIN, BURST, etc.) were sent to the given network (or the
+    current network if not specified) since it connected, and how many lines fixed size chunking
+    would have taken instead."""
+    permissions.check_permissions(irc, source, ['stats.burststats'])
+
+    ircobjs = _get_networks(irc, args)
+    if ircobjs is None:
+        return
+
+    for network, ircobj in sorted(ircobjs.items()):
+        stats = getattr(ircobj, 'burst_stats', None)
+        if stats is None:
+            irc.reply("%s: not supported on this network type" % network)
+            continue
+        irc.reply("%s: \x02%s\x02 items in \x02%s\x02 burst lines (%s lines saved by packing)" %
+                  (network, stats['items'], stats['lines'], stats['old_lines'] - stats['lines']))
+
+@utils.add_cmd
+def dispatchstats(irc, source, args):
+    """[<network> / --all]
+
+    Shows how many incoming lines are waiting to be processed on the given network (or the current
+    network if not specified), and how long they wait. This is only available on networks using
+    dispatch workers."""
+    permissions.check_permissions(irc, source, ['stats.dispatchstats'])
+
+    ircobjs = _get_networks(irc, args)
+    if ircobjs is None:
+        return
+
+    for network, ircobj in sorted(ircobjs.items()):
+        dispatch_queue = getattr(ircobj, '_dispatch_queue', None)
+        if dispatch_queue is None:
+            irc.reply("%s: dispatch workers are not enabled on this network" % network)
+            continue
+        stats = ircobj.dispatch_stats
+        irc.reply("%s: \x02%s\x02 lines queued, \x02%s\x02 processed; last lag %.3fs (max %.3fs)" %
+                  (network, dispatch_queue.qsize(), stats['lines'], stats['lag'], stats['max_lag']))
+
+@utils.add_cmd
+def unknowncmds(irc, source, args):
+    """[<network> / --all]
+
+    Shows the incoming commands received most often on the given network (or the current network
+    if not specified) that PyLink has no handler for."""
+    permissions.check_permissions(irc, source, ['stats.unknowncmds'])
+
+    ircobjs = _get_networks(irc, args)
+    if ircobjs is None:
+        return
+
+    for network, ircobj in sorted(ircobjs.items()):
+        counts = getattr(ircobj, 'unknown_commands', None)
+        if counts is None:
+            irc.reply("%s: not supported on this network type" % network)
+            continue
+        elif not counts:
+            irc.reply("%s: no unknown commands received" % network)
+            continue
+        irc.reply("%s: \x02%s\x02 unknown commands received: %s" % (network, sum(counts.values()),
+                  ', '.join('%s (%s)' % (command, count) for command, count in counts.most_common(15))))
+
+@utils.add_cmd
+def hookstats(irc, source, args):
+    """[<number of entries> / --reset]
+
+    Shows the hook functions that took the most time in total, with their call counts, mean and
+    99th percentile run times, and how many exceptions they raised. This requires the
+    pylink::hook_profiling option. --reset clears the collected statistics."""
+    permissions.check_permissions(irc, source, ['stats.hookstats'])
+
+    if args and args[0] == '--reset':
+        world.hook_stats.clear()
+        irc.reply("Hook statistics cleared.")
+        return
+
+    try:
+        count = int(args[0]) if args else 10
+    except ValueError:
+        irc.error("Invalid number of entries %r." % args[0])
+        return
+
+    if not world.hook_profiling:
+        irc.reply("Hook profiling is disabled; set pylink::hook_profiling to true to enable it.")
+    if not world.hook_stats:
+        irc.reply("No hook statistics collected.")
+        return
+
+    entries = sorted(world.hook_stats.items(), key=lambda item: item[1].total, reverse=True)
+    for (module, hook), stats in entries[:count]:
+        irc.reply("\x02%s\x02 on %s: %s calls, %.3fs total, %.2fms mean, %.2fms p99, %.2fms max, "
+                  "%s exceptions" % (module.replace(utils.PLUGIN_PREFIX, '', 1), hook, stats.calls,
+                                     stats.total, stats.mean * 1000, stats.percentile(99) * 1000,
+                                     stats.max * 1000, stats.exceptions))
+
 def handle_stats(irc, source, command, args):
     """/STATS handler. Currently supports the following:
 
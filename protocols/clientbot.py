@@ -274,8 +274,7 @@ class ClientbotWrapperProtocol(ClientbotBaseProtocol, IRCCommonProtocol):
             log.info('(%s) Skipping SASL due to timeout; are the IRCd and services configured '
                      'properly?', self.name)
             self._do_cap_end()
-        self._cap_timer = threading.Timer(self.serverdata.get('sasl_timeout') or 15, _do_cap_end_wrapper)
-        self._cap_timer.start()
+        self._cap_timer = self._driver.call_later(self.serverdata.get('sasl_timeout') or 15, _do_cap_end_wrapper)
 
         # Log in to IRC and set our irc.pseudoclient object.
         sbot = world.services['pylink']
@@ -395,7 +394,7 @@ class ClientbotWrapperProtocol(ClientbotBaseProtocol, IRCCommonProtocol):
         Sends a PING to the uplink.
         """
         if self.uplink:
-            self.send('PING %s' % self.get_friendly_name(self.uplink))
+            self.send('PING %s' % self.get_friendly_name(self.uplink), priority=SENDQ_CONTROL)
 
             # Poll WHO periodically to figure out any ident/host/away status changes.
             for channel in self.pseudoclient.channels:
@@ -451,25 +450,15 @@ class ClientbotWrapperProtocol(ClientbotBaseProtocol, IRCCommonProtocol):
 
     def handle_events(self, data):
         """Event handler for the RFC1459/2812 (clientbot) protocol."""
-        data = data.split(" ")
+        line = self.parse_line(data)
+        tags = line.tags
+        command = line.command
+        args = line.params
 
-        tags = self.parse_message_tags(data)
-        if tags:
-            # If we have tags, split off the first argument.
-            data = data[1:]
-
-        try:
-            args = self.parse_prefixed_args(data)
-            sender = args[0]
-            command = args[1]
-            args = args[2:]
-
-        except IndexError:
+        sender = line.prefix
+        if sender is None:
             # Raw command without an explicit sender; assume it's being sent by our uplink.
-            args = self.parse_args(data)
             idsource = sender = self.uplink
-            command = args[0]
-            args = args[1:]
         else:
             # PyLink as a services framework expects UIDs and SIDs for everything. Since we connect
             # as a bot here, there's no explicit user introduction, so we're going to generate
@@ -493,10 +482,9 @@ class ClientbotWrapperProtocol(ClientbotBaseProtocol, IRCCommonProtocol):
             # Handle IRCv3.2 account-tag.
             self._set_account_name(idsource, tags.get('account'))
 
-        try:
-            func = getattr(self, 'handle_'+command.lower())
-        except AttributeError:  # unhandled command
-            pass
+        command, func = self._get_handler(command)
+        if func is None:  # unhandled command
+            self.unknown_commands[command] += 1
         else:
             parsed_args = func(idsource, command, args)
             if parsed_args is not None:
@@ -1091,7 +1079,7 @@ class ClientbotWrapperProtocol(ClientbotBaseProtocol, IRCCommonProtocol):
         """
         Handles incoming PING requests.
         """
-        self.send('PONG :%s' % args[0], queue=False)
+        self.send('PONG :%s' % args[0], priority=SENDQ_CONTROL)
 
     def handle_privmsg(self, source, command, args):
         """Handles incoming PRIVMSG/NOTICE."""
@@ -138,9 +138,10 @@ class InspIRCdProtocol(TS6BaseProtocol):
 
         banmodes = []
         regularmodes = []
+        mode_types = self.cmode_table.types
         for mode in modes:
             modechar = mode[0][-1]
-            if modechar in self.cmodes['*A']:
+            if mode_types.get(modechar) == 'A':
                 # Track bans separately (they are sent as a normal FMODE instead of in FJOIN.
                 # However, don't reset bans that have already been set.
                 if (modechar, mode[1]) not in self._channels[channel].modes:
@@ -150,13 +151,15 @@ class InspIRCdProtocol(TS6BaseProtocol):
 
         uids = []
         changedmodes = set(modes)
-        namelist = []
+        # InspIRCd has no S2S line length limit, so this normally packs everyone into one FJOIN.
+        packer = self._get_burst_packer(':{sid} FJOIN {channel} {ts} {modes} :'.format(
+                sid=server, ts=ts, channel=channel, modes=self.join_modes(regularmodes)))
 
         # We take <users> as a list of (prefixmodes, uid) pairs.
         for userpair in users:
             assert len(userpair) == 2, "Incorrect format of userpair: %r" % userpair
             prefixes, user = userpair
-            namelist.append(','.join(userpair))
+            packer.add(','.join(userpair))
             uids.append(user)
             for m in prefixes:
                 changedmodes.add(('+%s' % m, user))
@@ -165,10 +168,7 @@ class InspIRCdProtocol(TS6BaseProtocol):
             except KeyError:  # Not initialized yet?
                 log.debug("(%s) sjoin: KeyError trying to add %r to %r's channel list?", self.name, channel, user)
 
-        namelist = ' '.join(namelist)
-        self._send_with_prefix(server, "FJOIN {channel} {ts} {modes} :{users}".format(
-                ts=ts, users=namelist, channel=channel,
-                modes=self.join_modes(modes)))
+        self._send_burst_lines('FJOIN', channel, packer)
         self._channels[channel].users.update(uids)
 
         if banmodes:
@@ -665,6 +665,8 @@ class InspIRCdProtocol(TS6BaseProtocol):
             # <- CAPAB MODSUPPORT :m_alltime.so m_check.so m_chghost.so m_chgident.so m_chgname.so m_fullversion.so m_gecosban.so m_knock.so m_muteban.so m_nicklock.so m_nopartmsg.so m_opmoderated.so m_sajoin.so m_sanick.so m_sapart.so m_serverban.so m_services_account.so m_showwhois.so m_silence.so m_swhois.so m_uninvite.so m_watch.so
             self._modsupport |= set(args[-1].split())
 
+        self._update_mode_tables()
+
     def handle_kick(self, source, command, args):
         """Handles incoming KICKs."""
         # InspIRCD 3 adds membership IDs to KICK messages when forwarding across servers
@@ -685,9 +687,9 @@ class InspIRCdProtocol(TS6BaseProtocol):
         # <- :3IN PING 808
         # -> :808 PONG 3IN
         if len(args) >= 2:
-            self._send_with_prefix(args[1], 'PONG %s %s' % (args[1], source), queue=False)
+            self._send_with_prefix(args[1], 'PONG %s %s' % (args[1], source), priority=SENDQ_CONTROL)
         else:
-            self._send_with_prefix(args[0], 'PONG %s' % source, queue=False)
+            self._send_with_prefix(args[0], 'PONG %s' % source, priority=SENDQ_CONTROL)
 
     def handle_fjoin(self, servernumeric, command, args):
         """Handles incoming FJOIN commands (InspIRCd equivalent of JOIN/SJOIN)."""
@@ -696,37 +698,19 @@ class InspIRCdProtocol(TS6BaseProtocol):
         # insp3:
         # <- :3IN FJOIN #test 1556842195 +nt :o,3INAAAAAA:4
         channel = args[0]
-        chandata = self._channels[channel].deepcopy()
+        chandata = self._snapshot_channel(channel, command)
         # InspIRCd sends each channel's users in the form of 'modeprefix(es),UID'
-        userlist = args[-1].split()
-
-        modestring = args[2:-1] or args[2]
-        parsedmodes = self.parse_modes(channel, modestring)
-        namelist = []
-
-        # Keep track of other modes that are added due to prefix modes being joined too.
-        changedmodes = set(parsedmodes)
-
-        for user in userlist:
-            modeprefix, user = user.split(',', 1)
-
-            if self.proto_ver >= 1205:
+        members = []
+        strip_membid = self.proto_ver >= 1205
+        for member in args[-1].split():
+            modeprefix, user = member.split(',', 1)
+            if strip_membid:
                 # XXX: we don't handle membership IDs yet
                 user = user.split(':', 1)[0]
+            members.append((user, modeprefix))
 
-            # Don't crash when we get an invalid UID.
-            if user not in self.users:
-                log.debug('(%s) handle_fjoin: tried to introduce user %s not in our user list, ignoring...',
-                          self.name, user)
-                continue
-
-            namelist.append(user)
-            self.users[user].channels.add(channel)
-
-            # Only save mode changes if the remote has lower TS than us.
-            changedmodes |= {('+%s' % mode, user) for mode in modeprefix}
-
-            self._channels[channel].users.add(user)
+        modestring = args[2:-1] or args[2]
+        parsedmodes = self.parse_modes(channel, modestring)
 
         # Statekeeping with timestamps. Note: some service packages (Anope 1.8) send a trailing
         # 'd' after the timestamp, which we should strip out to prevent int() from erroring.
@@ -735,8 +719,9 @@ class InspIRCdProtocol(TS6BaseProtocol):
         # <- :3AX FJOIN #monitor 1485462109d + :,3AXAAAAAK
         their_ts = int(''.join(char for char in args[1] if char.isdigit()))
 
-        our_ts = self._channels[channel].ts
-        self.updateTS(servernumeric, channel, their_ts, changedmodes)
+        # Join everyone at once: membership and prefix modes are only applied if the remote has
+        # a lower or equal TS.
+        namelist = self.join_users(servernumeric, channel, members, their_ts, parsedmodes)
 
         return {'channel': channel, 'users': namelist, 'modes': parsedmodes, 'ts': their_ts,
                 'channeldata': chandata}
@@ -823,11 +808,20 @@ class InspIRCdProtocol(TS6BaseProtocol):
         """Handles the FMODE command, used for channel mode changes."""
         # <- :70MAAAAAA FMODE #chat 1433653462 +hhT 70MAAAAAA 70MAAAAAD
         channel = args[0]
-        oldobj = self._channels[channel].deepcopy()
+        ts = int(args[1])
+        # Like InspIRCd, drop mode changes with a newer TS than ours: these were sent before the
+        # channel's TS was lowered (e.g. by an FJOIN during a burst) and would be undone anyways.
+        # This is checked once per line, before anything is parsed or copied.
+        our_ts = self._channels[channel].ts
+        if ts > our_ts:
+            log.debug('(%s) Ignoring FMODE on %s with TS %s newer than ours (%s)', self.name,
+                      channel, ts, our_ts)
+            return
+
+        oldobj = self._snapshot_channel(channel, command)
         modes = args[2:]
         changedmodes = self.parse_modes(channel, modes)
         self.apply_modes(channel, changedmodes)
-        ts = int(args[1])
         return {'target': channel, 'modes': changedmodes, 'ts': ts,
                 'channeldata': oldobj}
 
@@ -2,14 +2,19 @@
 ircs2s_common.py: Common base protocol class with functions shared by TS6 and P10-based protocols.
 """
 
+import collections
+import collections.abc
 import re
+import sys
+import threading
 import time
 
-from pylinkirc import conf
-from pylinkirc.classes import IRCNetwork, ProtocolError
+from pylinkirc import conf, utils
+from pylinkirc.classes import (SENDQ_CONTROL, IRCNetwork, ProtocolError, _send_priority,
+                               send_priority)
 from pylinkirc.log import log
 
-__all__ = ['UIDGenerator', 'IRCCommonProtocol', 'IRCS2SProtocol']
+__all__ = ['UIDGenerator', 'MessageTags', 'IRCLine', 'IRCCommonProtocol', 'IRCS2SProtocol']
 
 class UIDGenerator():
     """
@@ -38,10 +43,135 @@ class UIDGenerator():
         uid = uid.rjust(self.length, self.uidchars[0])
         return self.sid + uid
 
+# Tag keys seen so far, mapped to an interned copy, so that lines carrying the usual tags (time,
+# msgid, account, ...) share their key strings. This is capped to keep junk keys from piling up.
+_tag_keys = {}
+TAG_KEY_CACHE_SIZE = 256
+
+_TAG_ESCAPES = {':': ';', 's': ' ', '\\': '\\', 'r': '\r', 'n': '\n'}
+_tag_escape_re = re.compile(r'\\(.?)', re.DOTALL)
+
+def _unescape_tag_value(value):
+    """
+    Unescapes an IRCv3 message tag value. Unknown escapes turn into the escaped character, and
+    a lone backslash at the end is dropped.
+    """
+    return _tag_escape_re.sub(lambda match: _TAG_ESCAPES.get(match.group(1), match.group(1)), value)
+
+class MessageTags(collections.abc.Mapping):
+    """
+    Read-only mapping of IRCv3 message tags, as described at
+    https://ircv3.net/specs/extensions/message-tags.
+
+    This only keeps the raw tag string until tags are read: the string is split into keys the first
+    time the mapping is used, and each value is unescaped when it is first looked up.
+    """
+    __slots__ = ('raw', '_values', '_unescaped')
+
+    def __init__(self, raw=''):
+        self.raw = raw
+        self._values = None  # key -> escaped value
+        self._unescaped = None  # key -> unescaped value, for values looked up so far
+
+    def _split(self):
+        values = {}
+        for tag in self.raw.split(';'):
+            if not tag:
+                continue
+            key, _, value = tag.partition('=')
+            try:
+                key = _tag_keys[key]
+            except KeyError:
+                if len(_tag_keys) < TAG_KEY_CACHE_SIZE:
+                    key = _tag_keys[key] = sys.intern(key)
+            values[key] = value
+        self._values = values
+        return values
+
+    def __getitem__(self, key):
+        values = self._values
+        if values is None:
+            if not self.raw:
+                raise KeyError(key)
+            values = self._split()
+
+        value = values[key]
+        if '\\' not in value:
+            return value
+
+        unescaped = self._unescaped
+        if unescaped is None:
+            unescaped = self._unescaped = {}
+        elif key in unescaped:
+            return unescaped[key]
+        value = unescaped[key] = _unescape_tag_value(value)
+        return value
+
+    def __iter__(self):
+        values = self._values
+        if values is None:
+            values = self._split()
+        return iter(values)
+
+    def __len__(self):
+        values = self._values
+        if values is None:
+            values = self._split()
+        return len(values)
+
+    def __bool__(self):
+        return bool(self.raw)
+
+    def __repr__(self):
+        return 'MessageTags(%r)' % self.raw
+
+_no_tags = MessageTags()
+
+class IRCLine():
+    """
+    A tokenized RFC1459 line, as returned by IRCCommonProtocol.parse_line().
+
+    params includes the trailing (":"-prefixed) argument as its last item, if there is one;
+    trailing is also set to that text, and None otherwise.
+    """
+    __slots__ = ('tags', 'prefix', 'command', 'params', 'trailing')
+
+    def __init__(self, tags, prefix, command, params, trailing=None):
+        self.tags = tags
+        self.prefix = prefix
+        self.command = command
+        self.params = params
+        self.trailing = trailing
+
+    def __repr__(self):
+        return 'IRCLine(tags=%r, prefix=%r, command=%r, params=%r)' % (self.tags, self.prefix,
+                                                                       self.command, self.params)
+
+def _split_params(text):
+    """
+    Splits a string of RFC1459 arguments on spaces, skipping empty fields, with the first
+    argument starting with ":" lasting until the end of the line. Returns (params, trailing).
+    """
+    idx = text.find(' :')
+    if idx == -1:
+        trailing = None
+        params = text.split(' ')
+    else:
+        trailing = text[idx+2:]
+        params = text[:idx].split(' ')
+    if '' in params:  # Only rebuild the list if there are repeated spaces to skip
+        params = [arg for arg in params if arg]
+    if trailing is not None:
+        params.append(trailing)
+    return params, trailing
+
 class IRCCommonProtocol(IRCNetwork):
 
     COMMON_PREFIXMODES = [('h', 'halfop'), ('a', 'admin'), ('q', 'owner'), ('y', 'owner')]
 
+    # Maps command tokens (e.g. for P10) to the full command names they stand for.
+    COMMAND_TOKENS = {}
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
@@ -49,6 +179,49 @@ class IRCCommonProtocol(IRCNetwork):
         self._use_builtin_005_handling = False  # Disabled by default for greater security
         self.protocol_caps |= {'has-irc-modes', 'can-manage-bot-channels'}
 
+        # Counts incoming commands that have no handler, by command name.
+        self.unknown_commands = collections.Counter()
+
+    def _init_vars(self, *args, **kwargs):
+        super()._init_vars(*args, **kwargs)
+        # The dispatch table is (re)built on first use after each (re)connect, so that it picks
+        # up handlers aliased in __init__ as well as protocol module reloads.
+        self._dispatch_table = None
+
+    def _build_dispatch_table(self):
+        """
+        Builds the table handle_events() uses to look up command handlers, mapping raw commands
+        and command tokens (uppercase) to (command name, bound handler) pairs. The handler is None
+        for tokens of commands that aren't handled.
+        """
+        table = {}
+        for attr in dir(self):
+            if attr.startswith('handle_') and attr != 'handle_events':
+                func = getattr(self, attr, None)
+                if callable(func):
+                    command = attr[7:].upper()
+                    table[command] = (command, func)
+
+        for token, command in self.COMMAND_TOKENS.items():
+            table[token] = table.get(command, (command, None))
+
+        log.debug('(%s) Built dispatch table with %s handlers and %s tokens', self.name,
+                  len(table) - len(self.COMMAND_TOKENS), len(self.COMMAND_TOKENS))
+        self._dispatch_table = table
+        return table
+
+    def _get_handler(self, raw_command):
+        """
+        Returns the (command name, handler) pair for the given raw command or token. The handler
+        is None for unknown commands.
+        """
+        table = self._dispatch_table
+        if table is None:
+            table = self._build_dispatch_table()
+
+        raw_command = raw_command.upper()
+        return table.get(raw_command) or (raw_command, None)
+
     def post_connect(self):
         self._caps.clear()
 
@@ -72,7 +245,7 @@ class IRCCommonProtocol(IRCNetwork):
         be used for multi-word arguments that last until the end of a line.
         """
         if isinstance(args, str):
-            args = args.split(' ')
+            return _split_params(args)[0]
 
         real_args = []
         for idx, arg in enumerate(args):
@@ -125,6 +298,14 @@ class IRCCommonProtocol(IRCNetwork):
         prefixsearch = re.search(r'\(([A-Za-z]+)\)(.*)', args)
         return dict(zip(prefixsearch.group(1), prefixsearch.group(2)))
 
+    @staticmethod
+    def parse_tag_string(tagstring):
+        """
+        Parses a string of IRCv3.2 message tags (without the leading "@") into a MessageTags
+        mapping.
+        """
+        return MessageTags(tagstring)
+
     @classmethod
     def parse_message_tags(cls, data):
         """
@@ -135,23 +316,33 @@ class IRCCommonProtocol(IRCNetwork):
         # Example query:
         # @aaa=bbb;ccc;example.com/ddd=eee :nick!ident@host.com PRIVMSG me :Hello
         if data[0].startswith('@'):
-            tagdata = data[0].lstrip('@').split(';')
-            for idx, tag in enumerate(tagdata):
-                tag = tag.replace('\\s', ' ')
-                tag = tag.replace('\\r', '\r')
-                tag = tag.replace('\\n', '\n')
-                tag = tag.replace('\\:', ';')
-
-                # We want to drop lone \'s but keep \\ as \ ...
-                tag = tag.replace('\\\\', '\x00')
-                tag = tag.replace('\\', '')
-                tag = tag.replace('\x00', '\\')
-                tagdata[idx] = tag
-
-            results = cls.parse_isupport(tagdata, fallback='')
-            return results
+            return cls.parse_tag_string(data[0].lstrip('@'))
         return {}
 
+    @classmethod
+    def parse_line(cls, line):
+        """
+        Tokenizes a raw IRC line into an IRCLine, in one pass: message tags (a dict, empty if
+        there are none), the sender prefix without its leading ":" (None if missing), the command,
+        and its arguments.
+        """
+        tags = _no_tags
+        if line.startswith('@'):
+            tagstring, _, line = line.partition(' ')
+            tags = cls.parse_tag_string(tagstring[1:])
+            line = line.lstrip(' ')
+
+        prefix = None
+        if line.startswith(':'):
+            prefix, _, line = line.partition(' ')
+            prefix = prefix[1:]
+            line = line.lstrip(' ')
+
+        params, trailing = _split_params(line)
+        if not params:
+            raise ProtocolError('Received a line with no command: %r' % line)
+        return IRCLine(tags, prefix, params.pop(0), params, trailing)
+
     def handle_away(self, source, command, args):
         """Handles incoming AWAY messages."""
         # TS6:
@@ -259,12 +450,13 @@ class IRCCommonProtocol(IRCNetwork):
             # any more complicated.
             self.protocol_caps |= {'has-statusmsg'}
 
+        self._update_mode_tables()
+
     def _send_with_prefix(self, source, msg, **kwargs):
         """Sends a RFC1459-style raw command from the given sender."""
         self.send(':%s %s' % (self._expandPUID(source), msg), **kwargs)
 
 class IRCS2SProtocol(IRCCommonProtocol):
-    COMMAND_TOKENS = {}
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -274,6 +466,201 @@ class IRCS2SProtocol(IRCCommonProtocol):
         # Alias
         self.handle_squit = self._squit
 
+        # Route mode() through the mode coalescer, which passes calls straight through when
+        # coalescing is disabled.
+        self._mode_buffer_lock = threading.RLock()
+        self._send_mode = self.mode
+        self.mode = self._coalesce_mode
+
+    def _init_vars(self, *args, **kwargs):
+        super()._init_vars(*args, **kwargs)
+
+        # Outgoing mode coalescing: when enabled, mode() calls are buffered per target for
+        # coalesce_modes_delay seconds (or until the current event is done), so that they can be
+        # merged into as few lines as possible.
+        self._coalesce_modes = self.serverdata.get('coalesce_modes', False)
+        self._coalesce_modes_delay = self.serverdata.get('coalesce_modes_delay', 0)
+        # target -> [source, ts, send priority, number of mode() calls, {key: (mode, adding, effective)}]
+        self._mode_buffer = {}
+        self._mode_flush_timer = None
+
+        # Counters for burst lines (SJOIN, FJOIN, BURST, BMASK, etc.): items and lines sent, and how
+        # many lines the protocol module's fixed size chunking would have sent for them instead.
+        self.burst_stats = {'items': 0, 'lines': 0, 'old_lines': 0}
+
+    def _get_burst_packer(self, msgprefix, separator=' '):
+        """
+        Returns a utils.LinePacker for burst lines (SJOIN, FJOIN, BURST, BMASK, etc.) that start
+        with msgprefix, filling each line up to the protocol's S2S_BUFSIZE. msgprefix should
+        include the source prefix, if any.
+        """
+        return utils.LinePacker(msgprefix, self.S2S_BUFSIZE, separator=separator,
+                                encoding=self.encoding)
+
+    def _send_burst_lines(self, command, channel, packer, old_chunk_size=None):
+        """
+        Sends all lines of the given burst packer, and counts them in burst_stats.
+
+        old_chunk_size should be set if the protocol module used to send a fixed amount of items
+        per line here; otherwise, it is assumed that these lines were already wrapped by length.
+        """
+        lines = packer.get_lines()
+        stats = self.burst_stats
+        stats['items'] += packer.count
+        stats['lines'] += len(lines)
+        if old_chunk_size:
+            stats['old_lines'] += max(-(-packer.count // old_chunk_size), len(lines))
+        else:
+            stats['old_lines'] += len(lines)
+        log.debug('(%s) Packed %s item(s) for %s %s into %s line(s)', self.name, packer.count,
+                  command, channel, len(lines))
+        for line in lines:
+            self.send(line)
+
+    def _coalesce_mode(self, source, target, modes, ts=None):
+        """
+        mode() wrapper that buffers mode changes per target when coalescing is enabled. Changes
+        are applied to the state right away; the lines for them are sent by _flush_modes().
+        """
+        if not self._coalesce_modes:
+            return self._send_mode(source, target, modes, ts=ts)
+
+        # Check the call now, since the state is changed long before mode() runs.
+        self._check_mode_args(source, target)
+        source = self._get_mode_source(source, target)
+
+        priority = _send_priority.get()
+        if self.is_channel(target):
+            table = self.cmode_table
+            prefix_rank = table.prefix_rank
+        else:
+            table = self.umode_table
+            prefix_rank = {}
+        mode_types = table.types
+
+        with self._mode_buffer_lock:
+            entry = self._mode_buffer.get(target)
+            if entry is not None and entry[:3] != [source, ts, priority]:
+                # Changes from another sender can't be merged in; send everything pending first
+                # to keep the order.
+                self._flush_modes()
+                entry = None
+            if entry is None:
+                entry = self._mode_buffer[target] = [source, ts, priority, 0, {}]
+                if self._mode_flush_timer is None:
+                    self._mode_flush_timer = self._driver.call_later(self._coalesce_modes_delay,
+                                                                     self._flush_modes)
+            entry[3] += 1
+            pending = entry[4]
+
+            for mode in modes:
+                modechar = mode[0][-1]
+                mtype = 'A' if modechar in prefix_rank else mode_types.get(modechar)
+                if mtype == 'A':
+                    key = (modechar, self.to_lower(mode[1]))
+                else:
+                    key = modechar
+
+                adding = mode[0][0] != '-'
+                old = pending.pop(key, None)
+                if old is not None and mtype in ('A', 'D'):
+                    if old[1] == adding:
+                        pending[key] = old  # Duplicate of a pending change
+                        continue
+                    elif old[2]:
+                        # This undoes an earlier change that took effect (e.g. "+o x" then "-o x"),
+                        # so neither has to be sent.
+                        log.debug('(%s) Dropping cancelled mode changes %s and %s on %s', self.name,
+                                  old[0], mode, target)
+                        self.apply_modes(target, [mode])
+                        continue
+
+                # Only list and flag modes can cancel out, so only check whether those take effect.
+                effective = mtype in ('A', 'D') and \
+                    self._has_mode(target, modechar, mode[1], table) != adding
+                pending[key] = (mode, adding, effective)
+                self.apply_modes(target, [mode])
+
+    def _check_mode_args(self, source, target):
+        """
+        Raises an error if mode() can't send mode changes from the given source to the given
+        target. The mode coalescer calls this before buffering changes; protocols with further
+        restrictions should extend it.
+        """
+        if (not self.is_internal_client(source)) and \
+                (not self.is_internal_server(source)):
+            raise LookupError('No such PyLink client/server exists.')
+
+    def _get_mode_source(self, source, target):
+        """
+        Returns the sender mode() should use for mode changes from the given source. The mode
+        coalescer calls this before applying buffered changes to the state.
+        """
+        return source
+
+    def _has_mode(self, target, modechar, arg, table):
+        """Returns whether the given list/prefix mode or flag mode is set on the target."""
+        if self.is_channel(target):
+            c = self._channels[target]
+            if modechar in table.prefix_rank:
+                return any(arg in c.prefixmodes.get(name, ()) for name in table.names.get(modechar, ()))
+            modes = c.modes
+        else:
+            modes = self.users[target].modes
+
+        if arg is None:
+            return (modechar, None) in modes
+        arg = self.to_lower(arg)
+        return any(char == modechar and modearg is not None and self.to_lower(modearg) == arg
+                   for char, modearg in modes)
+
+    def _flush_modes(self):
+        """Sends all buffered mode changes from the mode coalescer."""
+        with self._mode_buffer_lock:
+            if self._mode_flush_timer is not None:
+                self._mode_flush_timer.cancel()
+                self._mode_flush_timer = None
+            # Take everything out of the buffer before sending, since send() flushes it too.
+            buffered = self._mode_buffer
+            self._mode_buffer = {}
+
+            for target, (source, ts, priority, calls, pending) in buffered.items():
+                if not (self.is_channel(target) or target in self.users):
+                    log.debug('(%s) Dropping coalesced modes for target %s, which no longer exists',
+                              self.name, target)
+                    continue
+                modes = [item[0] for item in pending.values()]
+                log.debug('(%s) Sending %s coalesced mode change(s) for %s from %s mode() call(s)',
+                          self.name, len(modes), target, calls)
+                if modes:
+                    # Errors here would otherwise end up in whichever send() call flushed the
+                    # buffer, and cost us the other targets' changes.
+                    try:
+                        with send_priority(priority):
+                            self._send_mode(source, target, modes, ts=ts)
+                    except Exception:
+                        log.exception('(%s) Failed to send coalesced mode changes %s for %s',
+                                      self.name, modes, target)
+
+    def send(self, *args, **kwargs):
+        """
+        send() wrapper that sends any buffered mode changes first, so that they keep their order
+        relative to other traffic.
+        """
+        if self._mode_buffer:
+            self._flush_modes()
+        super().send(*args, **kwargs)
+
+    def parse_irc_command(self, line):
+        """
+        parse_irc_command() wrapper that flushes buffered mode changes once the event is done,
+        if coalescing is enabled without a delay.
+        """
+        hook_args = super().parse_irc_command(line)
+        if self._mode_buffer and not self._coalesce_modes_delay:
+            self._flush_modes()
+        return hook_args
+
     def handle_events(self, data):
         """Event handler for RFC1459-like protocols.
 
@@ -285,19 +672,12 @@ class IRCS2SProtocol(IRCCommonProtocol):
         Commands sent without an explicit sender prefix will have them set to
         the SID of the uplink server.
         """
-        data = data.split(" ")
-
-        tags = self.parse_message_tags(data)
-        if tags:
-            # If we have message tags, split off the first argument.
-            data = data[1:]
-
-        args = self.parse_args(data)
-
-        sender = args[0]
-        if sender.startswith(':'):
-            sender = sender[1:]
+        line = self.parse_line(data)
+        tags = line.tags
+        args = line.params
 
+        sender = line.prefix
+        if sender is not None:
             # If the sender isn't in numeric format, try to convert it automatically.
             sender_sid = self._get_SID(sender)
             sender_uid = self._get_UID(sender)
@@ -309,17 +689,14 @@ class IRCS2SProtocol(IRCCommonProtocol):
         else:
             # No sender prefix; treat as coming from uplink IRCd.
             sender = self.uplink
-            args.insert(0, sender)
 
-        raw_command = args[1].upper()
-        args = args[2:]
+        raw_command = line.command
 
-        log.debug('(%s) Found message sender as %s, raw_command=%r, args=%r', self.name, sender, raw_command, args)
+        if log.debug_enabled:
+            log.debug('(%s) Found message sender as %s, raw_command=%r, args=%r', self.name, sender, raw_command, args)
 
-        # For P10, convert the command token into a regular command, if present.
-        command = self.COMMAND_TOKENS.get(raw_command, raw_command)
-        if command != raw_command:
-            log.debug('(%s) Translating token %s to command %s', self.name, raw_command, command)
+        # This also converts P10 command tokens into regular commands.
+        command, func = self._get_handler(raw_command)
 
         if self.is_internal_client(sender) or self.is_internal_server(sender):
             log.warning("(%s) Received command %s being routed the wrong way!", self.name, command)
@@ -328,14 +705,12 @@ class IRCS2SProtocol(IRCCommonProtocol):
         if command == 'ENCAP':
             # Special case for TS6 encapsulated commands (ENCAP), in forms like this:
             # <- :00A ENCAP * SU 42XAAAAAC :jlu5
-            command = args[1]
+            command, func = self._get_handler(args[1])
             args = args[2:]
             log.debug("(%s) Rewriting incoming ENCAP to command %s (args: %s)", self.name, command, args)
 
-        try:
-            func = getattr(self, 'handle_'+command.lower())
-        except AttributeError:  # Unhandled command
-            pass
+        if func is None:  # Unhandled command
+            self.unknown_commands[command] += 1
         else:
             parsed_args = func(sender, command, args)
             if parsed_args is not None:
@@ -399,7 +774,7 @@ class IRCS2SProtocol(IRCCommonProtocol):
 
         This is mostly used by PyLink internals to check whether the remote link is up."""
         if self.sid and self.connected.is_set():
-            self._send_with_prefix(self.sid, 'PING %s' % self._expandPUID(self.uplink))
+            self._send_with_prefix(self.sid, 'PING %s' % self._expandPUID(self.uplink), priority=SENDQ_CONTROL)
 
     def quit(self, numeric, reason):
         """Quits a PyLink client."""
@@ -7,10 +7,9 @@ ngircd.py: PyLink protocol module for ngIRCd.
 # and https://tools.ietf.org/html/rfc2813
 ##
 
-import re
 import time
 
-from pylinkirc import __version__, conf, utils
+from pylinkirc import __version__, conf
 from pylinkirc.classes import *
 from pylinkirc.log import log
 from pylinkirc.protocols.ircs2s_common import *
@@ -272,9 +271,12 @@ class NgIRCdProtocol(IRCS2SProtocol):
                                  self._expandPUID(userpair[1]))
 
         if nicks_to_send:
-            # Use 13 args max per line: this is equal to the max of 15 minus the command name and target channel.
-            for message in utils.wrap_arguments(njoin_prefix, nicks_to_send, self.S2S_BUFSIZE, separator=',', max_args_per_line=13):
-                self.send(message)
+            # The nick list is a single comma-separated argument, so only the line length limits
+            # how many nicks fit on one line.
+            packer = self._get_burst_packer(njoin_prefix, separator=',')
+            for nick in nicks_to_send:
+                packer.add(nick)
+            self._send_burst_lines('NJOIN', channel, packer)
 
         if modes:
             # Burst modes separately if there are any.
@@ -497,25 +499,26 @@ class NgIRCdProtocol(IRCS2SProtocol):
         # <- :ngircd.midnight.local NJOIN #test :tester,@%jlu5
 
         channel = args[0]
-        chandata = self._channels[channel].deepcopy()
+        chandata = self._snapshot_channel(channel, command)
         namelist = []
+        changedmodes = []
 
-        # Reverse the modechar->modeprefix mapping for quicker lookup
-        prefixchars = {v: k for k, v in self.prefixmodes.items()}
+        prefix_table = self._get_prefix_table()
+        prefix_chars = ''.join(prefix_table)
         for userpair in args[1].split(','):
-            # Some regex magic to split the prefix from the nick.
-            r = re.search(r'([%s]*)(.*)' % ''.join(self.prefixmodes.values()), userpair)
-            user = self._get_UID(r.group(2))
-            modeprefix = r.group(1)
-
-            if modeprefix:
-                modes = {('+%s' % prefixchars[mode], user) for mode in modeprefix}
-                self.apply_modes(channel, modes)
+            # Split the prefixes from the nick.
+            nick = userpair.lstrip(prefix_chars)
+            user = self._get_UID(nick)
+            for prefix in userpair[:len(userpair)-len(nick)]:
+                changedmodes.append(('+' + prefix_table[prefix], user))
             namelist.append(user)
 
             # Final bits of state tracking. (I hate having to do this everywhere...)
             self.users[user].channels.add(channel)
-            self._channels[channel].users.add(user)
+        self._channels[channel].users.update(namelist)
+
+        if changedmodes:
+            self.apply_modes(channel, changedmodes)
 
         return {'channel': channel, 'users': namelist, 'modes': [], 'channeldata': chandata}
 
@@ -536,7 +539,7 @@ class NgIRCdProtocol(IRCS2SProtocol):
         """
         Handles incoming PINGs (and implicit end of burst).
         """
-        self._send_with_prefix(self.sid, 'PONG %s :%s' % (self._expandPUID(self.sid), args[-1]), queue=False)
+        self._send_with_prefix(self.sid, 'PONG %s :%s' % (self._expandPUID(self.sid), args[-1]), priority=SENDQ_CONTROL)
 
         if not self.servers[source].has_eob:
             # Treat the first PING we receive as end of burst.
@@ -3,13 +3,13 @@ p10.py: P10 protocol module for PyLink, supporting Nefarious IRCu and others.
 """
 
 import base64
+import functools
 import socket
 import string
-import struct
 import time
 from ipaddress import ip_address
 
-from pylinkirc import conf, structures, utils
+from pylinkirc import conf, structures
 from pylinkirc.classes import *
 from pylinkirc.log import log
 from pylinkirc.protocols.ircs2s_common import *
@@ -17,23 +17,43 @@ from pylinkirc.protocols.ircs2s_common import *
 __all__ = ['P10Protocol']
 
 
+# P10 Base64 digits, as documented at
+# https://github.com/evilnet/nefarious2/blob/a29b63144/doc/p10.txt#L69-L92
+P10_B64_CHARS = string.ascii_uppercase + string.ascii_lowercase + string.digits + '[]'
+# Lookup tables used to decode numerics and IPs: digit -> value, and digit pair -> 12-bit value
+_P10_B64_VALUES = {char: value for value, char in enumerate(P10_B64_CHARS)}
+_P10_B64_PAIRS = {char1 + char2: (value1 << 6) | value2
+                  for char1, value1 in _P10_B64_VALUES.items()
+                  for char2, value2 in _P10_B64_VALUES.items()}
+
 class P10UIDGenerator(UIDGenerator):
     """Implements a P10 UID Generator."""
 
     def __init__(self, sid):
-        uidchars = string.ascii_uppercase + string.ascii_lowercase + string.digits + '[]'
         length = 3
-        super().__init__(uidchars, length, sid)
+        super().__init__(P10_B64_CHARS, length, sid)
 
 def p10b64encode(num, length=2):
     """
     Encodes a given numeric using P10 Base64 numeric nicks, as documented at
     https://github.com/evilnet/nefarious2/blob/a29b63144/doc/p10.txt#L69-L92
     """
-    # Pack the given number as an unsigned int.
-    sidbytes = struct.pack('>I', num)[1:]
-    sid = base64.b64encode(sidbytes, b'[]')[-length:]
-    return sid.decode()  # Return a string, not bytes.
+    # Only the lower 24 bits are used, as when packing the number into 3 bytes.
+    num &= 0xFFFFFF
+    return ''.join(P10_B64_CHARS[(num >> shift) & 63] for shift in range(6 * (length - 1), -1, -6))
+
+def p10b64decode(text):
+    """
+    Decodes a P10 Base64 string (e.g. a numeric) into an integer.
+    """
+    pairs = _P10_B64_PAIRS
+    num = 0
+    if len(text) % 2:
+        num = _P10_B64_VALUES[text[0]]
+        text = text[1:]
+    for idx in range(0, len(text), 2):
+        num = (num << 12) | pairs[text[idx:idx+2]]
+    return num
 
 class P10SIDGenerator():
     def __init__(self, irc):
@@ -197,22 +217,17 @@ class P10Protocol(IRCS2SProtocol):
         return num
 
     @staticmethod
+    @functools.lru_cache(maxsize=4096)
     def decode_p10_ip(ip):
         """Decodes a P10 IP."""
         # Many thanks to Jobe @ evilnet for the code on what to do here. :) -jlu5
 
         if len(ip) == 6:  # IPv4
-            # Pad the characters with two \x00's (represented in P10 B64 as AA)
-            ip = 'AA' + ip
-
-            # Decode it via Base64, dropping the initial padding characters.
-            ip = base64.b64decode(ip, altchars='[]')[2:]
-
-            # Convert the IP to a string.
-            return socket.inet_ntoa(ip)
+            # 6 Base64 digits hold 36 bits, the lower 32 of which are the IP.
+            num = p10b64decode(ip) & 0xFFFFFFFF
+            return '%d.%d.%d.%d' % (num >> 24, (num >> 16) & 255, (num >> 8) & 255, num & 255)
 
         elif len(ip) <= 24 or '_' in ip:  # IPv6
-            s = ''
             # P10-encoded IPv6 addresses are formed with chunks, where each 16-bit
             # portion of the address (each part between :'s) is encoded as 3 B64 chars.
             # A single :: is translated into an underscore (_).
@@ -222,27 +237,18 @@ class P10Protocol(IRCS2SProtocol):
             # Treat the part before and after the _ as two separate pieces (head and tail).
             head = ip
             tail = ''
-            byteshead = b''
-            bytestail = b''
-
             if '_' in ip:
                 head, tail = ip.split('_')
 
-            # Each B64-encoded section is 3 characters long. Split them up and
-            # iterate.
-            for section in range(0, len(head), 3):
-                byteshead += base64.b64decode('A' + head[section:section+3], '[]')[1:]
-            for section in range(0, len(tail), 3):
-                bytestail += base64.b64decode('A' + tail[section:section+3], '[]')[1:]
-
-            ipbytes = byteshead
+            # Each B64-encoded section is 3 characters long, of which the lower 16 bits are used.
+            headchunks = [p10b64decode(head[section:section+3]) & 0xFFFF for section in range(0, len(head), 3)]
+            tailchunks = [p10b64decode(tail[section:section+3]) & 0xFFFF for section in range(0, len(tail), 3)]
 
             # Figure out how many 0's the center _ actually represents.
-            # Subtract 16 (the amount of chunks in a v6 address) by
+            # Subtract 8 (the amount of chunks in a v6 address) by
             # the length of the head and tail sections.
-            pad = 16 - len(byteshead) - len(bytestail)
-            ipbytes += (b'\x00' * pad)  # Pad with zeros.
-            ipbytes += bytestail
+            pad = 8 - len(headchunks) - len(tailchunks)
+            ipbytes = b''.join(chunk.to_bytes(2, 'big') for chunk in headchunks + [0] * pad + tailchunks)
 
             ip = socket.inet_ntop(socket.AF_INET6, ipbytes)
             if ip.startswith(':'):
@@ -462,6 +468,22 @@ class P10Protocol(IRCS2SProtocol):
         """Sends a NOTICE from a PyLink client or server."""
         self.message(source, target, text, _notice=True)
 
+    def _check_mode_args(self, source, target):
+        """Checks the sender and target of mode() calls."""
+        super()._check_mode_args(source, target)
+        if not self.is_channel(target):
+            assert target in self.users, "Unknown mode target %s" % target
+
+    def _get_mode_source(self, source, target):
+        """
+        Returns the sender to use for mode changes from the given source: channel modes from
+        clients that aren't op are sent through their server, to prevent mode bounces.
+        """
+        if self.is_channel(target) and (source not in self.servers) and \
+                (not self._channels[target].is_halfop_plus(source)):
+            return self.get_server(source)
+        return source
+
     def mode(self, numeric, target, modes, ts=None):
         """Sends mode changes from a PyLink client/server."""
         # <- ABAAA M jlu5 -w
@@ -485,8 +507,7 @@ class P10Protocol(IRCS2SProtocol):
 
             # Prevent mode bounces by sending our mode through the server if
             # the sender isn't op.
-            if (numeric not in self.servers) and (not cobj.is_halfop_plus(numeric)):
-                numeric = self.get_server(numeric)
+            numeric = self._get_mode_source(numeric, target)
 
             # Wrap modes: start with max bufsize and subtract the lengths of the source, target,
             # mode command, and whitespace.
@@ -548,7 +569,7 @@ class P10Protocol(IRCS2SProtocol):
     def _ping_uplink(self):
         """Sends a PING to the uplink."""
         if self.sid:
-            self._send_with_prefix(self.sid, 'G %s' % self.sid)
+            self._send_with_prefix(self.sid, 'G %s' % self.sid, priority=SENDQ_CONTROL)
 
     def quit(self, numeric, reason):
         """Quits a PyLink client."""
@@ -606,10 +627,11 @@ class P10Protocol(IRCS2SProtocol):
         bans = []
         exempts = []
         regularmodes = []
+        mode_types = self.cmode_table.types
         for mode in modes:
             modechar = mode[0][-1]
             # Store bans and exempts in separate lists for processing, but don't reset bans that have already been set.
-            if modechar in self.cmodes['*A']:
+            if mode_types.get(modechar) == 'A':
                 if (modechar, mode[1]) not in self._channels[channel].modes:
                     if modechar == 'b':
                         bans.append(mode[1])
@@ -622,7 +644,6 @@ class P10Protocol(IRCS2SProtocol):
 
         changedmodes = set(modes)
         changedusers = []
-        namelist = []
 
         # This is annoying because we have to sort our users by access before sending...
         # Joins should look like: A0AAB,A0AAC,ABAAA:v,ABAAB:o,ABAAD,ACAAA:ov
@@ -632,66 +653,37 @@ class P10Protocol(IRCS2SProtocol):
         if regularmodes:
             msgprefix += '%s ' % self.join_modes(regularmodes)
 
+        # Pack all users up to the max buf size to prevent cutoff. Prefix modes carry over to the
+        # following users only within the same line, so the first user of each line must have its
+        # prefixes (if any) attached again.
+        packer = self._get_burst_packer(msgprefix, separator=',')
         last_prefixes = ''
         for userpair in users:
             # We take <users> as a list of (prefixmodes, uid) pairs.
             assert len(userpair) == 2, "Incorrect format of userpair: %r" % userpair
             prefixes, user = userpair
 
-            # Keep track of all the users and modes that are added. namelist is used
-            # to track what we actually send to the IRCd.
+            # Keep track of all the users and modes that are added.
             changedusers.append(user)
             log.debug('(%s) sjoin: adding %s:%s to namelist', self.name, user, prefixes)
 
+            item = user
             if prefixes and prefixes != last_prefixes:
-                namelist.append('%s:%s' % (user, prefixes))
-            else:
-                namelist.append(user)
+                item = '%s:%s' % (user, prefixes)
+            if not packer.fits(item):
+                packer.break_line()
+                if prefixes:
+                    item = '%s:%s' % (user, prefixes)
 
+            packer.add(item)
             last_prefixes = prefixes
             if prefixes:
                 for prefix in prefixes:
                     changedmodes.add(('+%s' % prefix, user))
 
             self.users[user].channels.add(channel)
-        else:
-            if namelist:
-                log.debug('(%s) sjoin: got %r for namelist', self.name, namelist)
-
-                # Flip the (prefixmodes, user) pairs in users, and save it as a dict for easy lookup
-                # later of what modes each target user should have.
-                names_dict = {uid: prefixes for prefixes, uid in users}
-
-                # Wrap all users and send them to prevent cutoff. Subtract 4 off the maximum
-                # buf size to account for user prefix data that may be re-added (e.g. ":ohv")
-                for linenum, wrapped_msg in \
-                        enumerate(utils.wrap_arguments(msgprefix, namelist, self.S2S_BUFSIZE-1-len(self.prefixmodes),
-                                                      separator=',')):
-                    if linenum:  # Implies "if linenum > 0"
-                        # XXX: Ugh, this postprocessing sucks, but we have to make sure that mode prefixes are accounted
-                        # for in the burst.
-                        wrapped_args = self.parse_args(wrapped_msg.split(" "))
-                        wrapped_namelist = wrapped_args[-1].split(',')
-                        log.debug('(%s) sjoin: wrapped args: %s (post-wrap fixing)', self.name,
-                                  wrapped_args)
-
-                        # If the first UID was supposed to have a prefix mode attached, re-add it here
-                        first_uid = wrapped_namelist[0]
-
-                        first_prefix = names_dict.get(first_uid, '')
-                        log.debug('(%s) sjoin: prefixes for first user %s: %s (post-wrap fixing)', self.name,
-                                  first_uid, first_prefix)
-
-                        if (':' not in first_uid) and first_prefix:
-                            log.debug('(%s) sjoin: re-adding prefix %s to user %s (post-wrap fixing)', self.name,
-                                      first_uid, first_prefix)
-                            wrapped_namelist[0] += ':%s' % prefixes
-                            wrapped_msg = ' '.join(wrapped_args[:-1])
-                            wrapped_msg += ' '
-                            wrapped_msg += ','.join(wrapped_namelist)
-
-                    self.send(wrapped_msg)
 
+        self._send_burst_lines('BURST', channel, packer)
         self._channels[channel].users.update(changedusers)
 
         # Technically we can send bans together with the above user introductions, but
@@ -699,13 +691,16 @@ class P10Protocol(IRCS2SProtocol):
         if bans or exempts:
             msgprefix += ':%'  # Ban string starts with a % if there is anything
             if bans:
-                for wrapped_msg in utils.wrap_arguments(msgprefix, bans, self.S2S_BUFSIZE):
-                    self.send(wrapped_msg)
+                packer = self._get_burst_packer(msgprefix)
+                for ban in bans:
+                    packer.add(ban)
+                self._send_burst_lines('BURST', channel, packer)
             if exempts:
                 # Now add exempts, which are separated from the ban list by a single argument "~".
-                msgprefix += ' ~ '
-                for wrapped_msg in utils.wrap_arguments(msgprefix, exempts, self.S2S_BUFSIZE):
-                    self.send(wrapped_msg)
+                packer = self._get_burst_packer(msgprefix + ' ~ ')
+                for exempt in exempts:
+                    packer.add(exempt)
+                self._send_burst_lines('BURST', channel, packer)
 
         self.updateTS(server, channel, ts, changedmodes)
 
@@ -1073,7 +1068,7 @@ class P10Protocol(IRCS2SProtocol):
         if self.is_internal_server(sid):
             # Only respond if the target server is ours. No forwarding is needed because
             # no IRCds can ever connect behind us...
-            self._send_with_prefix(self.sid, 'Z %s %s %s %s' % (target, orig_pingtime, timediff, currtime), queue=False)
+            self._send_with_prefix(self.sid, 'Z %s %s %s %s' % (target, orig_pingtime, timediff, currtime), priority=SENDQ_CONTROL)
 
     def handle_pass(self, source, command, args):
         """Handles authentication with our uplink."""
@@ -1101,25 +1096,41 @@ class P10Protocol(IRCS2SProtocol):
             return
 
         channel = args[0]
-        chandata = self._channels[channel].deepcopy()
+        chandata = self._snapshot_channel(channel, command)
+
+        modestring, members, bans = self._parse_burst_args(args)
+        if modestring:
+            parsedmodes = self.parse_modes(channel, modestring)
+        else:
+            parsedmodes = []
+
+        # Statekeeping with timestamps: membership is added at once, and modes are only applied
+        # if the remote has a lower or equal TS.
+        their_ts = int(args[1])
+        namelist = self.join_users(source, channel, members, their_ts, parsedmodes + bans)
+
+        return {'channel': channel, 'users': namelist, 'modes': parsedmodes, 'ts': their_ts,
+                'channeldata': chandata}
 
+    @staticmethod
+    def _parse_burst_args(args):
+        """
+        Splits the arguments of a BURST command into its modestring arguments (a possibly empty list),
+        a list of (UID, prefix modes) members, and a list of parsed ban and exempt modes.
+        """
         bans = []
         if args[-1].startswith('%'):
             # Ban lists start with a %. However, if one argument is "~",
             # parse everything after it as an ban exempt (+e).
-            exempts = False
+            banmode = '+b'
             for host in args[-1][1:].split(' '):
                 if not host:
                     # Space between % and ~; ignore.
                     continue
                 elif host == '~':
-                    exempts = True
+                    banmode = '+e'
                     continue
-
-                if exempts:
-                    bans.append(('+e', host))
-                else:
-                    bans.append(('+b', host))
+                bans.append((banmode, host))
 
             # Remove this argument from the args list.
             args = args[:-1]
@@ -1127,53 +1138,21 @@ class P10Protocol(IRCS2SProtocol):
         # Then, we can make the modestring just encompass all the text until the end of the string.
         # If no modes are given, this will simply be empty.
         modestring = args[2:-1]
-        if modestring:
-            parsedmodes = self.parse_modes(channel, modestring)
-        else:
-            parsedmodes = []
-
-        changedmodes = set(parsedmodes + bans)
-
-        namelist = []
-        prefixes = ''
-        userlist = args[-1].split(',')
-        log.debug('(%s) handle_burst: got userlist %r for %r', self.name, userlist, channel)
 
+        members = []
         if args[-1] != args[1]:  # Make sure the user list is the right argument (not the TS).
-            for userpair in userlist:
-                # This is given in the form UID1,UID2:prefixes. However, when one userpair is given
-                # with a certain prefix, it implicitly applies to all other following UIDs, until
-                # another userpair is given with a list of prefix modes. For example,
-                # "UID1,UID3:o,UID4,UID5" would assume that UID1 has no prefixes, but that UIDs 3-5
-                # all have op.
-                try:
-                    user, prefixes = userpair.split(':')
-                except ValueError:
-                    user = userpair
-                log.debug('(%s) handle_burst: got mode prefixes %r for user %r', self.name, prefixes, user)
-
-                # Don't crash when we get an invalid UID.
-                if user not in self.users:
-                    log.warning('(%s) handle_burst: tried to introduce user %s not in our user list, ignoring...',
-                                self.name, user)
-                    continue
-
-                namelist.append(user)
-
-                self.users[user].channels.add(channel)
-
-                # Only save mode changes if the remote has lower TS than us.
-                changedmodes |= {('+%s' % mode, user) for mode in prefixes}
-
-                self._channels[channel].users.add(user)
-
-        # Statekeeping with timestamps
-        their_ts = int(args[1])
-        our_ts = self._channels[channel].ts
-        self.updateTS(source, channel, their_ts, changedmodes)
-
-        return {'channel': channel, 'users': namelist, 'modes': parsedmodes, 'ts': their_ts,
-                'channeldata': chandata}
+            # This is given in the form UID1,UID2:prefixes. However, when one userpair is given
+            # with a certain prefix, it implicitly applies to all other following UIDs, until
+            # another userpair is given with a list of prefix modes. For example,
+            # "UID1,UID3:o,UID4,UID5" would assume that UID1 has no prefixes, but that UIDs 3-5
+            # all have op.
+            prefixes = ''
+            for userpair in args[-1].split(','):
+                user, sep, newprefixes = userpair.partition(':')
+                if sep:
+                    prefixes = newprefixes
+                members.append((user, prefixes))
+        return modestring, members, bans
 
     def handle_join(self, source, command, args):
         """Handles incoming JOINs and channel creations."""
@@ -1272,7 +1251,7 @@ class P10Protocol(IRCS2SProtocol):
 
             # Check if each mode matches any that we're unsetting.
             if modechar in modes:
-                if modechar in (self.cmodes['*A']+self.cmodes['*B']+''.join(self.prefixmodes.keys())):
+                if self.cmode_table.types.get(modechar) in ('A', 'B') or modechar in self.prefixmodes:
                     # Mode is a list mode, prefix mode, or one that always takes a parameter when unsetting.
                     changedmodes.append(('-%s' % modechar, data))
                 else:
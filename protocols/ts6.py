@@ -5,13 +5,15 @@ ts6.py: PyLink protocol module for TS6-based IRCds (charybdis, elemental-ircd).
 import re
 import time
 
-from pylinkirc import conf, utils
+from pylinkirc import conf
 from pylinkirc.classes import *
 from pylinkirc.log import log
 from pylinkirc.protocols.ts6_common import TS6BaseProtocol
 
 __all__ = ['TS6Protocol']
 
+_UID_PREFIX_RE = re.compile(r'^[^\d]+')
+
 
 class TS6Protocol(TS6BaseProtocol):
 
@@ -158,12 +160,13 @@ class TS6Protocol(TS6BaseProtocol):
 
         # Get all the ban modes in a separate list. These are bursted using a separate BMASK
         # command.
-        banmodes = {k: [] for k in self.cmodes['*A']}
+        mode_types = self.cmode_table.types
+        banmodes = {k: [] for k in self.cmode_table.list_modes}
         regularmodes = []
         log.debug('(%s) Unfiltered SJOIN modes: %s', self.name, modes)
         for mode in modes:
             modechar = mode[0][-1]
-            if modechar in self.cmodes['*A']:
+            if mode_types.get(modechar) == 'A':
                 # Mode character is one of 'beIq'
                 if (modechar, mode[1]) in self._channels[channel].modes:
                     # Don't reset modes that are already set.
@@ -175,44 +178,44 @@ class TS6Protocol(TS6BaseProtocol):
         log.debug('(%s) Filtered SJOIN modes to be regular modes: %s, banmodes: %s', self.name, regularmodes, banmodes)
 
         changedmodes = modes
-        while users[:12]:
-            uids = []
-            namelist = []
-            # We take <users> as a list of (prefixmodes, uid) pairs.
-            for userpair in users[:12]:
-                assert len(userpair) == 2, "Incorrect format of userpair: %r" % userpair
-                prefixes, user = userpair
-                prefixchars = ''
-                for prefix in prefixes:
-                    pr = self.prefixmodes.get(prefix)
-                    if pr:
-                        prefixchars += pr
-                        changedmodes.add(('+%s' % prefix, user))
-                namelist.append(prefixchars+user)
-                uids.append(user)
-                try:
-                    self.users[user].channels.add(channel)
-                except KeyError:  # Not initialized yet?
-                    log.debug("(%s) sjoin: KeyError trying to add %r to %r's channel list?", self.name, channel, user)
-            users = users[12:]
-            namelist = ' '.join(namelist)
-            self._send_with_prefix(server, "SJOIN {ts} {channel} {modes} :{users}".format(
-                    ts=ts, users=namelist, channel=channel,
-                    modes=self.join_modes(regularmodes)))
-            self._channels[channel].users.update(uids)
-
-        # Now, burst bans.
+        # Fill each SJOIN line up to the message length limit, instead of sending a fixed amount
+        # of users per line.
+        packer = self._get_burst_packer(':{sid} SJOIN {ts} {channel} {modes} :'.format(
+                sid=server, ts=ts, channel=channel, modes=self.join_modes(regularmodes)))
+        uids = []
+        # We take <users> as a list of (prefixmodes, uid) pairs.
+        for userpair in users:
+            assert len(userpair) == 2, "Incorrect format of userpair: %r" % userpair
+            prefixes, user = userpair
+            prefixchars = ''
+            for prefix in prefixes:
+                pr = self.prefixmodes.get(prefix)
+                if pr:
+                    prefixchars += pr
+                    changedmodes.add(('+%s' % prefix, user))
+            packer.add(prefixchars+user)
+            uids.append(user)
+            try:
+                self.users[user].channels.add(channel)
+            except KeyError:  # Not initialized yet?
+                log.debug("(%s) sjoin: KeyError trying to add %r to %r's channel list?", self.name, channel, user)
+        # SJOIN used to be sent 12 users at a time.
+        self._send_burst_lines('SJOIN', channel, packer, old_chunk_size=12)
+        self._channels[channel].users.update(uids)
+
+        # Now, burst bans. The masks all go in the trailing parameter, so only the line length
+        # limits how many fit on one line.
         # <- :42X BMASK 1424222769 #dev b :*!test@*.isp.net *!badident@*
         for bmode, bans in banmodes.items():
-            # Max 15-3 = 12 bans per line to prevent cut off. (TS6 allows a max of 15 parameters per
-            # line)
             if bans:
                 log.debug('(%s) sjoin: bursting mode %s with bans %s, ts:%s', self.name, bmode, bans, ts)
                 msgprefix = ':{sid} BMASK {ts} {channel} {bmode} :'.format(sid=server, ts=ts,
                                                                           channel=channel, bmode=bmode)
-                # Actually, we cut off at 17 arguments/line, since the prefix and command name don't count.
-                for msg in utils.wrap_arguments(msgprefix, bans, self.S2S_BUFSIZE, max_args_per_line=17):
-                    self.send(msg)
+                packer = self._get_burst_packer(msgprefix)
+                for ban in bans:
+                    packer.add(ban)
+                # BMASK used to be capped at 17 arguments (12 masks) per line.
+                self._send_burst_lines('BMASK', channel, packer, old_chunk_size=12)
 
         self.updateTS(server, channel, ts, changedmodes)
 
@@ -472,6 +475,7 @@ class TS6Protocol(TS6BaseProtocol):
             self.cmodes['invex'] = 'I'
         if 'SERVICES' in caps:
             self.cmodes['regonly'] = 'r'
+        self._update_mode_tables()
 
     def handle_ping(self, source, command, args):
         """Handles incoming PING commands."""
@@ -490,7 +494,7 @@ class TS6Protocol(TS6BaseProtocol):
         except IndexError:
             destination = self.sid
         if self.is_internal_server(destination):
-            self._send_with_prefix(destination, 'PONG %s %s' % (destination, source), queue=False)
+            self._send_with_prefix(destination, 'PONG %s %s' % (destination, source), priority=SENDQ_CONTROL)
 
             if not self.servers[source].has_eob:
                 # TS6 endburst is just sending a PING to the other server.
@@ -509,7 +513,7 @@ class TS6Protocol(TS6BaseProtocol):
         # parameters: channelTS, channel, simple modes, opt. mode parameters..., nicklist
         # <- :0UY SJOIN 1451041566 #channel +nt :@0UYAAAAAB
         channel = args[1]
-        chandata = self._channels[channel].deepcopy()
+        chandata = self._snapshot_channel(channel, command)
         userlist = args[-1].split()
 
         modestring = args[2:-1] or args[2]
@@ -520,33 +524,34 @@ class TS6Protocol(TS6BaseProtocol):
         changedmodes = set(parsedmodes)
 
         log.debug('(%s) handle_sjoin: got userlist %r for %r', self.name, userlist, channel)
+        prefix_table = self._get_prefix_table()
+        users = self.users
         for userpair in userlist:
             # charybdis sends this in the form "@+UID1, +UID2, UID3, @UID4"
-            r = re.search(r'([^\d]*)(.*)', userpair)
-            user = r.group(2)
-            modeprefix = r.group(1) or ''
-            finalprefix = ''
-            assert user, 'Failed to get the UID from %r; our regex needs updating?' % userpair
-            log.debug('(%s) handle_sjoin: got modeprefix %r for user %r', self.name, modeprefix, user)
+            # TS6 UIDs always start with a digit, so everything before that is a prefix.
+            if userpair[:1].isdigit():
+                user = userpair
+            else:
+                user = _UID_PREFIX_RE.sub('', userpair, count=1)
+            assert user, 'Failed to get the UID from %r' % userpair
 
             # Don't crash when we get an invalid UID.
-            if user not in self.users:
+            if user not in users:
                 log.debug('(%s) handle_sjoin: tried to introduce user %s not in our user list, ignoring...',
                           self.name, user)
                 continue
 
-            for m in modeprefix:
-                # Iterate over the mapping of prefix chars to prefixes, and
-                # find the characters that match.
-                for char, prefix in self.prefixmodes.items():
-                    if m == prefix:
-                        finalprefix += char
             namelist.append(user)
-            self.users[user].channels.add(channel)
+            users[user].channels.add(channel)
 
             # Only save mode changes if the remote has lower TS than us.
-            changedmodes |= {('+%s' % mode, user) for mode in finalprefix}
-            self._channels[channel].users.add(user)
+            if len(user) != len(userpair):
+                for prefix in userpair[:len(userpair)-len(user)]:
+                    # Ignore prefixes we don't know about.
+                    if prefix in prefix_table:
+                        changedmodes.add(('+' + prefix_table[prefix], user))
+
+        self._channels[channel].users.update(namelist)
 
         # Statekeeping with timestamps
         their_ts = int(args[0])
@@ -3,11 +3,10 @@ unreal.py: UnrealIRCd 4.x-5.x protocol module for PyLink.
 """
 
 import codecs
-import re
 import socket
 import time
 
-from pylinkirc import conf, utils
+from pylinkirc import conf
 from pylinkirc.classes import *
 from pylinkirc.log import log
 from pylinkirc.protocols.ts6_common import TS6BaseProtocol
@@ -18,6 +17,9 @@ __all__ = ['UnrealProtocol']
 SJOIN_PREFIXES = {'q': '*', 'a': '~', 'o': '@', 'h': '%', 'v': '+', 'b': '&', 'e': '"', 'I': "'"}
 
 class UnrealProtocol(TS6BaseProtocol):
+    # Maps the prefixes used in SJOIN nicklists to standard ones.
+    SJOIN_PREFIX_ALIASES = {'*': '~', '~': '&'}
+
     # I'm not sure what the real limit is, but the text posted at
     # https://github.com/jlu5/PyLink/issues/378 suggests 427 characters.
     # https://github.com/unrealircd/unrealircd/blob/4cad9cb/src/modules/m_server.c#L1260 may
@@ -92,6 +94,7 @@ class UnrealProtocol(TS6BaseProtocol):
 
         self.caps = []
         self.prefixmodes = {'q': '~', 'a': '&', 'o': '@', 'h': '%', 'v': '+'}
+        self._update_mode_tables()
 
         self.needed_caps = ["VL", "SID", "CHANMODES", "NOQUIT", "SJ3", "NICKIP", "UMODE2", "SJOIN"]
 
@@ -217,8 +220,9 @@ class UnrealProtocol(TS6BaseProtocol):
 
         # Track simple modes separately.
         simplemodes = set()
+        mode_types = self.cmode_table.types
         for modepair in modes:
-            if modepair[0][-1] in self.cmodes['*A']:
+            if mode_types.get(modepair[0][-1]) == 'A':
                 # Bans, exempts, invex get expanded to forms like "&*!*@some.host" in SJOIN.
 
                 if (modepair[0][-1], modepair[1]) in self._channels[channel].modes:
@@ -240,10 +244,12 @@ class UnrealProtocol(TS6BaseProtocol):
             sjoin_prefix += " %s" % self.join_modes(simplemodes)
 
         sjoin_prefix += " :"
-        # Wrap arguments to the max supported S2S line length to prevent cutoff
+        # Pack arguments up to the max supported S2S line length to prevent cutoff
         # (https://github.com/jlu5/PyLink/issues/378)
-        for line in utils.wrap_arguments(sjoin_prefix, itemlist, self.S2S_BUFSIZE):
-            self.send(line)
+        packer = self._get_burst_packer(sjoin_prefix)
+        for item in itemlist:
+            packer.add(item)
+        self._send_burst_lines('SJOIN', channel, packer)
 
         self._channels[channel].users.update(uids)
 
@@ -254,6 +260,12 @@ class UnrealProtocol(TS6BaseProtocol):
         if self.sid and self.uplink:
             self._send_with_prefix(self.sid, 'PING %s %s' % (self.get_friendly_name(self.sid), self.get_friendly_name(self.uplink)))
 
+    def _check_mode_args(self, source, target):
+        """Checks the sender and target of mode() calls."""
+        super()._check_mode_args(source, target)
+        if not (self.is_channel(target) or self.is_internal_client(target)):
+            raise ProtocolError('Cannot force mode change on external clients!')
+
     def mode(self, numeric, target, modes, ts=None):
         """
         Sends mode changes from a PyLink client/server. The mode list should be
@@ -542,7 +554,7 @@ class UnrealProtocol(TS6BaseProtocol):
 
     def handle_ping(self, numeric, command, args):
         if numeric == self.uplink:
-            self.send('PONG %s :%s' % (self.serverdata['hostname'], args[-1]), queue=False)
+            self.send('PONG %s :%s' % (self.serverdata['hostname'], args[-1]), priority=SENDQ_CONTROL)
 
     def handle_server(self, numeric, command, args):
         """Handles the SERVER command, which is used for both authentication and
@@ -618,6 +630,7 @@ class UnrealProtocol(TS6BaseProtocol):
         # Add in the supported prefix modes.
         self.cmodes.update({'halfop': 'h', 'admin': 'a', 'owner': 'q',
                             'op': 'o', 'voice': 'v'})
+        self._update_mode_tables()
 
     def handle_join(self, numeric, command, args):
         """Handles the UnrealIRCd JOIN command."""
@@ -647,7 +660,7 @@ class UnrealProtocol(TS6BaseProtocol):
         # <- :001 SJOIN 1444361345 #test :001AAAAAA @001AAAAAB +001AAAAAC
         # <- :001 SJOIN 1483250129 #services +nt :+001OR9V02 @*~001DH6901 &*!*@test "*!*@blah.blah '*!*@yes.no
         channel = args[1]
-        chandata = self._channels[channel].deepcopy()
+        chandata = self._snapshot_channel(channel, command)
         userlist = args[-1].split()
 
         namelist = []
@@ -671,51 +684,45 @@ class UnrealProtocol(TS6BaseProtocol):
         except IndexError:
             pass
 
+        # Unreal uses slightly different prefixes in SJOIN. +q is * instead of ~,
+        # and +a is ~ instead of &.
+        prefix_table = self._get_prefix_table(self.SJOIN_PREFIX_ALIASES)
+        users = self.users
         for userpair in userlist:
             # &, ", and ' entries are used for bursting bans:
             # https://www.unrealircd.org/files/docs/technical/serverprotocol.html#S5_1
-            if userpair.startswith("&"):
+            first = userpair[:1]
+            if first == "&":
                 changedmodes.add(('+b', userpair[1:]))
-            elif userpair.startswith('"'):
+            elif first == '"':
                 changedmodes.add(('+e', userpair[1:]))
-            elif userpair.startswith("'"):
+            elif first == "'":
                 changedmodes.add(('+I', userpair[1:]))
             else:
                 # Note: don't be too zealous in matching here or we'll break with nicks
                 # like "[abcd]".
-                r = re.search(r'([~*@%+]*)(.*)', userpair)
-                user = r.group(2)
+                nick = userpair.lstrip('~*@%+')
 
-                if not user:
+                if not nick:
                     # Userpair with no user? Ignore. XXX: find out how this is even possible...
                     # <- :002 SJOIN 1486361658 #idlerpg :@
                     continue
 
-                user = self._get_UID(user)  # Normalize nicks to UIDs for Unreal 3.2 links
-                if user not in self.users:
+                user = self._get_UID(nick)  # Normalize nicks to UIDs for Unreal 3.2 links
+                if user not in users:
                     # Work around a potential race when sending kills on join
                     log.debug("(%s) Ignoring user %s in SJOIN to %s, they don't exist anymore", self.name, user, channel)
                     continue
 
-                # Unreal uses slightly different prefixes in SJOIN. +q is * instead of ~,
-                # and +a is ~ instead of &.
-                modeprefix = (r.group(1) or '').replace("~", "&").replace("*", "~")
-                finalprefix = ''
-
-                log.debug('(%s) handle_sjoin: got modeprefix %r for user %r', self.name, modeprefix, user)
-                for m in modeprefix:
-                    # Iterate over the mapping of prefix chars to prefixes, and
-                    # find the characters that match.
-                    for char, prefix in self.prefixmodes.items():
-                        if m == prefix:
-                            finalprefix += char
                 namelist.append(user)
-                self.users[user].channels.add(channel)
+                users[user].channels.add(channel)
 
                 # Only merge the remote's prefix modes if their TS is smaller or equal to ours.
-                changedmodes |= {('+%s' % mode, user) for mode in finalprefix}
+                for prefix in userpair[:len(userpair)-len(nick)]:
+                    if prefix in prefix_table:
+                        changedmodes.add(('+' + prefix_table[prefix], user))
 
-                self._channels[channel].users.add(user)
+        self._channels[channel].users.update(namelist)
 
         our_ts = self._channels[channel].ts
         their_ts = int(args[0])
@@ -4,27 +4,66 @@ are used internally when available.
 """
 
 import selectors
+import socket
 import threading
 
-from pylinkirc import world
+from pylinkirc import structures, world
 from pylinkirc.log import log
 
-__all__ = ['register', 'unregister', 'start']
+__all__ = ['register', 'unregister', 'set_write_interest', 'call_later', 'call_every', 'wakeup',
+           'start']
 
 
-SELECT_TIMEOUT = 0.5
-
 selector = selectors.DefaultSelector()
 
+# Self-pipe used to interrupt select() when a timer is added or we're shutting down.
+_wakeup_reader, _wakeup_writer = socket.socketpair()
+_wakeup_reader.setblocking(False)
+_wakeup_writer.setblocking(False)
+selector.register(_wakeup_reader, selectors.EVENT_READ, data=None)
+
+def wakeup():
+    """
+    Interrupts the driver's wait for I/O, so that it runs any new timers and notices shutdown
+    right away. This is safe to call from any thread.
+    """
+    try:
+        _wakeup_writer.send(b'\0')
+    except (BlockingIOError, OSError):
+        # The pipe is already full, so the driver will wake up anyway.
+        pass
+
+def _drain_wakeups():
+    """Empties the self-pipe."""
+    try:
+        while _wakeup_reader.recv(4096):
+            pass
+    except BlockingIOError:
+        pass
+
+scheduler = structures.Scheduler(wakeup=wakeup)
+call_later = scheduler.call_later
+call_every = scheduler.call_every
+
 def _process_conns():
-    """Main loop which processes connected sockets."""
+    """Main loop which processes connected sockets and timers."""
 
     while not world.shutting_down.is_set():
-        for socketkey, mask in selector.select(timeout=SELECT_TIMEOUT):
+        # Sleep until either a socket is ready or the next timer is due.
+        timeout = scheduler.run_pending()
+        for socketkey, mask in selector.select(timeout=timeout):
             irc = socketkey.data
+            if irc is None:
+                _drain_wakeups()
+                continue
             try:
+                if mask & selectors.EVENT_WRITE:
+                    irc._flush_outbuf()
                 if mask & selectors.EVENT_READ and not irc._aborted.is_set():
                     irc._run_irc()
+                    # Pending TLS writes may have been waiting for a read.
+                    if irc._outbuf and not irc._want_write:
+                        irc._flush_outbuf()
             except:
                 log.exception('Error in select driver loop:')
                 continue
@@ -35,6 +74,8 @@ def register(irc):
     """
     log.debug('selectdriver: registering %s for network %s', irc._socket, irc.name)
     selector.register(irc._socket, selectors.EVENT_READ, data=irc)
+    # Not all selectors pick up changes made while select() is running.
+    wakeup()
 
 def unregister(irc):
     """
@@ -46,6 +87,22 @@ def unregister(irc):
     else:
         log.debug('selectdriver: skipping de-registering %s for network %s', irc._socket, irc.name)
 
+def set_write_interest(irc, enabled):
+    """
+    Sets whether the selector should wake up when a network's socket becomes writable. Networks
+    enable this only while they have buffered output.
+    """
+    events = selectors.EVENT_READ
+    if enabled:
+        events |= selectors.EVENT_WRITE
+    try:
+        selector.modify(irc._socket, events, data=irc)
+        wakeup()
+    except (KeyError, ValueError):
+        # The socket was unregistered or closed in the meantime.
+        log.debug('selectdriver: not changing events for unregistered socket %s of network %s',
+                  irc._socket, irc.name)
+
 def start():
     """
     Starts a thread to process connections.
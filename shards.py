@@ -0,0 +1,369 @@
+"""
+shards.py - Process-per-shard deployment mode for PyLink.
+
+When "shards" in the pylink: block is set to a number greater than 1, the launcher runs as a
+supervisor process which starts that many worker processes. Each worker is a regular PyLink
+instance that only connects to its share of the configured networks, so that PyLink can use
+more than one CPU core.
+
+Workers talk to the supervisor over a Unix socket (the event bus), using one line of compact JSON
+per event. The bus only carries rehash and shutdown requests, which apply to all shards.
+
+Relaying between shards is not implemented: Relay links channels by spawning clients directly on
+the other networks' objects and keeps its state in memory, so it can only link networks within the
+same shard. Carrying relay traffic over the bus would need Relay's network state and database to
+be shared between processes. Until then, use the "shard" option in server blocks to keep networks
+that share relay channels together; Relay refuses to link to networks on other shards (see
+get_network_shard()).
+"""
+
+import json
+import os
+import selectors
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+import zlib
+
+from . import conf, structures, world
+from .log import log
+
+__all__ = ['shard', 'shard_count', 'is_worker', 'get_shard_count', 'get_shard', 'filter_servers',
+           'assign_servers', 'get_network_shard', 'encode_event', 'notify_supervisor', 'start_worker',
+           'Supervisor']
+
+# Environment variables used to pass shard information on to worker processes.
+ENV_SHARD = 'PYLINK_SHARD'
+ENV_SHARD_COUNT = 'PYLINK_SHARD_COUNT'
+ENV_SHARD_SOCKET = 'PYLINK_SHARD_SOCKET'
+
+# How long (in seconds) the supervisor waits before restarting a worker that exited unexpectedly.
+WORKER_RESTART_DELAY = 5
+# How long (in seconds) the supervisor waits for workers to exit on shutdown before killing them.
+WORKER_SHUTDOWN_TIMEOUT = 15
+
+# The shard this process runs as (None if this isn't a worker), and the total number of shards.
+shard = None
+shard_count = 1
+
+# Maps the names of all configured networks (including those on other shards) to their shard.
+_network_shards = {}
+
+_bus = None
+_bus_lock = threading.Lock()
+_bus_thread = None
+
+def is_worker():
+    """Returns whether this process is a shard worker."""
+    return shard is not None
+
+def get_shard_count(config=None):
+    """Returns the number of shards configured (1 if sharding is disabled)."""
+    config = config or conf.conf
+    try:
+        return max(int(config['pylink'].get('shards', 1)), 1)
+    except (TypeError, ValueError):
+        log.error('Invalid value %r for pylink::shards, disabling sharding', config['pylink'].get('shards'))
+        return 1
+
+def get_shard(network, sdata, count):
+    """Returns the shard number the given network belongs to."""
+    if isinstance(sdata, dict) and sdata.get('shard') is not None:
+        return int(sdata['shard']) % count
+    # Use a stable hash, so that networks stay on the same shard across restarts.
+    return zlib.crc32(network.lower().encode('utf-8')) % count
+
+def filter_servers(servers, shard_num=None, count=None):
+    """
+    Returns the subset of the given server blocks (a dict, as in conf.conf['servers']) that belong
+    to the given shard, defaulting to the current one.
+    """
+    if shard_num is None:
+        shard_num = shard
+    if count is None:
+        count = shard_count
+    return {network: sdata for network, sdata in servers.items()
+            if get_shard(network, sdata, count) == shard_num}
+
+def assign_servers(servers):
+    """
+    Records which shard each of the given server blocks belongs to, and returns the ones belonging
+    to this shard. This is used on startup and rehash in worker processes.
+    """
+    global _network_shards
+    _network_shards = {network: get_shard(network, sdata, shard_count)
+                       for network, sdata in servers.items()}
+    return filter_servers(servers)
+
+def get_network_shard(network):
+    """
+    Returns the shard the given network is assigned to, or None if sharding is disabled or there
+    is no such network.
+    """
+    return _network_shards.get(network)
+
+def encode_event(event_type, **fields):
+    """Serializes an event bus message as a line of compact JSON."""
+    fields['t'] = event_type
+    return json.dumps(fields, separators=(',', ':')).encode('utf-8') + b'\n'
+
+def _read_events(sock, framer):
+    """
+    Reads from an event bus socket, returning a list of decoded events or None if the socket
+    was closed.
+    """
+    try:
+        if not framer.recv_from(sock, 4096):
+            return None
+    except (BlockingIOError, InterruptedError):
+        return []
+    except OSError:
+        return None
+
+    events = []
+    for line in framer.get_lines():
+        try:
+            events.append(json.loads(line))
+        except ValueError:
+            log.warning('shards: ignoring malformed event bus message %r', line)
+    return events
+
+### Worker side
+
+def _send(data):
+    with _bus_lock:
+        _bus.sendall(data)
+
+def notify_supervisor(event_type):
+    """
+    Forwards a rehash or shutdown of this worker to the supervisor, which repeats it on the other
+    shards. Requests that came from the supervisor in the first place are not sent back.
+    """
+    if _bus is not None and threading.current_thread() is not _bus_thread:
+        try:
+            _send(encode_event(event_type, s=shard))
+        except OSError:
+            log.warning('shards: failed to notify supervisor of %s', event_type, exc_info=True)
+
+def _handle_worker_event(event):
+    """Handles an event received by a worker from the supervisor."""
+    from .coremods import control  # Avoid a circular import
+
+    event_type = event.get('t')
+    if event_type == 'rehash':
+        log.info('shards: rehashing at the request of the supervisor')
+        control.rehash()
+    elif event_type == 'shutdown':
+        if not world.shutting_down.is_set():
+            log.info('shards: shutting down at the request of the supervisor')
+            control.shutdown()
+    else:
+        log.warning('shards: ignoring unknown event bus message %r', event)
+
+def _run_worker_bus(sock):
+    """Reads and handles events from the supervisor."""
+    framer = structures.LineFramer()
+    while True:
+        events = _read_events(sock, framer)
+        if events is None:
+            if not world.shutting_down.is_set():
+                from .coremods import control
+                log.error('shards: lost connection to the supervisor, shutting down')
+                control.shutdown()
+            return
+
+        for event in events:
+            try:
+                _handle_worker_event(event)
+            except Exception:
+                log.exception('shards: error handling event bus message %r', event)
+
+def start_worker():
+    """
+    Sets this process up as a shard worker if it was started by a supervisor: only this shard's
+    networks are kept in the config, and the event bus is connected. Returns whether this process
+    is a worker.
+    """
+    global shard, shard_count, _bus, _bus_thread
+    if ENV_SHARD not in os.environ:
+        return False
+
+    shard = int(os.environ[ENV_SHARD])
+    shard_count = int(os.environ[ENV_SHARD_COUNT])
+    conf.conf['servers'] = assign_servers(conf.conf['servers'])
+    log.info('Running as shard %s of %s with networks: %s', shard, shard_count,
+             ', '.join(sorted(conf.conf['servers'])) or '(none)')
+
+    _bus = socket.socket(socket.AF_UNIX)
+    _bus.connect(os.environ[ENV_SHARD_SOCKET])
+    _send(encode_event('hello', s=shard))
+    _bus_thread = threading.Thread(target=_run_worker_bus, args=(_bus,), name='Shard event bus',
+                                   daemon=True)
+    _bus_thread.start()
+    return True
+
+### Supervisor side
+
+class Supervisor():
+    """
+    Starts and watches over the shard worker processes, and passes rehashes and shutdowns between
+    them.
+    """
+    def __init__(self, config_path, count):
+        self.config_path = config_path
+        self.count = count
+        self.socket_path = os.path.join(conf.conf['pylink'].get('pid_dir', ''),
+                                        '%s.shards.sock' % conf.confname)
+
+        self.selector = selectors.DefaultSelector()
+        self.procs = {}
+        self.conns = {}
+        self.restart_at = {}
+        self.stopping = False
+        self.stop_deadline = None
+        self._signals = []
+
+    def _spawn(self, shard_num):
+        """Starts the worker process for the given shard."""
+        env = dict(os.environ)
+        env.update({ENV_SHARD: str(shard_num), ENV_SHARD_COUNT: str(self.count),
+                    ENV_SHARD_SOCKET: self.socket_path})
+        cmd = [sys.executable, '-c', 'from pylinkirc import launcher; launcher.main()',
+               self.config_path, '--no-pid']
+
+        kwargs = {}
+        if world.daemon:
+            # We're detached from the terminal, so the workers should be too.
+            kwargs = {'stdin': subprocess.DEVNULL, 'stdout': subprocess.DEVNULL,
+                      'stderr': subprocess.DEVNULL}
+        self.procs[shard_num] = proc = subprocess.Popen(cmd, env=env, **kwargs)
+        self.restart_at.pop(shard_num, None)
+        log.info('shards: started worker for shard %s (PID %s)', shard_num, proc.pid)
+
+    def broadcast(self, data, exclude=None):
+        """Sends an encoded event to all workers, except the given shard."""
+        for shard_num, sock in list(self.conns.items()):
+            if shard_num == exclude:
+                continue
+            try:
+                sock.sendall(data)
+            except OSError:
+                log.warning('shards: failed to send to shard %s, dropping its connection', shard_num,
+                            exc_info=True)
+                self._close(sock)
+
+    def _close(self, sock):
+        """Closes a worker's event bus connection."""
+        key = self.selector.get_map().get(sock)
+        if key is not None:
+            self.selector.unregister(sock)
+            if key.data.get('shard') is not None:
+                self.conns.pop(key.data['shard'], None)
+        sock.close()
+
+    def shutdown(self):
+        """Shuts down all workers."""
+        if not self.stopping:
+            log.info('shards: shutting down all workers')
+            self.stopping = True
+            self.stop_deadline = time.monotonic() + WORKER_SHUTDOWN_TIMEOUT
+            self.broadcast(encode_event('shutdown'))
+
+    def handle_event(self, conn_data, event):
+        """Handles an event received from a worker."""
+        event_type = event.get('t')
+        origin = conn_data.get('shard')
+        if event_type == 'hello':
+            conn_data['shard'] = origin = event['s']
+            self.conns[origin] = conn_data['sock']
+            log.debug('shards: worker for shard %s connected to the event bus', origin)
+        elif event_type == 'rehash':
+            log.info('shards: shard %s rehashed, rehashing the others', origin)
+            self.broadcast(encode_event('rehash'), exclude=origin)
+        elif event_type == 'shutdown':
+            log.info('shards: shard %s is shutting down', origin)
+            self.shutdown()
+        else:
+            log.warning('shards: ignoring unknown event bus message %r from shard %s', event, origin)
+
+    def _check_workers(self):
+        """Reaps exited workers and restarts them when applicable."""
+        now = time.monotonic()
+        for shard_num, proc in list(self.procs.items()):
+            if proc.poll() is None:
+                if self.stopping and now > self.stop_deadline:
+                    log.warning('shards: worker for shard %s (PID %s) did not stop in time, killing it',
+                                shard_num, proc.pid)
+                    proc.kill()
+                continue
+
+            del self.procs[shard_num]
+            if self.stopping:
+                log.info('shards: worker for shard %s exited', shard_num)
+            else:
+                log.error('shards: worker for shard %s exited unexpectedly (code %s), restarting it in '
+                          '%s seconds', shard_num, proc.returncode, WORKER_RESTART_DELAY)
+                self.restart_at[shard_num] = now + WORKER_RESTART_DELAY
+
+        if not self.stopping:
+            for shard_num, when in list(self.restart_at.items()):
+                if now >= when:
+                    self._spawn(shard_num)
+
+    def _handle_signal(self, signo, _stack_frame):
+        self._signals.append(signo)
+
+    def _process_signals(self):
+        while self._signals:
+            signo = self._signals.pop(0)
+            if signo in (signal.SIGTERM, signal.SIGINT):
+                log.info('shards: shutting down on signal %s', signo)
+                self.shutdown()
+            else:
+                log.info('shards: signal %s received, rehashing all workers', signo)
+                self.broadcast(encode_event('rehash'))
+
+    def run(self):
+        """Runs the supervisor until all workers have shut down."""
+        for signo in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP, signal.SIGUSR1):
+            signal.signal(signo, self._handle_signal)
+
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        listener = socket.socket(socket.AF_UNIX)
+        listener.bind(self.socket_path)
+        listener.listen()
+        self.selector.register(listener, selectors.EVENT_READ, data=None)
+
+        log.info('shards: starting %s workers', self.count)
+        for shard_num in range(self.count):
+            self._spawn(shard_num)
+
+        try:
+            while self.procs or (self.restart_at and not self.stopping):
+                for key, _mask in self.selector.select(timeout=1):
+                    if key.data is None:
+                        sock, _ = listener.accept()
+                        self.selector.register(sock, selectors.EVENT_READ,
+                                               data={'sock': sock, 'shard': None,
+                                                     'framer': structures.LineFramer()})
+                        continue
+
+                    events = _read_events(key.fileobj, key.data['framer'])
+                    if events is None:
+                        self._close(key.fileobj)
+                        continue
+                    for event in events:
+                        self.handle_event(key.data, event)
+
+                self._process_signals()
+                self._check_workers()
+        finally:
+            for sock in list(self.conns.values()):
+                self._close(sock)
+            listener.close()
+            os.unlink(self.socket_path)
+        log.info('shards: all workers have stopped')
@@ -6,21 +6,26 @@ This module contains custom data structures that may be useful in various situat
 
 import collections
 import collections.abc
+import concurrent.futures
+import heapq
 import json
 import os
 import pickle
+import queue
 import string
 import threading
+import time
 from copy import copy, deepcopy
 
-from . import conf
+from . import conf, world
 from .log import log
 
 __all__ = ['KeyedDefaultdict', 'CopyWrapper', 'CaseInsensitiveFixedSet',
           'CaseInsensitiveDict', 'IRCCaseInsensitiveDict',
           'CaseInsensitiveSet', 'IRCCaseInsensitiveSet',
           'CamelCaseToSnakeCase', 'DataStore', 'JSONDataStore',
-          'PickleDataStore']
+          'PickleDataStore', 'LineFramer', 'TokenBucket', 'SendThrottle',
+           'PrioritySendQueue', 'TimerHandle', 'Scheduler', 'HookStats', 'OrderedPool']
 
 
 _BLACKLISTED_COPY_TYPES = []
@@ -203,6 +208,410 @@ class CamelCaseToSnakeCase():
         log.warning('%s.%s is deprecated, considering migrating to %s.%s!', classname, attr, classname, normalized_attr)
         return target
 
+class LineFramer():
+    """
+    Splits a byte stream into lines, reading data into one reusable buffer.
+
+    Line boundaries are found by offset, so each byte is only copied once when it is read
+    and once more when its line is decoded, no matter how many lines arrive at once.
+    """
+    def __init__(self, size=8192):
+        self._buf = bytearray(size)
+        self._view = memoryview(self._buf)
+        self._start = 0  # Start of data that hasn't been returned as a line yet
+        self._end = 0  # End of valid data
+
+    def __len__(self):
+        """Returns the amount of buffered bytes not yet returned as lines."""
+        return self._end - self._start
+
+    def _reserve(self, nbytes):
+        """Makes room for at least nbytes of new data at the end of the buffer."""
+        if self._end + nbytes <= len(self._buf):
+            return
+        pending = self._end - self._start
+        if pending + nbytes > len(self._buf):
+            # Grow the buffer. Resizing a bytearray isn't allowed while a memoryview
+            # is exported, so release the current one first.
+            self._view.release()
+            self._buf.extend(bytes(pending + nbytes - len(self._buf)))
+            self._view = memoryview(self._buf)
+        # Move any partial line to the front of the buffer.
+        self._view[:pending] = self._view[self._start:self._end]
+        self._start = 0
+        self._end = pending
+
+    def recv_from(self, sock, nbytes):
+        """
+        Reads up to nbytes from the given socket directly into the buffer, returning
+        the amount of bytes read.
+        """
+        self._reserve(nbytes)
+        count = sock.recv_into(self._view[self._end:self._end+nbytes], nbytes)
+        self._end += count
+        return count
+
+    def feed(self, data):
+        """Adds the given bytes to the buffer."""
+        self._reserve(len(data))
+        self._view[self._end:self._end+len(data)] = data
+        self._end += len(data)
+
+    def get_lines(self, encoding='utf-8', errors='replace'):
+        """
+        Returns a list of all complete lines in the buffer, decoded using the given encoding.
+        Line endings and carriage returns around them are stripped.
+        """
+        buf = self._buf
+        view = self._view
+        start = self._start
+        end = self._end
+        lines = []
+        while True:
+            idx = buf.find(b'\n', start, end)
+            if idx == -1:
+                break
+
+            linestart = start
+            lineend = idx
+            # Strip \r's around the line, like bytes.strip(b'\r') does
+            while lineend > linestart and buf[lineend-1] == 13:
+                lineend -= 1
+            while linestart < lineend and buf[linestart] == 13:
+                linestart += 1
+
+            lines.append(str(view[linestart:lineend], encoding, errors))
+            start = idx + 1
+
+        if start == end:
+            # Everything's consumed; rewind to the start of the buffer.
+            self._start = self._end = 0
+        else:
+            self._start = start
+        return lines
+
+    def clear(self):
+        """Discards all buffered data."""
+        self._start = self._end = 0
+
+class TokenBucket():
+    """
+    Token bucket rate limiter: tokens refill at a steady rate up to a maximum (the burst size).
+
+    Consuming more tokens than are available is allowed and leaves the bucket in debt, which
+    delays later sends. This keeps the long term rate exact even when items vary in size.
+    """
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self._last = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def consume(self, amount=1):
+        """Takes the given amount of tokens from the bucket."""
+        self._refill()
+        self.tokens -= amount
+
+    def get_delay(self, amount=1):
+        """Returns how long to wait (in seconds) until the given amount of tokens is available."""
+        self._refill()
+        # Never require more than a full bucket, or we'd wait forever.
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0
+        return (amount - self.tokens) / self.rate
+
+class HookStats():
+    """
+    Call counters and timings for one hook function on one hook. Percentiles are computed from
+    the most recent SAMPLE_SIZE calls.
+    """
+    SAMPLE_SIZE = 1024
+    __slots__ = ('calls', 'total', 'max', 'exceptions', 'samples')
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.exceptions = 0
+        self.samples = collections.deque(maxlen=self.SAMPLE_SIZE)
+
+    def add(self, elapsed):
+        """Records one call that took the given amount of seconds."""
+        self.calls += 1
+        self.total += elapsed
+        if elapsed > self.max:
+            self.max = elapsed
+        self.samples.append(elapsed)
+
+    @property
+    def mean(self):
+        return self.total / self.calls if self.calls else 0.0
+
+    def percentile(self, pct):
+        """Returns the given percentile (0-100) of recent call times."""
+        samples = sorted(self.samples)
+        if not samples:
+            return 0.0
+        return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+class OrderedPool():
+    """
+    Bounded thread pool that keeps tasks in order per key: tasks with the same key never run at the
+    same time and run in the order they were submitted, while tasks with different keys can run in
+    parallel. submit() blocks while max_pending tasks are waiting, to push back on the caller.
+    """
+    def __init__(self, max_workers, max_pending, name='pool'):
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers,
+                                                               thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self._queues = {}  # key -> deque of (func, args) waiting to run
+        self._slots = threading.BoundedSemaphore(max_pending)
+
+    def submit(self, key, func, *args):
+        """Schedules func(*args) to run after all earlier tasks with the same key."""
+        self._slots.acquire()
+        with self._lock:
+            tasks = self._queues.get(key)
+            if tasks is not None:
+                # A worker is already running tasks for this key; it'll pick this one up as well.
+                tasks.append((func, args))
+                return
+            self._queues[key] = collections.deque([(func, args)])
+        try:
+            self._executor.submit(self._run, key)
+        except BaseException:
+            # The executor is shutting down: drop this key's tasks (including any queued behind
+            # ours in the meantime), so that the key and its slots aren't stuck forever.
+            with self._lock:
+                tasks = self._queues.pop(key, ())
+            for _ in tasks:
+                self._slots.release()
+            raise
+
+    def _run(self, key):
+        """Runs the tasks queued for the given key, until there are none left."""
+        while True:
+            with self._lock:
+                tasks = self._queues[key]
+                if not tasks:
+                    del self._queues[key]
+                    return
+                func, args = tasks.popleft()
+            try:
+                func(*args)
+            except Exception:
+                log.exception('Unhandled exception caught in pooled task %r', func)
+            finally:
+                self._slots.release()
+
+    def pending(self):
+        """Returns the amount of tasks waiting to run."""
+        with self._lock:
+            return sum(len(tasks) for tasks in self._queues.values())
+
+    def shutdown(self, wait=True):
+        """Shuts down the pool, optionally waiting for all pending tasks to finish."""
+        self._executor.shutdown(wait=wait)
+
+class SendThrottle():
+    """
+    Rate limiter for outgoing lines, combining an optional lines per second and bytes per
+    second token bucket.
+    """
+    def __init__(self, lines_per_sec=None, bytes_per_sec=None, burst=1, burst_bytes=None):
+        self.lines = None
+        self.bytes = None
+        if lines_per_sec:
+            self.lines = TokenBucket(lines_per_sec, max(burst, 1))
+        if bytes_per_sec:
+            self.bytes = TokenBucket(bytes_per_sec, burst_bytes or bytes_per_sec)
+
+    def get_delay(self):
+        """Returns how long to wait (in seconds) before another line may be sent."""
+        delay = 0
+        if self.lines:
+            delay = self.lines.get_delay(1)
+        if self.bytes:
+            # Wait until the bucket is out of debt.
+            delay = max(delay, self.bytes.get_delay(0.001))
+        return delay
+
+    def consume(self, nbytes):
+        """Accounts for a line of the given size being sent."""
+        if self.lines:
+            self.lines.consume(1)
+        if self.bytes:
+            self.bytes.consume(nbytes)
+
+class PrioritySendQueue():
+    """
+    Thread-safe FIFO queue split into priority lanes, each with its own maximum size.
+
+    Items are always taken from the first non-empty lane, in the order the lanes were given.
+    Items within a lane keep their order.
+    """
+    def __init__(self, lanes):
+        """
+        Initializes the queue with lanes, an iterable of (name, maxsize) pairs in descending order
+        of priority. A maxsize <= 0 means the lane is unbounded.
+        """
+        self.mutex = threading.Lock()
+        self.not_empty = threading.Condition(self.mutex)
+        self.maxsizes = collections.OrderedDict(lanes)
+        self.lanes = collections.OrderedDict((name, collections.deque()) for name in self.maxsizes)
+        self._first_lane = self.lanes[next(iter(self.lanes))]
+        self._last_lane = next(reversed(self.lanes))
+
+    def put_nowait(self, item, lane=None):
+        """
+        Adds an item to the given lane (or the lowest priority lane if not specified), raising
+        queue.Full if the lane is full.
+        """
+        lane = lane or self._last_lane
+        with self.mutex:
+            items = self.lanes[lane]
+            if 0 < self.maxsizes[lane] <= len(items):
+                raise queue.Full
+            items.append(item)
+            self.not_empty.notify()
+
+    def _pop(self):
+        for items in self.lanes.values():
+            if items:
+                return items.popleft()
+        raise queue.Empty
+
+    def get(self, block=True, timeout=None):
+        """Removes and returns the next item, waiting for one if block is True."""
+        with self.not_empty:
+            if block:
+                self.not_empty.wait_for(self.qsize, timeout)
+            return self._pop()
+
+    def get_nowait(self):
+        """Removes and returns the next item, raising queue.Empty if there are none."""
+        return self.get(block=False)
+
+    def qsize(self, lane=None):
+        """Returns the amount of items in the given lane, or the whole queue if not specified."""
+        if lane is not None:
+            return len(self.lanes[lane])
+        return sum(len(items) for items in self.lanes.values())
+
+    def clear(self):
+        """Removes all items from the queue."""
+        with self.mutex:
+            for items in self.lanes.values():
+                items.clear()
+
+    def stop(self, item=None, drain=False):
+        """
+        Places an item (a stop marker) ahead of everything else, regardless of lane limits.
+        If drain is True, the item is placed after everything else instead.
+        """
+        with self.mutex:
+            if drain:
+                self.lanes[self._last_lane].append(item)
+            else:
+                self._first_lane.appendleft(item)
+            self.not_empty.notify()
+
+class TimerHandle():
+    """
+    Handle for a job scheduled using a socket driver's call_later() or call_every().
+    """
+    __slots__ = ('when', 'interval', 'func', 'args', 'cancelled')
+
+    def __init__(self, when, func, args, interval=None):
+        self.when = when
+        self.interval = interval
+        self.func = func
+        self.args = args
+        self.cancelled = False
+
+    def __lt__(self, other):
+        return self.when < other.when
+
+    def __repr__(self):
+        return '<TimerHandle %s%s (when=%s, interval=%s)>' % (getattr(self.func, '__qualname__', self.func),
+            ' cancelled' if self.cancelled else '', self.when, self.interval)
+
+    def cancel(self):
+        """Cancels the job. This is a no-op if the job already ran."""
+        self.cancelled = True
+
+    def run(self):
+        """Runs the job, logging any errors."""
+        try:
+            self.func(*self.args)
+        except Exception:
+            log.exception('Error in scheduled job %r:', self)
+
+class Scheduler():
+    """
+    Thread-safe heap of one-shot and periodic jobs, which a socket driver runs from its main loop.
+    """
+    def __init__(self, wakeup=None):
+        """
+        Initializes the scheduler. wakeup is an optional function that interrupts the driver's
+        wait for I/O, called when a job is added that's due before all others.
+        """
+        self._heap = []
+        self._lock = threading.Lock()
+        self._wakeup = wakeup
+
+    def _add(self, handle):
+        with self._lock:
+            heapq.heappush(self._heap, handle)
+            first = self._heap[0] is handle
+        if first and self._wakeup:
+            self._wakeup()
+        return handle
+
+    def call_later(self, delay, func, *args):
+        """Schedules func(*args) to run once after the given delay (in seconds)."""
+        return self._add(TimerHandle(time.monotonic() + delay, func, args))
+
+    def call_every(self, interval, func, *args):
+        """Schedules func(*args) to run every interval seconds, starting interval seconds from now."""
+        return self._add(TimerHandle(time.monotonic() + interval, func, args, interval=interval))
+
+    def __len__(self):
+        return len(self._heap)
+
+    def run_pending(self):
+        """
+        Runs all jobs that are due, and returns the amount of seconds until the next one (or None
+        if there are no jobs left).
+        """
+        now = time.monotonic()
+        while True:
+            with self._lock:
+                if not self._heap:
+                    return None
+                handle = self._heap[0]
+                if handle.cancelled:
+                    heapq.heappop(self._heap)
+                    continue
+                elif handle.when > now:
+                    return handle.when - now
+
+                if handle.interval:
+                    # Reschedule periodic jobs in place, skipping any runs we're too late for.
+                    handle.when += handle.interval
+                    if handle.when <= now:
+                        handle.when = now + handle.interval
+                    heapq.heapreplace(self._heap, handle)
+                else:
+                    heapq.heappop(self._heap)
+            handle.run()
+
 class DataStore:
     """
     Generic database class. Plugins should use a subclass of this such as JSONDataStore or
@@ -230,11 +639,12 @@ class DataStore:
             self.store = {}
         self.store_lock = threading.Lock()
         self.exportdb_timer = None
+        self._save_thread = None
 
         self.load()
 
         if self.save_frequency > 0:
-            # If autosaving is enabled, start the save_callback loop.
+            # If autosaving is enabled, start the save loop.
             self.save_callback(starting=True)
 
     def load(self):
@@ -250,10 +660,30 @@ class DataStore:
         if not starting:
             self.save()
 
-        # schedule saving in a loop.
-        self.exportdb_timer = threading.Timer(self.save_frequency, self.save_callback)
-        self.exportdb_timer.name = 'DataStore {} save_callback loop'.format(self.name)
-        self.exportdb_timer.start()
+        if self.exportdb_timer is None:
+            # Schedule saving in a loop, run by the socket driver.
+            from . import selectdriver  # Avoid a circular import
+            driver = world.driver or selectdriver
+            self.exportdb_timer = driver.call_every(self.save_frequency, self._start_save)
+
+    def _start_save(self):
+        """
+        Saves the database in a separate thread, so that serializing and writing it out never
+        holds up the socket driver loop. This is skipped if the last save is still running.
+        """
+        if self._save_thread is not None and self._save_thread.is_alive():
+            log.debug('(DataStore:%s) skipping autosave, as the last one is still running', self.name)
+            return
+        self._save_thread = threading.Thread(target=self._run_save, daemon=True,
+                                             name='DataStore save thread for %s' % self.name)
+        self._save_thread.start()
+
+    def _run_save(self):
+        """Save thread target."""
+        try:
+            self.save()
+        except Exception:
+            log.exception('(DataStore:%s) failed to save database %s', self.name, self.filename)
 
     def save(self):
         """
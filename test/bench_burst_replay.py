@@ -0,0 +1,70 @@
+"""
+Benchmark for replaying an InspIRCd netburst: a synthetic burst of UID, FJOIN, and FMODE lines is
+fed through InspIRCdProtocol.handle_events() and timed.
+    python3 test/bench_burst_replay.py [users] [channels] [members per channel]
+
+Pass --hooks to bind a no-op JOIN/MODE hook that asks for channeldata, so that channel snapshots
+for hook payloads are taken as they would be with relay loaded.
+"""
+import sys
+import time
+
+from pylinkirc import conf, utils
+from pylinkirc.classes import Server
+from pylinkirc.protocols.inspircd import InspIRCdProtocol
+
+UPLINK = '3IN'
+
+def make_burst(num_users, num_channels, members_per_channel):
+    """Returns the lines of a synthetic insp3 burst."""
+    uids = ['%sAA%05d' % (UPLINK, num) for num in range(num_users)]
+    lines = []
+    for num, uid in enumerate(uids):
+        lines.append(':%s UID %s 1500000000 user%s 10.0.%s.%s host%s.example.net ident 10.0.%s.%s '
+                     '1500000000 +i :Real name' % (UPLINK, uid, num, num // 256 % 256, num % 256,
+                                                   num, num // 256 % 256, num % 256))
+
+    prefixes = ('o', 'v', 'ov', '', '', '', '', '')
+    for chan_num in range(num_channels):
+        members = []
+        for idx in range(members_per_channel):
+            uid = uids[(chan_num * 7 + idx) % num_users]
+            members.append('%s,%s:%s' % (prefixes[idx % len(prefixes)], uid, idx))
+        lines.append(':%s FJOIN #chan%s 1500000000 +nt :%s' % (UPLINK, chan_num, ' '.join(members)))
+        opped = ' '.join(uids[(chan_num * 7 + idx) % num_users] for idx in range(3, 9))
+        lines.append(':%s FMODE #chan%s 1500000000 +hhhvvv %s' % (UPLINK, chan_num, opped))
+    return lines
+
+def make_network():
+    conf.conf['servers']['benchnet']  # Fill in the default server block
+    irc = InspIRCdProtocol('benchnet')
+    irc.servers[UPLINK] = Server(irc, None, 'uplink.example.net')
+    irc.uplink = UPLINK
+    return irc
+
+def main():
+    bind_hooks = '--hooks' in sys.argv
+    args = [int(arg) for arg in sys.argv[1:] if not arg.startswith('--')]
+    num_users, num_channels, members_per_channel = (args + [20000, 200, 500][len(args):])[:3]
+
+    lines = make_burst(num_users, num_channels, members_per_channel)
+    if bind_hooks:
+        for hook in ('JOIN', 'MODE'):
+            utils.add_hook(lambda *args: None, hook, wants_channeldata=True)
+
+    print('Burst: %d users, %d channels x %d members (%d lines)%s' %
+          (num_users, num_channels, members_per_channel, len(lines),
+           ', with hooks bound' if bind_hooks else ''))
+    results = []
+    for _ in range(3):
+        irc = make_network()
+        start = time.perf_counter()
+        for line in lines:
+            irc.handle_events(line)
+        results.append(time.perf_counter() - start)
+    best = min(results)
+    print('Replayed in %.2f ms (%.0f lines/sec, %.0f memberships/sec)' %
+          (best * 1000, len(lines) / best, num_channels * members_per_channel / best))
+
+if __name__ == '__main__':
+    main()
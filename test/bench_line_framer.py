@@ -0,0 +1,64 @@
+"""
+Microbenchmark for structures.LineFramer, comparing it to the old bytearray.split() based
+framing in IRCNetwork._run_irc().
+
+This feeds a 50k line TS6-style netburst through both framers in recv()-sized chunks:
+    python3 test/bench_line_framer.py [chunk size]
+"""
+import sys
+import timeit
+
+from pylinkirc.structures import LineFramer
+
+BURST_LINES = 50000
+
+def make_burst(count=BURST_LINES):
+    """Generates a netburst that looks like one captured from a TS6 uplink."""
+    lines = []
+    for num in range(count):
+        if num % 5 == 4:
+            lines.append(':42X SJOIN 1500000000 #channel%d +nt :@42XAAA%03d +42XAAB%03d 42XAAC%03d'
+                         % (num // 50, num % 1000, num % 999, num % 998))
+        else:
+            lines.append(':42X EUID user%d 1 1500000000 +i ~ident%d host%d.example.net '
+                         '127.0.%d.%d 42XA%05d real.host%d.example.net * :Real name of user %d'
+                         % (num, num, num, num % 256, num % 250, num, num, num))
+    return ('\r\n'.join(lines) + '\r\n').encode('utf-8')
+
+def chunk(data, size):
+    return [data[idx:idx+size] for idx in range(0, len(data), size)]
+
+def split_framer(chunks):
+    """The framing loop used before LineFramer."""
+    buf = bytearray()
+    count = 0
+    for data in chunks:
+        buf += data
+        while b'\n' in buf:
+            line, buf = buf.split(b'\n', 1)
+            line = line.strip(b'\r')
+            line = line.decode('utf-8', 'replace')
+            count += 1
+    return count
+
+def line_framer(chunks):
+    framer = LineFramer()
+    count = 0
+    for data in chunks:
+        framer.feed(data)
+        count += len(framer.get_lines())
+    return count
+
+def main():
+    chunk_size = int(sys.argv[1]) if len(sys.argv) > 1 else 65536
+    data = make_burst()
+    chunks = chunk(data, chunk_size)
+    print('Burst: %d lines, %d bytes, %d chunks of %d bytes' % (BURST_LINES, len(data), len(chunks), chunk_size))
+
+    for func in (split_framer, line_framer):
+        assert func(chunks) == BURST_LINES
+        best = min(timeit.repeat(lambda: func(chunks), number=1, repeat=5))
+        print('%-14s %8.2f ms  (%.0f lines/sec)' % (func.__name__, best * 1000, BURST_LINES / best))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""
+Microbenchmark for IRCCommonProtocol.parse_line(), comparing it to the old tokenizing steps in
+handle_events(): split(" "), parse_message_tags(), and parse_args() / parse_prefixed_args().
+
+This uses the ircdocs/parser-tests corpus (test/parser-tests) when it is checked out, and a
+sample of typical S2S and client lines otherwise:
+    python3 test/bench_line_parser.py [repeat count]
+"""
+from pathlib import Path
+import sys
+import timeit
+
+from pylinkirc.protocols.ircs2s_common import IRCCommonProtocol
+
+PARSER_DATA_PATH = Path(__file__).parent.resolve() / 'parser-tests' / 'tests' / 'msg-split.yaml'
+
+SAMPLE_LINES = [
+    ':42X EUID user1 1 1500000000 +i ~ident host1.example.net 127.0.0.1 42XAAAAAB '
+    'real.host1.example.net * :Real name of user 1',
+    ':42X SJOIN 1500000000 #channel +nt :@42XAAAAAB +42XAAAAAC 42XAAAAAD',
+    ':42XAAAAAB PRIVMSG #channel :Hello world, this is a test message',
+    '@time=2020-01-01T00:00:00.000Z;account=someone :nick!ident@host.example.com PRIVMSG #chan :hi',
+    ':nick!ident@host.example.com MODE #chan +ov  nick1  nick2',
+    'PING :irc.example.com',
+    ':irc.example.com 005 PyLink CHANTYPES=# EXCEPTS INVEX CHANMODES=eIbq,k,flj,CFLMPQScgimnprstz '
+    'CHANLIMIT=#:120 PREFIX=(ov)@+ MAXLIST=bqeI:100 :are supported by this server',
+]
+
+def load_corpus():
+    """Returns the lines to parse: the parser-tests corpus if available, or the sample lines."""
+    try:
+        import yaml
+        with open(PARSER_DATA_PATH) as f:
+            return 'parser-tests', [test['input'] for test in yaml.safe_load(f)['tests']]
+    except (ImportError, OSError):
+        return 'sample', SAMPLE_LINES
+
+def old_parser(lines):
+    """The tokenizing steps handle_events() used before parse_line()."""
+    for line in lines:
+        data = line.split(" ")
+        tags = IRCCommonProtocol.parse_message_tags(data)
+        if tags:
+            data = data[1:]
+        if data[0].startswith(':'):
+            IRCCommonProtocol.parse_prefixed_args(data)
+        else:
+            IRCCommonProtocol.parse_args(data)
+
+def new_parser(lines):
+    for line in lines:
+        IRCCommonProtocol.parse_line(line)
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    name, lines = load_corpus()
+    print('Corpus: %s (%d lines), parsed %d times' % (name, len(lines), repeat))
+
+    total = len(lines) * repeat
+    for func in (old_parser, new_parser):
+        best = min(timeit.repeat(lambda: func(lines), number=repeat, repeat=5))
+        print('%-11s %8.2f ms  (%.0f lines/sec)' % (func.__name__, best * 1000, total / best))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+Benchmark for replaying a P10 (Nefarious) netburst: a synthetic burst of NICK and BURST lines is
+fed through P10Protocol.handle_events() and timed.
+    python3 test/bench_p10_burst.py [users] [channels] [members per channel]
+"""
+import base64
+import socket
+import sys
+import time
+
+from pylinkirc import conf
+from pylinkirc.classes import Server
+from pylinkirc.protocols.p10 import P10Protocol, p10b64encode
+
+UPLINK = 'AB'
+
+def make_burst(num_users, num_channels, members_per_channel):
+    """Returns the lines of a synthetic Nefarious burst."""
+    uids = [UPLINK + p10b64encode(num, length=3) for num in range(num_users)]
+    lines = []
+    for num, uid in enumerate(uids):
+        if num % 4 == 3:  # Some IPv6 users
+            ip = P10Protocol.encode_p10_ipv6('2001:db8:%x::%x' % (num // 65536, num % 65536))
+        else:
+            ip = base64.b64encode(b'\x00\x00' + socket.inet_aton('10.%d.%d.%d' % (num >> 16, (num >> 8) & 255, num & 255)),
+                                  b'[]')[2:].decode()
+
+        if num % 3 == 0:  # Some logged in users
+            modes = '+iwxr account%s:1460000000' % num
+        else:
+            modes = '+iw'
+        lines.append('%s N user%s 1 1460000000 ~ident%s host%s.example.net %s %s %s :Real name' %
+                     (UPLINK, num, num, num, modes, ip, uid))
+
+    prefixes = (':o', ':v', '', ':vo', '', ':o', '', '')
+    for chan_num in range(num_channels):
+        members = []
+        for idx in range(members_per_channel):
+            uid = uids[(chan_num * 7 + idx) % num_users]
+            members.append(uid + prefixes[idx % len(prefixes)])
+        lines.append('%s B #chan%s 1460000000 +ntl 50 %s :%%*!*@bad%s.host ~ *!*@good.host' %
+                     (UPLINK, chan_num, ','.join(members), chan_num))
+    return lines
+
+def make_network():
+    conf.conf['servers']['benchnet'] = {'sidrange': '8-10'}
+    irc = P10Protocol('benchnet')
+    irc.servers[UPLINK] = Server(irc, None, 'uplink.example.net')
+    irc.uplink = UPLINK
+    # The subset of Nefarious modes used in the burst; these are normally set in post_connect()
+    irc.cmodes.update({'banexception': 'e', '*A': 'be', '*B': 'AUk', '*C': 'Ll'})
+    irc.umodes.update({'registered': 'r', 'cloak': 'x', '*C': 'fCcrh', '*D': 'oOiwskgxnqBdDHIRWaXLz'})
+    irc._update_mode_tables()
+    return irc
+
+def main():
+    args = [int(arg) for arg in sys.argv[1:]]
+    num_users, num_channels, members_per_channel = (args + [50000, 1000, 500][len(args):])[:3]
+
+    lines = make_burst(num_users, num_channels, members_per_channel)
+    print('Burst: %d users, %d channels x %d members (%d lines)' %
+          (num_users, num_channels, members_per_channel, len(lines)))
+    results = []
+    for _ in range(3):
+        irc = make_network()
+        start = time.perf_counter()
+        for line in lines:
+            irc.handle_events(line)
+        results.append(time.perf_counter() - start)
+    best = min(results)
+    print('Replayed in %.2f ms (%.0f lines/sec, %.0f memberships/sec)' %
+          (best * 1000, len(lines) / best, num_channels * members_per_channel / best))
+
+if __name__ == '__main__':
+    main()
@@ -5,16 +5,20 @@ import time
 import unittest
 import collections
 import itertools
+import threading
+import unittest.mock
 from unittest.mock import patch
 
-from pylinkirc import conf, world
+from pylinkirc import classes, conf, structures, utils, world
 from pylinkirc.log import log
 from pylinkirc.classes import User, Server, Channel
 
 class DummySocket():
-    def __init__(self):
+    def __init__(self, max_write=None):
         #self.recv_messages = collections.deque()
         self.sent_messages = collections.deque()
+        # Simulates partial writes on non-blocking sockets when set
+        self.max_write = max_write
 
     @staticmethod
     def connect(address):
@@ -33,8 +37,10 @@ class DummySocket():
         raise NotImplementedError
 
     def send(self, data):
+        data = bytes(data[:self.max_write])
         print('->', data)
         self.sent_messages.append(data)
+        return len(data)
 
 class BaseProtocolTest(unittest.TestCase):
     proto_class = None
@@ -650,6 +656,53 @@ class BaseProtocolTest(unittest.TestCase):
         self.p.apply_modes('#Magic', [('-b', '*!*@best.host'), ('-b', '*!*@guest.host'), ('-b', '*!*@test.host')])
         self.assertEqual(c.modes, set(), "Bans should be removed")
 
+    def test_apply_modes_channel_ban_mixed_case(self):
+        c = self.p.channels['#Magic'] = Channel(self.p, name='#Magic')
+        self.p.apply_modes('#Magic', [('+b', '*!*@Test.Host'), ('+b', '*!*@best.host')])
+        self.p.apply_modes('#Magic', [('-b', '*!*@test.host')])
+        self.assertEqual(c.modes, {('b', '*!*@best.host')}, "Ban on *!*@Test.Host should be removed (different case)")
+
+    def test_parse_modes_channel_large_ban_list(self):
+        c = self.p.channels['#bans'] = Channel(self.p, name='#bans')
+        c.modes = {('b', '*!*@host%s.example' % num) for num in range(500)}
+
+        # Adding and removing many bans at once
+        modes = ['+bbb-bbb', '*!*@new1', '*!*@new2', '*!*@new3', '*!*@HOST1.example', '*!*@new2',
+                 '*!*@missing']
+        self.assertEqual(self.p.parse_modes('#bans', modes),
+                         [('+b', '*!*@new1'), ('+b', '*!*@new2'), ('+b', '*!*@new3'),
+                          ('-b', '*!*@host1.example'), ('-b', '*!*@new2')])
+        # parse_modes() shouldn't change the channel's modes
+        self.assertEqual(len(c.modes), 500)
+
+    def test_mode_table(self):
+        table = classes.ModeTable({'ban': 'b', 'key': 'k', 'limit': 'l', 'noextmsg': 'n',
+                                   'topiclock': 't', 'op': 'o', 'voice': 'v', 'quiet': 'q',
+                                   'mute': 'q', '*A': 'bq', '*B': 'k', '*C': 'l', '*D': 'nt'},
+                                  {'o': '@', 'v': '+'})
+        self.assertEqual(table.types, {'b': 'A', 'q': 'A', 'k': 'B', 'l': 'C', 'n': 'D', 't': 'D'})
+        self.assertEqual(table.names['q'], ('quiet', 'mute'))
+        self.assertEqual(table.chars['limit'], 'l')
+        self.assertEqual(table.list_modes, 'bq')
+        self.assertEqual(table.prefix_rank, {'o': 0, 'v': 1})
+        self.assertEqual(table.prefixes, {'@': 'o', '+': 'v'})
+        with self.assertRaises(AttributeError):
+            table.types = {}
+        with self.assertRaises(TypeError):
+            table.types['x'] = 'D'
+
+    def test_cmode_table_rebuild(self):
+        table = self.p.cmode_table
+        self.assertIs(self.p.cmode_table, table)
+
+        # Tables are recompiled once the supported modes change, e.g. after 005 or CAPAB
+        self.p.cmodes['*A'] += 'Z'
+        self.p.prefixmodes = {'q': '~', 'o': '@', 'v': '+'}
+        self.p._update_mode_tables()
+        self.assertIsNot(self.p.cmode_table, table)
+        self.assertEqual(self.p.cmode_table.types['Z'], 'A')
+        self.assertEqual(self.p.cmode_table.prefix_rank, {'q': 0, 'o': 1, 'v': 2})
+
     def test_apply_modes_channel_mode_cycle(self):
         c = self.p.channels['#Magic'] = Channel(self.p, name='#Magic')
         self.p.apply_modes('#Magic', [('+b', '*!*@example.net'), ('-b', '*!*@example.net')])
@@ -709,6 +762,107 @@ class BaseProtocolTest(unittest.TestCase):
         self.assertFalse(c.get_prefix_modes('100'))
         self.assertEqual(c.get_prefix_modes('101'), ['voice'])
 
+    def test_call_hooks_filters(self):
+        calls = []
+        def hook(name):
+            return lambda irc, source, command, args: calls.append(name)
+
+        with patch.dict(world.hooks, clear=True):
+            utils.add_hook(hook('all'), 'PRIVMSG')
+            utils.add_hook(hook('channels'), 'PRIVMSG', priority=200, channels_only=True)
+            utils.add_hook(hook('thisnet'), 'PRIVMSG', networks=[self.p.name])
+            utils.add_hook(hook('othernet'), 'PRIVMSG', networks=['othernet'])
+
+            self.p.call_hooks(['uid1', 'PRIVMSG', {'target': '#chan', 'text': 'hi'}])
+            self.assertEqual(calls, ['channels', 'all', 'thisnet'])
+
+            calls.clear()
+            self.p.call_hooks(['uid1', 'PRIVMSG', {'target': 'uid2', 'text': 'hi'}])
+            self.assertEqual(calls, ['all', 'thisnet'])
+
+    def test_call_hooks_profiling(self):
+        def good_hook(irc, source, command, args):
+            pass
+        def bad_hook(irc, source, command, args):
+            raise ValueError("oops")
+
+        with patch.dict(world.hooks, clear=True), patch.dict(world.hook_stats, clear=True), \
+                patch.multiple(world, hook_profiling=True, hook_timing=True, slow_hook_threshold=0):
+            utils.add_hook(good_hook, 'PRIVMSG')
+            utils.add_hook(bad_hook, 'PRIVMSG')
+            for _ in range(3):
+                self.p.call_hooks(['uid1', 'PRIVMSG', {'target': '#chan', 'text': 'hi'}])
+
+            stats = world.hook_stats[(__name__, 'PRIVMSG')]
+            self.assertEqual(stats.calls, 6)
+            self.assertEqual(stats.exceptions, 3)
+            self.assertGreaterEqual(stats.total, stats.max)
+            self.assertGreaterEqual(stats.percentile(99), stats.percentile(50))
+
+    def test_call_hooks_pooled(self):
+        calls = []
+        def pooled_hook(irc, source, command, args):
+            args['text'] = 'changed'
+            calls.append((threading.current_thread() is not main_thread, args['target']))
+            return False  # Can't stop other hooks
+
+        main_thread = threading.current_thread()
+        pool = structures.OrderedPool(2, 10)
+        with patch.dict(world.hooks, clear=True), \
+                patch.object(utils, '_get_hook_pool', return_value=pool):
+            utils.add_hook(pooled_hook, 'PRIVMSG', priority=200, executor='pool')
+            utils.add_hook(lambda irc, source, command, args: calls.append(args['text']), 'PRIVMSG')
+
+            payloads = [{'target': '#chan', 'text': 'hi'} for _ in range(5)]
+            for payload in payloads:
+                self.p.call_hooks(['uid1', 'PRIVMSG', payload])
+            pool.shutdown()
+
+            # A pool that's shutting down doesn't stop the other hooks from running.
+            with self.assertLogs('pylinkirc', level='ERROR'):
+                self.p.call_hooks(['uid1', 'PRIVMSG', {'target': '#chan', 'text': 'hi'}])
+
+        self.assertEqual(calls.count('hi'), 6)
+        self.assertEqual(calls.count((True, '#chan')), 5)
+        # The pooled hook got a copy of the payload
+        self.assertEqual([payload['text'] for payload in payloads], ['hi'] * 5)
+
+        with self.assertRaises(ValueError):
+            utils.add_hook(pooled_hook, 'PRIVMSG', executor='process')
+
+    def test_join_users(self):
+        c = self.p.channels['#burst'] = Channel(self.p, name='#burst')
+        c.ts = 1500000000
+        u1 = self._make_user('user100', uid='100')
+        self._make_user('user101', uid='101')
+        self._make_user('user102', uid='102')
+
+        # Same TS: modes are merged
+        namelist = self.p.join_users('9PY', '#burst', [('100', 'ov'), ('101', 'v'), ('102', ''),
+                                                       ('unknown', 'o')],
+                                     1500000000, [('+t', None)])
+        self.assertEqual(namelist, ['100', '101', '102'])
+        self.assertEqual(c.users, {'100', '101', '102'})
+        self.assertIn('#burst', u1.channels)
+        self.assertEqual(c.modes, {('t', None)})
+        self.assertEqual(c.prefixmodes['op'], {'100'})
+        self.assertEqual(c.prefixmodes['voice'], {'100', '101'})
+
+        # Higher TS: users join, but their modes are ignored
+        self._make_user('user103', uid='103')
+        self.p.join_users('9PY', '#burst', [('103', 'o')], 1600000000, [('+n', None)])
+        self.assertIn('103', c.users)
+        self.assertEqual(c.prefixmodes['op'], {'100'})
+        self.assertEqual(c.modes, {('t', None)})
+
+        # Lower TS: our modes are cleared and theirs are applied
+        self.p.join_users('9PY', '#burst', [('102', 'o')], 1400000000, [('+n', None)])
+        self.assertEqual(c.ts, 1400000000)
+        self.assertEqual(c.users, {'100', '101', '102', '103'})
+        self.assertEqual(c.prefixmodes['op'], {'102'})
+        self.assertFalse(c.prefixmodes['voice'])
+        self.assertEqual(c.modes, {('n', None)})
+
     def test_apply_modes_user(self):
         u = self._make_user('nick', uid='user')
         self.p.apply_modes('user', [('+o', None), ('+w', None)])
@@ -974,4 +1128,121 @@ class BaseProtocolTest(unittest.TestCase):
             # Check that no users are missing
             self.assertIn('user%s' % num, all_args)
 
+    ### SEND QUEUE
+
+    def test_get_send_batch(self):
+        self.p.serverdata = {'send_batch_bytes': 20}
+        self.p._init_vars()  # Set up the send queue
+        for line in ('PING :a', 'PING :b', 'PING :c', 'PING :d', None, 'PING :e'):
+            self.p._queue.put_nowait(line)
+
+        first = self.p._queue.get_nowait()
+        self.assertEqual(self.p._get_send_batch(first), (['PING :a', 'PING :b', 'PING :c'], False))
+        first = self.p._queue.get_nowait()
+        self.assertEqual(self.p._get_send_batch(first), (['PING :d'], True))
+
+    def test_send_priority(self):
+        self.p._init_vars()
+        self.p.send('UID a')
+        self.p.send('UID b')
+
+        # Higher priority classes skip ahead of the bulk queue.
+        with classes.send_priority(classes.SENDQ_INTERACTIVE):
+            self.p.send('NOTICE x :hello')
+        self.p.send('PING x', priority=classes.SENDQ_CONTROL)
+        self.assertEqual(self.p._get_send_batch(self.p._queue.get_nowait()),
+                         (['PING x', 'NOTICE x :hello', 'UID a', 'UID b'], False))
+
+        self.p._queue.put_nowait('PING y', classes.SENDQ_CONTROL)
+        self.p._queue.stop()
+        self.assertIsNone(self.p._queue.get_nowait())
+
+    def test_reply_priority(self):
+        self._make_user('user1', uid='uid1')
+        self.p.called_in = self.p.called_by = 'uid1'
+        with patch.object(self.p, 'msg') as msg:
+            # Replies keep the caller's priority class unless one is given.
+            self.p.reply('hello')
+            self.assertIsNone(msg.call_args[1]['priority'])
+            self.p.reply('hello', priority=classes.SENDQ_INTERACTIVE)
+            self.assertEqual(msg.call_args[1]['priority'], classes.SENDQ_INTERACTIVE)
+
+    def test_get_send_batch_throttled(self):
+        self.p.serverdata = {'throttle_time': 0.1}
+        self.p._init_vars()
+        self.p._queue.put_nowait('PING :b')
+        self.assertEqual(self.p._get_send_batch('PING :a'), (['PING :a'], False))
+        self.assertGreater(self.p._get_throttle_delay(), 0)
+
+    def test_get_send_batch_token_bucket(self):
+        self.p.serverdata = {'throttle_burst': 3, 'throttle_lines_per_sec': 0.5}
+        self.p._init_vars()
+        for line in ('PING :b', 'PING :c', 'PING :d'):
+            self.p._queue.put_nowait(line)
+
+        # Only the burst size can be sent right away.
+        self.assertEqual(self.p._get_send_batch('PING :a'), (['PING :a', 'PING :b', 'PING :c'], False))
+        self.assertGreater(self.p._get_throttle_delay(), 1)
+
+        # Changing the server block (e.g. on rehash) rebuilds the throttle.
+        self.p.serverdata = {}
+        self.assertEqual(self.p._get_throttle_delay(), 0)
+
+    @patch('pylinkirc.selectdriver.set_write_interest')
+    def test_send_lines(self, set_write_interest):
+        self.p._socket = DummySocket(max_write=10)
+        self.p._send_lines(['PING :a', 'PING :bcdefg'])
+
+        # Whatever the socket didn't take is buffered until the socket is writable again.
+        self.assertEqual(b''.join(self.p._socket.sent_messages), b'PING :a\r\nP')
+        set_write_interest.assert_called_once_with(self.p, True)
+        self.assertFalse(self.p._outbuf_drained.is_set())
+
+        self.p._flush_outbuf()
+        self.p._flush_outbuf()
+        self.assertEqual(b''.join(self.p._socket.sent_messages), b'PING :a\r\nPING :bcdefg\r\n')
+        set_write_interest.assert_called_with(self.p, False)
+        self.assertTrue(self.p._outbuf_drained.is_set())
+
+        self.assertEqual(self.p.write_stats['writes'], 1)
+        self.assertEqual(self.p.write_stats['lines'], 2)
+        self.assertEqual(self.p.write_stats['bytes'], 23)
+
+    ### DISPATCH WORKERS
+
+    def test_process_dispatch(self):
+        self.p.serverdata = {'dispatch_worker': True}
+        self.p._init_vars()
+        dispatch_queue = self.p._dispatch_queue
+        self.assertIsNotNone(dispatch_queue)
+
+        received = time.monotonic() - 2
+        dispatch_queue.put((received, 'PING a'))
+        dispatch_queue.put((received, 'PING b'))
+        dispatch_queue.put(None)
+        dispatch_queue.put((received, 'PING c'))
+
+        with patch.object(self.p, 'parse_irc_command') as parse_irc_command:
+            self.p._process_dispatch(dispatch_queue)
+            self.assertEqual(parse_irc_command.call_count, 2)
+            parse_irc_command.assert_called_with('PING b')
+        self.assertEqual(self.p.dispatch_stats['lines'], 2)
+        self.assertGreaterEqual(self.p.dispatch_stats['max_lag'], 2)
+
+    ### COMMAND DISPATCH
+
+    def test_handle_events_dispatch(self):
+        self.p.handle_foobar = handler = unittest.mock.Mock(return_value={'text': 'b c'})
+        self.p._dispatch_table = None  # Pick up the new handler
+
+        hook_args = self.p.handle_events('FOOBAR a :b c')
+        handler.assert_called_once_with(self.p.uplink, 'FOOBAR', ['a', 'b c'])
+        self.assertEqual(hook_args[1], 'FOOBAR')
+        self.assertEqual(hook_args[2]['text'], 'b c')
+
+        # Commands without a handler are counted.
+        self.assertIsNone(self.p.handle_events('SOMETHINGELSE a'))
+        self.assertIsNone(self.p.handle_events('SOMETHINGELSE b'))
+        self.assertEqual(self.p.unknown_commands['SOMETHINGELSE'], 2)
+
     # TODO: test type coersion if channel or mode targets are ints
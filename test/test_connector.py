@@ -0,0 +1,98 @@
+"""
+Test cases for connector.py
+"""
+
+import asyncio
+import concurrent.futures
+import socket
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+from pylinkirc import connector
+
+
+def _addrinfo(family, ip, port=6667):
+    return (family, socket.SOCK_STREAM, 6, '', (ip, port))
+
+class ConnectorTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.server = socket.socket()
+        self.server.bind(('127.0.0.1', 0))
+        self.server.listen()
+        self.port = self.server.getsockname()[1]
+
+        # Find a port nothing is listening on, for attempts that should fail.
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            self.closed_port = sock.getsockname()[1]
+
+    def tearDown(self):
+        self.server.close()
+
+    def test_interleave_addrinfo(self):
+        addrs = [_addrinfo(socket.AF_INET6, '2001:db8::1'), _addrinfo(socket.AF_INET6, '2001:db8::2'),
+                 _addrinfo(socket.AF_INET6, '2001:db8::3'), _addrinfo(socket.AF_INET, '192.0.2.1'),
+                 _addrinfo(socket.AF_INET, '192.0.2.2')]
+        self.assertEqual([addr[-1][0] for addr in connector.interleave_addrinfo(addrs)],
+                         ['2001:db8::1', '192.0.2.1', '2001:db8::2', '192.0.2.2', '2001:db8::3'])
+
+    def test_resolve(self):
+        addrs = connector.resolve('127.0.0.1', self.port)
+        self.assertEqual(addrs[0][-1], ('127.0.0.1', self.port))
+
+    def test_resolve_timeout(self):
+        done = threading.Event()
+        def _getaddrinfo(host, port, family, type):
+            if family == socket.AF_INET6:
+                time.sleep(0.4)
+                return [_addrinfo(family, '2001:db8::1', port)]
+            done.wait(5)  # A lookup that doesn't answer in time
+
+        pool = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+        try:
+            with patch.object(connector, '_resolver_pool', pool), \
+                    patch.object(connector.socket, 'getaddrinfo', _getaddrinfo):
+                started = time.monotonic()
+                addrs = connector.resolve('irc.example.com', self.port, timeout=0.5)
+                # The timeout covers both lookups, instead of restarting once one of them is done.
+                self.assertLess(time.monotonic() - started, 0.75)
+        finally:
+            done.set()
+            pool.shutdown()
+        self.assertEqual(addrs[0][-1], ('2001:db8::1', self.port))
+
+    def test_connect_fallback(self):
+        attempts = []
+        addrs = [_addrinfo(socket.AF_INET, '127.0.0.1', self.closed_port),
+                 _addrinfo(socket.AF_INET, '127.0.0.1', self.port)]
+        sock, address = connector.connect(addrs, socket.socket, 5, attempts=attempts)
+        with sock:
+            self.assertEqual(address, ('127.0.0.1', self.port))
+            self.assertEqual(len(attempts), 2)
+            self.assertFalse(attempts[0].succeeded)
+            self.assertTrue(attempts[1].succeeded)
+            # The refused attempt shouldn't have held up the next one.
+            self.assertLess(attempts[1].started - attempts[0].started, connector.CONNECT_ATTEMPT_DELAY)
+
+    def test_connect_all_failed(self):
+        attempts = []
+        addrs = [_addrinfo(socket.AF_INET, '127.0.0.1', self.closed_port)]
+        with self.assertRaises(ConnectionRefusedError):
+            connector.connect(addrs, socket.socket, 5, attempts=attempts)
+        self.assertEqual(len(attempts), 1)
+        self.assertIsNotNone(attempts[0].elapsed)
+
+    def test_connect_async_fallback(self):
+        attempts = []
+        addrs = [_addrinfo(socket.AF_INET, '127.0.0.1', self.closed_port),
+                 _addrinfo(socket.AF_INET, '127.0.0.1', self.port)]
+        sock, address = asyncio.run(connector.connect_async(addrs, socket.socket, 5, attempts=attempts))
+        with sock:
+            self.assertEqual(address, ('127.0.0.1', self.port))
+            self.assertEqual([attempt.succeeded for attempt in attempts], [False, True])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -12,6 +12,7 @@ PARSER_DATA_PATH = Path(__file__).parent.resolve() / 'parser-tests' / 'tests'
 print(PARSER_DATA_PATH)
 
 from pylinkirc import utils
+from pylinkirc.classes import ProtocolError
 from pylinkirc.protocols.ircs2s_common import IRCCommonProtocol
 
 class MessageParserTest(unittest.TestCase):
@@ -54,6 +55,10 @@ class MessageParserTest(unittest.TestCase):
                     parts = IRCCommonProtocol.parse_args(inp)
                 self.assertEqual(expected, parts, "Parse test failed for string: %r" % inp)
 
+                line = IRCCommonProtocol.parse_line(inp)
+                self.assertEqual(expected, ([line.prefix] if has_source else []) + [line.command] + line.params,
+                                 "Tokenizer test failed for string: %r" % inp)
+
     @unittest.skip("Not quite working yet")
     def testMessageTags(self):
         for testdata in self.MESSAGE_SPLIT_TEST_DATA['tests']:
@@ -114,5 +119,48 @@ class MessageParserTest(unittest.TestCase):
         self.assertEqual(f(":123LOLWUT MODE  ## +ov  \u3000  checking"),
                          ["123LOLWUT", "MODE", "##", "+ov", "\u3000", "checking"])
 
+class LineTokenizerTest(unittest.TestCase):
+    def testParseLine(self):
+        f = IRCCommonProtocol.parse_line
+        line = f('@aaa=bbb;ccc;example.com/ddd=eee :nick!ident@host.com PRIVMSG me :Hello world')
+        self.assertEqual(line.tags, {'aaa': 'bbb', 'ccc': '', 'example.com/ddd': 'eee'})
+        self.assertEqual(line.prefix, 'nick!ident@host.com')
+        self.assertEqual(line.command, 'PRIVMSG')
+        self.assertEqual(line.params, ['me', 'Hello world'])
+        self.assertEqual(line.trailing, 'Hello world')
+
+        line = f('PING :irc.example.com')
+        self.assertEqual(line.tags, {})
+        self.assertIsNone(line.prefix)
+        self.assertEqual(line.command, 'PING')
+        self.assertEqual(line.params, ['irc.example.com'])
+
+    def testParseLineSpaces(self):
+        f = IRCCommonProtocol.parse_line
+        line = f(':foo  MODE  ## +ov  \u3000  checking')
+        self.assertEqual(line.prefix, 'foo')
+        self.assertEqual(line.command, 'MODE')
+        self.assertEqual(line.params, ['##', '+ov', '\u3000', 'checking'])
+        self.assertIsNone(line.trailing)
+
+        # Empty and colon-containing trailing arguments
+        self.assertEqual(f(':foo TOPIC #test :').params, ['#test', ''])
+        self.assertEqual(f(':foo TOPIC #test ::: hi ').params, ['#test', ':: hi '])
+
+    def testMessageTags(self):
+        tags = IRCCommonProtocol.parse_line(r'@a=b\\and\nk;c=72\s45;d=gh\:764;e;f=x\\s\ foo').tags
+        self.assertEqual(tags['d'], 'gh;764')
+        self.assertEqual(tags, {'a': 'b\\and\nk', 'c': '72 45', 'd': 'gh;764', 'e': '', 'f': 'x\\s'})
+        self.assertNotIn('g', tags)
+
+        # Lines without tags share an empty mapping
+        tags = IRCCommonProtocol.parse_line(':foo PRIVMSG #test :hello').tags
+        self.assertFalse(tags)
+        self.assertIsNone(tags.get('account'))
+
+    def testParseLineNoCommand(self):
+        with self.assertRaises(ProtocolError):
+            IRCCommonProtocol.parse_line(':foo.bar')
+
 if __name__ == '__main__':
     unittest.main()
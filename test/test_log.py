@@ -0,0 +1,115 @@
+"""
+Test cases for log.py
+"""
+
+import logging
+import unittest
+
+from pylinkirc import world
+from pylinkirc.log import PyLinkLogWriter, _update_log_level, log
+
+
+class LogLevelTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.old_console_level = world.console_handler.level
+
+    def tearDown(self):
+        world.console_handler.setLevel(self.old_console_level)
+        _update_log_level()
+
+    def test_update_log_level(self):
+        world.console_handler.setLevel(logging.INFO)
+        _update_log_level()
+        self.assertEqual(log.level, logging.INFO)
+        self.assertFalse(log.debug_enabled)
+
+        world.console_handler.setLevel(logging.DEBUG)
+        _update_log_level()
+        self.assertEqual(log.level, logging.DEBUG)
+        self.assertTrue(log.debug_enabled)
+
+    def test_update_log_level_lowest_handler(self):
+        world.console_handler.setLevel(logging.WARNING)
+        handler = logging.NullHandler(logging.DEBUG)
+        log.addHandler(handler)
+        try:
+            _update_log_level()
+            self.assertEqual(log.level, logging.DEBUG)
+            self.assertTrue(log.debug_enabled)
+        finally:
+            log.removeHandler(handler)
+
+        _update_log_level()
+        self.assertEqual(log.level, logging.WARNING)
+        self.assertFalse(log.debug_enabled)
+
+    def test_update_log_level_notset(self):
+        # Handlers without a level accept everything
+        handler = logging.NullHandler()
+        log.addHandler(handler)
+        try:
+            _update_log_level()
+            self.assertEqual(log.level, 1)
+            self.assertTrue(log.debug_enabled)
+        finally:
+            log.removeHandler(handler)
+
+class CaptureHandler(logging.Handler):
+    def __init__(self, level=logging.NOTSET):
+        super().__init__(level)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append((record.levelno, record.getMessage()))
+
+class LogWriterTestCase(unittest.TestCase):
+
+    def _make_record(self, level, msg, *args):
+        return log.makeRecord(log.name, level, __file__, 0, msg, args, None)
+
+    def test_write(self):
+        writer = PyLinkLogWriter()
+        debug_handler = CaptureHandler()
+        info_handler = CaptureHandler(logging.INFO)
+        writer.add_target(debug_handler)
+        writer.add_target(info_handler)
+        writer.start()
+
+        args = ['a']
+        writer.handle(self._make_record(logging.DEBUG, 'debug %s', args))
+        args.append('b')  # Arguments are copied when the record is queued
+        writer.handle(self._make_record(logging.INFO, 'info %s', 1))
+        writer.stop()
+
+        self.assertEqual(debug_handler.messages, [(logging.DEBUG, "debug ['a']"),
+                                                  (logging.INFO, 'info 1')])
+        self.assertEqual(info_handler.messages, [(logging.INFO, 'info 1')])
+        self.assertFalse(writer._thread.is_alive())
+
+    def test_overflow(self):
+        # The writer thread isn't started here, so that the queue fills up
+        writer = PyLinkLogWriter(maxsize=10)
+        handler = CaptureHandler()
+        writer.add_target(handler)
+
+        for num in range(12):
+            writer.handle(self._make_record(logging.DEBUG, 'debug %s', num))
+        # DEBUG records are dropped once the queue is 90% full
+        self.assertEqual(writer.queue.qsize(), 9)
+        self.assertEqual(writer.dropped, 3)
+
+        for num in range(2):
+            writer.handle(self._make_record(logging.WARNING, 'warning %s', num))
+        self.assertEqual(writer.queue.qsize(), 10)
+        self.assertEqual(writer.dropped, 4)
+
+        writer.stop()
+        expected = [(logging.DEBUG, 'debug %s' % num) for num in range(9)]
+        expected.append((logging.WARNING, 'warning 0'))
+        expected.append((logging.WARNING, 'Dropped 4 log message(s) because the log queue was full '
+                                          '(4 dropped in total)'))
+        self.assertEqual(handler.messages, expected)
+
+if __name__ == '__main__':
+    unittest.main()
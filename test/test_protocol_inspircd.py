@@ -1,5 +1,7 @@
 import unittest
+from unittest.mock import patch
 
+from pylinkirc import classes, utils, world
 from pylinkirc.protocols import inspircd
 
 import protocol_test_fixture as ptf
@@ -7,7 +9,125 @@ import protocol_test_fixture as ptf
 class InspIRCdProtocolTest(ptf.BaseProtocolTest):
     proto_class = inspircd.InspIRCdProtocol
 
-    # In the future we will have protocol specific test cases here
+    def test_handle_fjoin(self):
+        self.p.proto_ver = 1205
+        c = self.p._channels['#test']
+        c.ts = 1556842195
+        for num in range(4):
+            self._make_user('user%s' % num, uid='3INAAAAA%s' % num)
+
+        args = self.p.parse_args('#test 1556842195 +nt :o,3INAAAAA0:4 ov,3INAAAAA1:2 '
+                                 ',3INAAAAA2:1 v,3INUNKNOWN:1'.split())
+        # Hooks that don't ask for channeldata don't make us copy the channel.
+        with patch.dict(world.hooks, {'JOIN': (utils.HookHandler(100, lambda *args: None),)}):
+            hook = self.p.handle_fjoin('3IN', 'FJOIN', args)
+
+        self.assertEqual(hook['users'], ['3INAAAAA0', '3INAAAAA1', '3INAAAAA2'])
+        self.assertEqual(hook['modes'], [('+n', None), ('+t', None)])
+        self.assertEqual(hook['ts'], 1556842195)
+        self.assertIsNone(hook['channeldata'])
+        self.assertEqual(c.users, {'3INAAAAA0', '3INAAAAA1', '3INAAAAA2'})
+        self.assertEqual(c.prefixmodes['op'], {'3INAAAAA0', '3INAAAAA1'})
+        self.assertEqual(c.prefixmodes['voice'], {'3INAAAAA1'})
+        self.assertEqual(c.modes, {('n', None), ('t', None)})
+
+        # A later FJOIN with a higher TS only adds membership
+        with patch.dict(world.hooks, {'JOIN': (utils.HookHandler(100, lambda *args: None, wants_channeldata=True),)}):
+            args = self.p.parse_args('#test 1600000000 +i :o,3INAAAAA3:1'.split())
+            hook = self.p.handle_fjoin('3IN', 'FJOIN', args)
+        self.assertEqual(hook['channeldata'].users, {'3INAAAAA0', '3INAAAAA1', '3INAAAAA2'})
+        self.assertIn('3INAAAAA3', c.users)
+        self.assertNotIn('3INAAAAA3', c.prefixmodes['op'])
+        self.assertEqual(c.modes, {('n', None), ('t', None)})
+
+    def test_handle_fmode(self):
+        c = self.p._channels['#test']
+        c.ts = 1556842195
+        self._make_user('user0', uid='3INAAAAA0')
+        c.users.add('3INAAAAA0')
+
+        hook = self.p.handle_fmode('3IN', 'FMODE', ['#test', '1556842195', '+ov', '3INAAAAA0', '3INAAAAA0'])
+        self.assertEqual(hook['modes'], [('+o', '3INAAAAA0'), ('+v', '3INAAAAA0')])
+        self.assertIsNone(hook['channeldata'])
+        self.assertEqual(c.prefixmodes['op'], {'3INAAAAA0'})
+
+        # Mode changes with a newer TS than ours are dropped.
+        self.assertIsNone(self.p.handle_fmode('3IN', 'FMODE', ['#test', '1600000000', '-o', '3INAAAAA0']))
+        self.assertEqual(c.prefixmodes['op'], {'3INAAAAA0'})
+
+        # An older TS is applied (the channel's TS is only lowered by FJOIN).
+        with patch.dict(world.hooks, {'MODE': (utils.HookHandler(100, lambda *args: None, wants_channeldata=True),)}):
+            hook = self.p.handle_fmode('3IN', 'FMODE', ['#test', '1500000000', '-o', '3INAAAAA0'])
+        self.assertEqual(hook['channeldata'].prefixmodes['op'], {'3INAAAAA0'})
+        self.assertEqual(c.prefixmodes['op'], set())
+        self.assertEqual(c.ts, 1556842195)
+
+    def test_coalesce_modes(self):
+        c = self.p._channels['#test']
+        c.ts = 1556842195
+        self.p.servers['9PY'] = classes.Server(self.p, None, 'pylink.test', internal=True)
+        for num in range(3):
+            self._make_user('user%s' % num, uid='9PYAAAAA%s' % num, sid='9PY')
+        self.p._coalesce_modes = True
+        self.p._coalesce_modes_delay = 60
+
+        sent = []
+        with patch.object(classes.IRCNetwork, 'send', lambda irc, data, **kwargs: sent.append(data)):
+            self.p.mode('9PY', '#test', [('+o', '9PYAAAAA0')])
+            self.p.mode('9PY', '#test', [('+v', '9PYAAAAA1'), ('+l', '10')])
+            self.p.mode('9PY', '#test', [('-o', '9PYAAAAA0'), ('+l', '20')])
+            # Mode changes from a different sender aren't merged
+            self.p.mode('9PYAAAAA2', '9PYAAAAA2', [('+i', None)])
+            self.p.mode('9PYAAAAA2', '9PYAAAAA2', [('+w', None)])
+
+            # The state is updated right away, but nothing is sent until the buffer is flushed
+            self.assertEqual(sent, [])
+            self.assertEqual(c.prefixmodes['op'], set())
+            self.assertEqual(c.prefixmodes['voice'], {'9PYAAAAA1'})
+            self.assertIn(('l', '20'), c.modes)
+
+            # Other traffic sends the buffered modes first
+            self.p.send('PING 9PY')
+            self.assertEqual(sent, [':9PY FMODE #test 1556842195 +vl 9PYAAAAA1 20',
+                                    ':9PYAAAAA2 MODE 9PYAAAAA2 +iw', 'PING 9PY'])
+
+            # Changes that were no-ops don't cancel out later changes
+            sent.clear()
+            self.p.mode('9PY', '#test', [('+v', '9PYAAAAA1')])
+            self.p.mode('9PY', '#test', [('-v', '9PYAAAAA1')])
+            self.p._flush_modes()
+            self.assertEqual(sent, [':9PY FMODE #test 1556842195 -v 9PYAAAAA1'])
+            self.assertEqual(c.prefixmodes['voice'], set())
+
+    def test_coalesce_modes_errors(self):
+        c = self.p._channels['#test']
+        c.ts = 1556842195
+        self.p.servers['9PY'] = classes.Server(self.p, None, 'pylink.test', internal=True)
+        self.p._coalesce_modes = True
+        self.p._coalesce_modes_delay = 60
+
+        sent = []
+        with patch.object(classes.IRCNetwork, 'send', lambda irc, data, **kwargs: sent.append(data)):
+            # Invalid senders are rejected before anything is buffered or applied
+            with self.assertRaises(LookupError):
+                self.p.mode('NOTINTERNAL', '#test', [('+l', '5')])
+            self.assertNotIn(('l', '5'), c.modes)
+            self.assertEqual(self.p._mode_buffer, {})
+
+            # Errors while flushing are logged instead of reaching the caller of send(), and
+            # don't affect other targets
+            self.p.mode('9PY', '#test', [('+l', '5')])
+            self.p.mode('9PY', '#test2', [('+n', None)])
+            real_send_mode = self.p._send_mode
+            def send_mode(source, target, modes, ts=None):
+                if target == '#test':
+                    raise ValueError('test')
+                real_send_mode(source, target, modes, ts=ts)
+            with patch.object(self.p, '_send_mode', send_mode), patch('pylinkirc.protocols.ircs2s_common.log'):
+                self.p.send('PONG x')
+            self.assertEqual(sent[-1], 'PONG x')
+            self.assertEqual(len(sent), 2)
+            self.assertIn(' FMODE #test2 ', sent[0])
 
 if __name__ == '__main__':
     unittest.main()
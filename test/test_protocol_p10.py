@@ -3,7 +3,10 @@ Tests for protocols/p10
 """
 
 import unittest
+from unittest.mock import patch
 
+from pylinkirc import conf
+from pylinkirc.classes import IRCNetwork, Server, User
 from pylinkirc.protocols import p10
 
 class P10UIDGeneratorTest(unittest.TestCase):
@@ -82,5 +85,132 @@ class P10UIDGeneratorTest(unittest.TestCase):
         self.assertTrue(self.uidgen.next_uid())
         self.assertRaises(RuntimeError, self.uidgen.next_uid)
 
+class P10Base64Test(unittest.TestCase):
+    def test_p10b64encode(self):
+        self.assertEqual(p10.p10b64encode(0), 'AA')
+        self.assertEqual(p10.p10b64encode(9), 'AJ')
+        self.assertEqual(p10.p10b64encode(4095), ']]')
+        self.assertEqual(p10.p10b64encode(1, length=3), 'AAB')
+
+    def test_p10b64decode(self):
+        for num in (0, 9, 63, 64, 4095, 262143, 2**24-1):
+            for length in (3, 4):
+                if num < 64**length:
+                    self.assertEqual(p10.p10b64decode(p10.p10b64encode(num, length)), num)
+        self.assertEqual(p10.p10b64decode('B]AAAB'), 0x7F000001)
+
+    def test_decode_p10_ip(self):
+        self.assertEqual(p10.P10Protocol.decode_p10_ip('B]AAAB'), '127.0.0.1')
+        self.assertEqual(p10.P10Protocol.decode_p10_ip('AAAAAA'), '0.0.0.0')
+        self.assertEqual(p10.P10Protocol.decode_p10_ip('D]]]]]'), '255.255.255.255')
+        self.assertEqual(p10.P10Protocol.decode_p10_ip('AABAAC_AAD'), '1:2::3')
+        self.assertEqual(p10.P10Protocol.decode_p10_ip('AAA_AAB'), '0::1')
+        self.assertEqual(p10.P10Protocol.decode_p10_ip('CABA24_AAB'), '2001:db8::1')
+
+    def test_encode_decode_p10_ipv6(self):
+        for ip in ('1:2::3', '2001:db8::1', 'fe80::1:2:3:4', '2001:db8:1:2:3:4:5:6'):
+            self.assertEqual(p10.P10Protocol.decode_p10_ip(p10.P10Protocol.encode_p10_ipv6(ip)), ip)
+
+class P10BurstTest(unittest.TestCase):
+    def setUp(self):
+        with patch.dict(conf.conf['servers'], {'p10test': {'sidrange': '8-10'}}):
+            self.p = p10.P10Protocol('p10test')
+        for uid in ('ABAAA', 'ABAAB', 'ABAAC', 'ABAAD'):
+            self.p.users[uid] = User(self.p, 'nick' + uid, 1460742014, uid, 'AB')
+
+    def test_parse_burst_args(self):
+        args = ['#test', '1460742014', '+tnlk', '10', 'testkey', 'ABAAB,ABAAA:o,ABAAC,ABAAD:vo',
+                '%*!*@bad.host ~ *!*@test.host']
+        self.assertEqual(self.p._parse_burst_args(args),
+                         (['+tnlk', '10', 'testkey'],
+                          [('ABAAB', ''), ('ABAAA', 'o'), ('ABAAC', 'o'), ('ABAAD', 'vo')],
+                          [('+b', '*!*@bad.host'), ('+e', '*!*@test.host')]))
+
+        # No user list
+        self.assertEqual(self.p._parse_burst_args(['#test', '1460742014', '%*!*@bad.host']),
+                         ([], [], [('+b', '*!*@bad.host')]))
+
+    def test_handle_burst(self):
+        c = self.p._channels['#test']
+        c.ts = 1460742014
+        hook = self.p.handle_burst('AB', 'BURST', ['#test', '1460742014', '+tl', '10',
+                                                   'ABAAB,ABAAA:o,ABAAC,ABAAX:v', '%*!*@bad.host'])
+        self.assertEqual(hook['users'], ['ABAAB', 'ABAAA', 'ABAAC'])
+        self.assertEqual(hook['modes'], [('+t', None), ('+l', '10')])
+        self.assertEqual(c.users, {'ABAAA', 'ABAAB', 'ABAAC'})
+        self.assertEqual(c.prefixmodes['op'], {'ABAAA', 'ABAAC'})
+        self.assertEqual(c.prefixmodes['voice'], set())
+        self.assertEqual(c.modes, {('t', None), ('l', '10'), ('b', '*!*@bad.host')})
+
+    def test_sjoin_packing(self):
+        sent = []
+        self.p.send = sent.append
+        self.p.prefixmodes = {'o': '@', 'v': '+'}
+        self.p._update_mode_tables()
+        users = []
+        for num in range(300):
+            uid = 'AC' + p10.p10b64encode(num, length=3)
+            self.p.users[uid] = User(self.p, 'nick' + uid, 1460742014, uid, 'AC')
+            users.append(('o' if num < 150 else '', uid))
+        self.p._channels['#test'].ts = 1460742014
+
+        self.p.sjoin('AC', '#test', users, modes=[('+b', '*!*@bad.host')])
+        self.assertEqual(sent[-1], 'AC B #test 1460742014 :%*!*@bad.host')
+
+        # Each line is filled up to the length limit, and the ops are kept when a line is
+        # wrapped in the middle of them.
+        burst_lines = sent[:-1]
+        self.assertEqual(len(burst_lines), -(-300 * 6 // 480))
+        members = []
+        for line in burst_lines:
+            self.assertLessEqual(len(line), self.p.S2S_BUFSIZE)
+            if line != burst_lines[-1]:
+                self.assertGreater(len(line), self.p.S2S_BUFSIZE - 10)
+            args = line.split(' ')[2:]
+            self.assertEqual(args[:2], ['#test', '1460742014'])
+            members += self.p._parse_burst_args(args)[1]
+        # Users are sent sorted by access, with unprefixed users first
+        self.assertEqual(sorted(members), sorted((uid, prefixes) for prefixes, uid in users))
+        self.assertEqual(members[0], ('ACACW', ''))
+
+class P10ModeTest(unittest.TestCase):
+    def setUp(self):
+        with patch.dict(conf.conf['servers'], {'p10test': {'sidrange': '8-10', 'coalesce_modes': True,
+                                                           'coalesce_modes_delay': 60}}):
+            self.p = p10.P10Protocol('p10test')
+        self.p.sid = 'AB'
+        self.p.servers['AB'] = Server(self.p, None, 'pylink.test', internal=True)
+        self.p.users['ABAAA'] = User(self.p, 'bot', 1460742014, 'ABAAA', 'AB')
+        self.p.prefixmodes = {'o': '@', 'v': '+'}
+        self.p._update_mode_tables()
+        self.p._channels['#test'].ts = 1460742014
+        self.p._channels['#test'].users.add('ABAAA')
+
+    def test_coalesce_modes_source(self):
+        sent = []
+        with patch.object(IRCNetwork, 'send', lambda irc, data, **kwargs: sent.append(data)):
+            # The op check happens before the client's own +o is applied, so the change is sent
+            # through its server.
+            self.p.mode('ABAAA', '#test', [('+o', 'ABAAA')])
+            self.p._flush_modes()
+        self.assertEqual(sent, ['AB M #test +o ABAAA 1460742014'])
+
+        with self.assertRaises(AssertionError):
+            self.p.mode('ABAAA', 'ABXXX', [('+i', None)])
+
+class P10DispatchTest(unittest.TestCase):
+    def setUp(self):
+        with patch.dict(conf.conf['servers'], {'p10test': {'sidrange': '8-10'}}):
+            self.p = p10.P10Protocol('p10test')
+
+    def test_get_handler_tokens(self):
+        self.assertEqual(self.p._get_handler('B'), ('BURST', self.p.handle_burst))
+        self.assertEqual(self.p._get_handler('OM'), ('OPMODE', self.p.handle_opmode))
+        # Full command names work too
+        self.assertEqual(self.p._get_handler('burst'), ('BURST', self.p.handle_burst))
+        # Tokens for unhandled commands are still translated
+        self.assertEqual(self.p._get_handler('LU'), ('LUSERS', None))
+        self.assertEqual(self.p._get_handler('XYZ'), ('XYZ', None))
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,42 @@
+import unittest
+
+from pylinkirc.protocols import ts6
+
+import protocol_test_fixture as ptf
+
+class TS6ProtocolTest(ptf.BaseProtocolTest):
+    proto_class = ts6.TS6Protocol
+
+    def test_handle_sjoin(self):
+        self.p.prefixmodes = {'o': '@', 'v': '+'}
+        self.p._update_mode_tables()
+        for num in range(4):
+            self._make_user('user%s' % num, '001AAAAA%s' % num)
+        self.p._channels['#test'].ts = 1500000000
+
+        # Unknown prefixes are stripped and ignored instead of dropping the user.
+        args = self.p.handle_sjoin('001', 'SJOIN', ['1500000000', '#test', '+nt',
+            '@+001AAAAA0 !001AAAAA1 +001AAAAA2 001AAAAA3 001AAAAA9'])
+        self.assertEqual(args['users'], ['001AAAAA0', '001AAAAA1', '001AAAAA2', '001AAAAA3'])
+
+        chan = self.p.channels['#test']
+        self.assertEqual(chan.users, set(args['users']))
+        self.assertEqual(chan.prefixmodes['op'], {'001AAAAA0'})
+        self.assertEqual(chan.prefixmodes['voice'], {'001AAAAA0', '001AAAAA2'})
+        self.assertIn('#test', self.p.users['001AAAAA1'].channels)
+
+    def test_sjoin_burst_stats(self):
+        sent = []
+        self.p.send = sent.append
+        self.p.prefixmodes = {'o': '@', 'v': '+'}
+        self.p._update_mode_tables()
+        users = [('', self._make_user('user%s' % num, '001AAA%03d' % num).uid) for num in range(30)]
+        self.p._channels['#test'].ts = 1500000000
+
+        self.p.sjoin('001', '#test', users)
+        self.assertEqual(len(sent), 1)
+        # These 30 users used to take 3 lines of 12 users each
+        self.assertEqual(self.p.burst_stats, {'items': 30, 'lines': 1, 'old_lines': 3})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,7 @@
 import unittest
+from unittest.mock import patch
 
+from pylinkirc import utils, world
 from pylinkirc.protocols import unreal
 
 import protocol_test_fixture as ptf
@@ -7,7 +9,37 @@ import protocol_test_fixture as ptf
 class UnrealProtocolTest(ptf.BaseProtocolTest):
     proto_class = unreal.UnrealProtocol
 
-    # In the future we will have protocol specific test cases here
+    def test_handle_sjoin(self):
+        self.p.prefixmodes = {'q': '~', 'a': '&', 'o': '@', 'h': '%', 'v': '+'}
+        self.p.cmodes.update({'owner': 'q', 'admin': 'a', 'halfop': 'h', 'banexception': 'e',
+                              'invex': 'I', '*A': 'beI'})
+        self.p._update_mode_tables()
+        for num in range(4):
+            self._make_user('user%s' % num, '001AAAAA%s' % num)
+        self.p._channels['#test'].ts = 1500000000
+
+        # Unreal uses * for owner and ~ for admin in SJOIN
+        args = self.p.handle_sjoin('001', 'SJOIN', ['1500000000', '#test', '+nt',
+            "*001AAAAA0 ~@001AAAAA1 +001AAAAA2 001AAAAA3 001AAAAA9 &*!*@bad.host \"*!*@good.host"])
+        self.assertEqual(args['users'], ['001AAAAA0', '001AAAAA1', '001AAAAA2', '001AAAAA3'])
+
+        chan = self.p.channels['#test']
+        self.assertEqual(chan.users, set(args['users']))
+        self.assertEqual(chan.prefixmodes['owner'], {'001AAAAA0'})
+        self.assertEqual(chan.prefixmodes['admin'], {'001AAAAA1'})
+        self.assertEqual(chan.prefixmodes['op'], {'001AAAAA1'})
+        self.assertEqual(chan.prefixmodes['voice'], {'001AAAAA2'})
+        self.assertIn(('b', '*!*@bad.host'), chan.modes)
+        self.assertIn(('e', '*!*@good.host'), chan.modes)
+        self.assertIn('#test', self.p.users['001AAAAA3'].channels)
+
+        # Channel state before the SJOIN is only saved if there's a hook to read it.
+        self._make_user('user4', '001AAAAA4')
+        with patch.dict(world.hooks, {'JOIN': (utils.HookHandler(100, lambda *args: None, wants_channeldata=True),)}):
+            args = self.p.handle_sjoin('001', 'SJOIN', ['1500000000', '#test', '@001AAAAA4'])
+        self.assertEqual(args['channeldata'].users, set(['001AAAAA0', '001AAAAA1', '001AAAAA2', '001AAAAA3']))
+        self.assertEqual(args['channeldata'].prefixmodes['op'], {'001AAAAA1'})
+        self.assertEqual(chan.prefixmodes['op'], {'001AAAAA1', '001AAAAA4'})
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,97 @@
+"""
+Test cases for shards.py
+"""
+
+import socket
+import unittest
+from unittest.mock import patch
+
+from pylinkirc import conf, shards, structures
+
+
+class ShardsTestCase(unittest.TestCase):
+
+    def test_get_shard(self):
+        self.assertEqual(shards.get_shard('net', {'shard': 1}, 2), 1)
+        # Shard numbers wrap around if there are fewer shards than expected
+        self.assertEqual(shards.get_shard('net', {'shard': 3}, 2), 1)
+        # Hash based assignment is stable and case insensitive
+        self.assertEqual(shards.get_shard('SomeNet', {}, 4), shards.get_shard('somenet', {}, 4))
+
+    def test_filter_servers(self):
+        servers = {'net%s' % num: {} for num in range(20)}
+        servers['net0'] = {'shard': 0}
+        shard0 = shards.filter_servers(servers, 0, 3)
+        shard1 = shards.filter_servers(servers, 1, 3)
+        shard2 = shards.filter_servers(servers, 2, 3)
+
+        self.assertIn('net0', shard0)
+        self.assertEqual(len(shard0) + len(shard1) + len(shard2), 20)
+        self.assertFalse(set(shard0) & set(shard1))
+
+    def test_assign_servers(self):
+        servers = {'net0': {'shard': 0}, 'net1': {'shard': 1}}
+        with patch.object(shards, 'shard', 1), patch.object(shards, 'shard_count', 2), \
+                patch.object(shards, '_network_shards', {}):
+            self.assertEqual(shards.assign_servers(servers), {'net1': {'shard': 1}})
+            # Networks on other shards are still known
+            self.assertEqual(shards.get_network_shard('net0'), 0)
+            self.assertEqual(shards.get_network_shard('net1'), 1)
+            self.assertIsNone(shards.get_network_shard('missing'))
+
+    def test_read_events(self):
+        sock1, sock2 = socket.socketpair()
+        framer = structures.LineFramer()
+        with sock1, sock2:
+            sock1.sendall(shards.encode_event('event', s=1, n='test', d={'a': [1, 2]}) +
+                          shards.encode_event('rehash'))
+            self.assertEqual(shards._read_events(sock2, framer),
+                             [{'t': 'event', 's': 1, 'n': 'test', 'd': {'a': [1, 2]}},
+                              {'t': 'rehash'}])
+            sock1.close()
+            self.assertIsNone(shards._read_events(sock2, framer))
+
+    def test_shard_file_names(self):
+        with patch.object(conf, 'confname', 'pylink'):
+            with patch.dict('os.environ', {shards.ENV_SHARD: '2'}):
+                self.assertEqual(conf.get_database_name('automode'), 'automode-shard2.db')
+            with patch.dict('os.environ', clear=True):
+                self.assertEqual(conf.get_database_name('automode'), 'automode.db')
+
+class SupervisorTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.supervisor = shards.Supervisor('pylink.yml', 2)
+        self.workers = {}
+        self.conn_data = {}
+        for shard_num in range(2):
+            ours, theirs = socket.socketpair()
+            theirs.setblocking(False)
+            self.workers[shard_num] = theirs
+            self.conn_data[shard_num] = data = {'sock': ours, 'shard': None}
+            self.supervisor.handle_event(data, {'t': 'hello', 's': shard_num})
+
+    def tearDown(self):
+        for sock in self.workers.values():
+            sock.close()
+        for data in self.conn_data.values():
+            data['sock'].close()
+
+    def _recv(self, shard_num):
+        try:
+            return self.workers[shard_num].recv(4096)
+        except BlockingIOError:
+            return b''
+
+    def test_rehash(self):
+        self.supervisor.handle_event(self.conn_data[1], {'t': 'rehash', 's': 1})
+        self.assertEqual(self._recv(0), shards.encode_event('rehash'))
+        self.assertEqual(self._recv(1), b'')
+
+    def test_shutdown(self):
+        self.supervisor.handle_event(self.conn_data[1], {'t': 'shutdown', 's': 1})
+        self.assertTrue(self.supervisor.stopping)
+        self.assertEqual(self._recv(0), shards.encode_event('shutdown'))
+
+if __name__ == '__main__':
+    unittest.main()
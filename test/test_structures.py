@@ -0,0 +1,254 @@
+"""
+Test cases for structures.py
+"""
+
+import queue
+import threading
+import unittest
+
+from pylinkirc import structures
+
+
+class FakeSocket():
+    """Socket stub that hands out the given chunks of data through recv_into()."""
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+
+    def recv_into(self, buf, nbytes):
+        data = self.chunks.pop(0)[:nbytes]
+        buf[:len(data)] = data
+        return len(data)
+
+class LineFramerTestCase(unittest.TestCase):
+
+    def test_single_line(self):
+        framer = structures.LineFramer()
+        framer.feed(b':abc PRIVMSG #test :hello world\r\n')
+        self.assertEqual(framer.get_lines(), [':abc PRIVMSG #test :hello world'])
+        self.assertEqual(len(framer), 0)
+
+    def test_partial_lines(self):
+        framer = structures.LineFramer()
+        framer.feed(b'PING :a\r\nPI')
+        self.assertEqual(framer.get_lines(), ['PING :a'])
+        self.assertEqual(len(framer), 2)
+
+        framer.feed(b'NG :b\r')
+        self.assertEqual(framer.get_lines(), [])
+
+        framer.feed(b'\nPING :c\n\r\nPING :d\r\n')
+        self.assertEqual(framer.get_lines(), ['PING :b', 'PING :c', '', 'PING :d'])
+
+    def test_strip_cr(self):
+        framer = structures.LineFramer()
+        framer.feed(b'\rabcd\r\r\n')
+        self.assertEqual(framer.get_lines(), ['abcd'])
+
+    def test_decoding(self):
+        framer = structures.LineFramer()
+        framer.feed('café\r\n'.encode('utf-8') + b'bad \xff\r\n')
+        self.assertEqual(framer.get_lines(), ['café', 'bad �'])
+
+        framer.feed('café\r\n'.encode('latin-1'))
+        self.assertEqual(framer.get_lines('latin-1'), ['café'])
+
+    def test_buffer_growth(self):
+        framer = structures.LineFramer(size=16)
+        longline = b'x' * 1000
+        framer.feed(b'abc\r\n' + longline[:500])
+        self.assertEqual(framer.get_lines(), ['abc'])
+        framer.feed(longline[500:] + b'\r\n')
+        self.assertEqual(framer.get_lines(), [longline.decode()])
+
+    def test_recv_from(self):
+        framer = structures.LineFramer(size=8)
+        sock = FakeSocket([b'NICK a\r\nNI', b'CK b\r\n', b'NICK c'])
+        self.assertEqual(framer.recv_from(sock, 4096), 10)
+        self.assertEqual(framer.get_lines(), ['NICK a'])
+        self.assertEqual(framer.recv_from(sock, 4096), 6)
+        self.assertEqual(framer.get_lines(), ['NICK b'])
+        framer.recv_from(sock, 4096)
+        self.assertEqual(framer.get_lines(), [])
+
+        framer.clear()
+        self.assertEqual(len(framer), 0)
+
+class TokenBucketTestCase(unittest.TestCase):
+
+    def test_burst(self):
+        bucket = structures.TokenBucket(1, 3)
+        for _ in range(3):
+            self.assertEqual(bucket.get_delay(), 0)
+            bucket.consume()
+        self.assertGreater(bucket.get_delay(), 0.9)
+
+    def test_debt(self):
+        bucket = structures.TokenBucket(100, 100)
+        bucket.consume(300)
+        # Paying back 200 tokens of debt plus one more takes just over 2 seconds.
+        self.assertGreater(bucket.get_delay(), 2)
+        # Requests larger than the bucket only wait for a full bucket.
+        self.assertLess(bucket.get_delay(1000), 3.01)
+
+    def test_send_throttle(self):
+        throttle = structures.SendThrottle(bytes_per_sec=100)
+        self.assertIsNone(throttle.lines)
+        self.assertEqual(throttle.get_delay(), 0)
+        throttle.consume(150)
+        self.assertGreater(throttle.get_delay(), 0.4)
+
+class HookStatsTestCase(unittest.TestCase):
+
+    def test_hook_stats(self):
+        stats = structures.HookStats()
+        self.assertEqual((stats.mean, stats.percentile(99)), (0, 0))
+        for num in range(1, 101):
+            stats.add(num / 1000)
+        self.assertEqual(stats.calls, 100)
+        self.assertAlmostEqual(stats.mean, 0.0505)
+        self.assertEqual(stats.max, 0.1)
+        self.assertEqual(stats.percentile(99), 0.1)
+        self.assertEqual(stats.percentile(50), 0.051)
+
+class OrderedPoolTestCase(unittest.TestCase):
+
+    def test_ordering(self):
+        pool = structures.OrderedPool(4, 100)
+        results = {key: [] for key in range(4)}
+        for num in range(50):
+            for key in range(4):
+                pool.submit(key, results[key].append, num)
+        pool.shutdown()
+        for key in range(4):
+            self.assertEqual(results[key], list(range(50)))
+
+    def test_parallel_and_backpressure(self):
+        pool = structures.OrderedPool(2, 2)
+        blocker = threading.Event()
+        done = []
+        pool.submit('a', blocker.wait)
+        # Tasks for other keys don't wait for a busy key
+        pool.submit('b', done.append, 'b')
+        pool.submit('a', done.append, 'a')
+        self.assertEqual(pool.pending(), 1)
+
+        blocker.set()
+        pool.shutdown()
+        self.assertEqual(sorted(done), ['a', 'b'])
+        self.assertEqual(pool.pending(), 0)
+
+    def test_submit_after_shutdown(self):
+        pool = structures.OrderedPool(1, 1)
+        pool.shutdown()
+        for _ in range(2):
+            # A failed submit doesn't leave the key or its slot behind (or the second one would block).
+            self.assertRaises(RuntimeError, pool.submit, 'a', print)
+        self.assertEqual(pool.pending(), 0)
+
+class PrioritySendQueueTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.queue = structures.PrioritySendQueue([('high', 1), ('low', 2)])
+
+    def test_priority(self):
+        self.queue.put_nowait('a', 'low')
+        self.queue.put_nowait('b', 'low')
+        self.queue.put_nowait('c', 'high')
+        self.assertEqual(self.queue.qsize(), 3)
+        self.assertEqual([self.queue.get() for _ in range(3)], ['c', 'a', 'b'])
+        self.assertRaises(queue.Empty, self.queue.get_nowait)
+        self.assertRaises(queue.Empty, self.queue.get, timeout=0.01)
+
+    def test_maxsize(self):
+        self.queue.put_nowait('a', 'high')
+        self.assertRaises(queue.Full, self.queue.put_nowait, 'b', 'high')
+        # Other lanes have separate limits
+        self.queue.put_nowait('b', 'low')
+        self.assertEqual(self.queue.qsize('low'), 1)
+
+    def test_stop_and_clear(self):
+        self.queue.put_nowait('a', 'high')
+        self.queue.stop()
+        self.assertIsNone(self.queue.get())
+
+        # With drain=True, the stop marker goes after everything queued, even in a full lane
+        self.queue.put_nowait('b', 'low')
+        self.queue.put_nowait('c', 'low')
+        self.queue.stop(drain=True)
+        self.assertEqual([self.queue.get() for _ in range(4)], ['a', 'b', 'c', None])
+
+        self.queue.put_nowait('a', 'high')
+        self.queue.clear()
+        self.assertEqual(self.queue.qsize(), 0)
+
+class SchedulerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.wakeups = 0
+        self.scheduler = structures.Scheduler(wakeup=self._wakeup)
+        self.calls = []
+
+    def _wakeup(self):
+        self.wakeups += 1
+
+    def test_call_later(self):
+        self.assertIsNone(self.scheduler.run_pending())
+        self.scheduler.call_later(0, self.calls.append, 'a')
+        self.scheduler.call_later(60, self.calls.append, 'b')
+        # Only jobs due before all others wake up the driver
+        self.assertEqual(self.wakeups, 1)
+
+        timeout = self.scheduler.run_pending()
+        self.assertEqual(self.calls, ['a'])
+        self.assertGreater(timeout, 59)
+
+    def test_cancel(self):
+        handle = self.scheduler.call_later(0, self.calls.append, 'a')
+        handle.cancel()
+        self.assertIsNone(self.scheduler.run_pending())
+        self.assertEqual(self.calls, [])
+        self.assertEqual(len(self.scheduler), 0)
+
+    def test_call_every(self):
+        handle = self.scheduler.call_every(10, self.calls.append, 'a')
+        handle.when -= 25  # Pretend we're late by a few runs
+        self.scheduler.run_pending()
+        # Missed runs are skipped instead of being run all at once.
+        self.assertEqual(self.calls, ['a'])
+        self.assertAlmostEqual(self.scheduler.run_pending(), 10, delta=1)
+
+    def test_errors_are_logged(self):
+        self.scheduler.call_later(0, lambda: 1/0)
+        self.scheduler.call_later(0, self.calls.append, 'a')
+        with self.assertLogs('pylinkirc', level='ERROR'):
+            self.scheduler.run_pending()
+        self.assertEqual(self.calls, ['a'])
+
+class DataStoreTestCase(unittest.TestCase):
+
+    def test_autosave_thread(self):
+        saved = threading.Event()
+        blocker = threading.Event()
+        save_threads = []
+
+        class TestDataStore(structures.DataStore):
+            def load(self):
+                pass
+
+            def save(self):
+                save_threads.append(threading.current_thread())
+                saved.set()
+                blocker.wait(5)
+
+        db = TestDataStore('test', 'test.db', save_frequency=-1)
+        # Autosaves run off the calling (driver) thread, and don't pile up.
+        db._start_save()
+        self.assertTrue(saved.wait(5))
+        db._start_save()
+        blocker.set()
+        db._save_thread.join(5)
+        self.assertEqual(len(save_threads), 1)
+        self.assertIsNot(save_threads[0], threading.current_thread())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,8 +3,9 @@ Test cases for utils.py
 """
 
 import unittest
+from unittest.mock import patch
 
-from pylinkirc import utils
+from pylinkirc import utils, world
 
 
 class UtilsTestCase(unittest.TestCase):
@@ -271,5 +272,46 @@ class UtilsTestCase(unittest.TestCase):
         with self.assertRaises(ValueError):
             f([], set())  # mismatched type
 
+    def test_pack_arguments(self):
+        f = utils.pack_arguments
+        self.assertEqual(f('PREFIX :', ['a', 'bb', 'ccc', 'd'], 14),
+                         ['PREFIX :a bb', 'PREFIX :ccc d'])
+        self.assertEqual(f('P ', ['a', 'b', 'c'], 0, separator=','), ['P a,b,c'])
+        self.assertEqual(f('P ', ['a', 'b', 'c', 'd', 'e'], 0, max_args_per_line=2),
+                         ['P a b', 'P c d', 'P e'])
+        self.assertEqual(f('P ', [], 10), [])
+
+        # Lengths are counted in bytes
+        self.assertEqual(f('P ', ['\u00e9\u00e9', 'ab', 'c'], 7), ['P \u00e9\u00e9', 'P ab c'])
+        self.assertEqual(f('P ', ['\u00e9\u00e9', 'ab'], 7, encoding='latin-1'), ['P \u00e9\u00e9 ab'])
+
+        with self.assertRaises(ValueError):
+            f('PREFIX :', ['a', 'toolongarg'], 12)
+
+    def test_add_remove_hooks(self):
+        def hook1(*args): pass
+        def hook2(*args): pass
+        def hook3(*args): pass
+
+        with patch.dict(world.hooks, clear=True):
+            utils.add_hook(hook1, 'join')
+            old_handlers = world.hooks['JOIN']
+            utils.add_hook(hook2, 'JOIN', priority=200)
+            utils.add_hook(hook3, 'JOIN', networks=['net1'])
+
+            # Handlers are published as a new sorted tuple; older tuples are left untouched
+            self.assertEqual(old_handlers, (utils.HookHandler(100, hook1),))
+            self.assertEqual(world.hooks['JOIN'],
+                             (utils.HookHandler(200, hook2), utils.HookHandler(100, hook1),
+                              utils.HookHandler(100, hook3, False, frozenset({'net1'}))))
+
+            utils.remove_hooks(lambda func: func in (hook1, hook3))
+            self.assertEqual(world.hooks['JOIN'], (utils.HookHandler(200, hook2),))
+            utils.remove_hooks(lambda func: func is hook2, 'join')
+            self.assertNotIn('JOIN', world.hooks)
+            # Unbound hooks read as empty, without being added to the table.
+            self.assertEqual(world.hooks['JOIN'], ())
+            self.assertNotIn('JOIN', world.hooks)
+
 if __name__ == '__main__':
     unittest.main()
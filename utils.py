@@ -13,18 +13,19 @@ import ipaddress
 import os
 import re
 import string
+import threading
 
 # Load the protocol and plugin packages.
 from pylinkirc import plugins, protocols
 
-from . import conf, structures, world
+from . import conf, selectdriver, structures, world
 from .log import log
 
 __all__ = ['PLUGIN_PREFIX', 'PROTOCOL_PREFIX', 'NORMALIZEWHITESPACE_RE',
            'NotAuthorizedError', 'InvalidArgumentsError', 'ProtocolError',
-           'add_cmd', 'add_hook', 'expand_path', 'split_hostmask',
+           'add_cmd', 'HookHandler', 'add_hook', 'remove_hooks', 'call_in_main', 'expand_path', 'split_hostmask',
            'ServiceBot', 'register_service', 'unregister_service',
-           'wrap_arguments', 'IRCParser', 'strip_irc_formatting',
+           'wrap_arguments', 'LinePacker', 'pack_arguments', 'IRCParser', 'strip_irc_formatting',
            'remove_range', 'get_hostname_type', 'parse_duration', 'match_text',
            'merge_iterables']
 
@@ -54,17 +55,112 @@ def add_cmd(func, name=None, **kwargs):
     world.services['pylink'].add_cmd(func, name=name, **kwargs)
     return func
 
-def add_hook(func, command, priority=100):
+# A registered hook function, as stored in world.hooks. Filters (channels_only, networks) are checked
+# by the dispatcher, so that filtered out events never reach the function. executor is None for
+# hooks run inline, or 'pool' for hooks run on the hook worker pool. wants_channeldata marks
+# hooks that read the "channeldata" (old channel state) field of JOIN and MODE payloads.
+HookHandler = collections.namedtuple('HookHandler',
+                                     'priority func channels_only networks executor wants_channeldata',
+                                     defaults=(False, None, None, False))
+
+# Serializes changes to world.hooks; readers never need it, since the handler tuples there are
+# immutable and only ever replaced.
+_hooks_lock = threading.Lock()
+
+def add_hook(func, command, priority=100, channels_only=False, networks=None, executor=None,
+             wants_channeldata=False):
     """
     Binds a hook function to the given command name.
 
     A custom priority can also be given (defaults to 100), and hooks with
-    higher priority values will be called first."""
+    higher priority values will be called first.
+
+    If channels_only is True, the hook is only called for events whose target (or channel)
+    is a channel. networks optionally sets a list of network names to call the hook on.
+
+    If executor is set to 'pool', the hook runs on a bounded worker thread pool instead of the
+    socket thread, in order with other pooled hook calls for the same network and target. Pooled
+    hooks get a copy of the hook payload, can't stop the event from reaching other hooks, and
+    should use call_in_main() to act on shared state. Hooks in coremods always run inline.
+
+    Protocol modules only copy a channel's old state into the "channeldata" field of burst JOIN
+    and channel MODE payloads if some hook bound to that command sets wants_channeldata=True;
+    otherwise the field may be None."""
     command = command.upper()
-    world.hooks[command].append((priority, func))
-    world.hooks[command].sort(key=lambda pair: pair[0], reverse=True)
+    if executor not in (None, 'pool'):
+        raise ValueError("Unknown hook executor %r" % executor)
+    elif executor and func.__module__.startswith(__package__ + '.coremods'):
+        # Core state keeping hooks must run before anything else sees the next event.
+        log.debug('Running hook function %s inline, as it is part of coremods', func)
+        executor = None
+    if networks is not None:
+        networks = frozenset(networks)
+    handler = HookHandler(priority, func, channels_only, networks, executor, wants_channeldata)
+    with _hooks_lock:
+        # Publish a new sorted tuple instead of changing the old one in place, so that events
+        # being dispatched concurrently keep a consistent view.
+        handlers = world.hooks.get(command, ()) + (handler,)
+        world.hooks[command] = tuple(sorted(handlers, key=lambda handler: handler[0], reverse=True))
     return func
 
+def remove_hooks(filterfunc, command=None):
+    """
+    Unbinds all hook functions for which filterfunc(func) returns True, for the given command name
+    or for all commands if none is given.
+    """
+    with _hooks_lock:
+        commands = [command.upper()] if command else list(world.hooks)
+        for command in commands:
+            handlers = world.hooks.get(command, ())
+            newhandlers = tuple(handler for handler in handlers if not filterfunc(handler[1]))
+            if len(newhandlers) == len(handlers):
+                continue
+            log.debug('Removing %s hook function(s) from hook %s', len(handlers) - len(newhandlers),
+                      command)
+            if newhandlers:
+                world.hooks[command] = newhandlers
+            else:
+                del world.hooks[command]
+
+def _update_hook_profiling():
+    """Applies the hook profiling options in the config (pylink::hook_profiling, slow_hook_threshold)."""
+    world.hook_profiling = bool(conf.conf['pylink'].get('hook_profiling', False))
+    world.slow_hook_threshold = conf.conf['pylink'].get('slow_hook_threshold') or 0
+    world.hook_timing = world.hook_profiling or world.slow_hook_threshold > 0
+
+_hook_pool = None
+_hook_pool_lock = threading.Lock()
+
+def _get_hook_pool():
+    """
+    Returns the worker pool for pooled hooks, creating it from the pylink::hook_pool_workers and
+    pylink::hook_pool_max_pending options if needed.
+    """
+    global _hook_pool
+    if _hook_pool is None:
+        with _hook_pool_lock:
+            if _hook_pool is None:
+                _hook_pool = structures.OrderedPool(conf.conf['pylink'].get('hook_pool_workers', 4),
+                                                    conf.conf['pylink'].get('hook_pool_max_pending', 1000),
+                                                    name='pylink-hooks')
+    return _hook_pool
+
+def _shutdown_hook_pool():
+    """Waits for pooled hooks to finish and shuts down the hook worker pool."""
+    global _hook_pool
+    with _hook_pool_lock:
+        pool, _hook_pool = _hook_pool, None
+    if pool is not None:
+        log.debug('Waiting for pooled hooks to finish')
+        pool.shutdown()
+
+def call_in_main(func, *args):
+    """
+    Schedules func(*args) to run on the socket driver's main loop. This is meant for pooled hooks
+    (and other worker threads) to report their results back, e.g. to change network state.
+    """
+    return (world.driver or selectdriver).call_later(0, func, *args)
+
 def expand_path(path):
     """
     Returns a path expanded with environment variables and home folders (~) expanded, in that order."""
@@ -247,23 +343,23 @@ class ServiceBot():
 
         irc.call_hooks([uid, 'PYLINK_SERVICE_PART', {'channels': to_part, 'text': reason}])
 
-    def reply(self, irc, text, notice=None, private=None):
+    def reply(self, irc, text, notice=None, private=None, priority=None):
         """Replies to a message as the service in question."""
         servuid = self.uids.get(irc.name)
         if not servuid:
             log.warning("(%s) Possible desync? UID for service %s doesn't exist!", irc.name, self.name)
             return
 
-        irc.reply(text, notice=notice, source=servuid, private=private)
+        irc.reply(text, notice=notice, source=servuid, private=private, priority=priority)
 
-    def error(self, irc, text, notice=None, private=None):
+    def error(self, irc, text, notice=None, private=None, priority=None):
         """Replies with an error, as the service in question."""
         servuid = self.uids.get(irc.name)
         if not servuid:
             log.warning("(%s) Possible desync? UID for service %s doesn't exist!", irc.name, self.name)
             return
 
-        irc.error(text, notice=notice, source=servuid, private=private)
+        irc.error(text, notice=notice, source=servuid, private=private, priority=priority)
 
     def call_cmd(self, irc, source, text, called_in=None):
         """
@@ -474,15 +570,15 @@ class ServiceBot():
                               reason=part_reason)
 
 
-    def _show_command_help(self, irc, command, private=False, shortform=False):
+    def _show_command_help(self, irc, command, private=False, shortform=False, priority=None):
         """
         Shows help for the given command.
         """
         def _reply(text):
             """
-            reply() wrapper to handle the private argument.
+            reply() wrapper to handle the private and priority arguments.
             """
-            self.reply(irc, text, private=private)
+            self.reply(irc, text, private=private, priority=priority)
 
         def _reply_format(next_line):
             """
@@ -611,17 +707,21 @@ class ServiceBot():
             self.reply(irc, 'This service doesn\'t provide any public commands from the plugin %s.' % plugin_filter)
 
         # If there are featured commands, list them by showing the help for each.
-        # These definitions are sent in private to prevent flooding in channels.
+        # These definitions are sent in private to prevent flooding in channels. As private
+        # replies from an existing service don't depend on any other output, they can skip
+        # ahead of bulk traffic.
         if self.featured_cmds and not plugin_filter:
-            self.reply(irc, " ", private=True)
-            self.reply(irc, 'Featured commands include:', private=True)
+            from pylinkirc.classes import SENDQ_INTERACTIVE  # Avoid a circular import
+            self.reply(irc, " ", private=True, priority=SENDQ_INTERACTIVE)
+            self.reply(irc, 'Featured commands include:', private=True, priority=SENDQ_INTERACTIVE)
             for cmd in sorted(self.featured_cmds):
                 if cmd in cmds:
                     # Only show featured commands that are both defined and loaded.
                     # TODO: perhaps plugin unload should remove unused featured command
                     # definitions automatically?
-                    self._show_command_help(irc, cmd, private=True, shortform=True)
-            self.reply(irc, 'End of command listing.', private=True)
+                    self._show_command_help(irc, cmd, private=True, shortform=True,
+                                            priority=SENDQ_INTERACTIVE)
+            self.reply(irc, 'End of command listing.', private=True, priority=SENDQ_INTERACTIVE)
 
 def register_service(name, *args, **kwargs):
     """Registers a service bot."""
@@ -693,6 +793,88 @@ def wrap_arguments(prefix, args, length, separator=' ', max_args_per_line=0):
     return strings
 wrapArguments = wrap_arguments
 
+class LinePacker():
+    """
+    Packs arguments into as few lines as possible, where each line starts with a static prefix
+    and is at most `length` bytes long once encoded. A length of 0 or less means that lines are
+    not limited in length.
+
+    Unlike wrap_arguments(), arguments are added one at a time, so that callers can change an
+    argument depending on whether it starts a new line (e.g. P10 BURST member lists).
+    """
+    def __init__(self, prefix, length, separator=' ', encoding='utf-8', max_args_per_line=0):
+        self.prefix = prefix
+        self.length = max(length, 0)
+        self.separator = separator
+        self.encoding = encoding
+        self.max_args_per_line = max_args_per_line
+
+        self.lines = []
+        self.count = 0  # Total amount of arguments added
+
+        self._buf = []
+        self._prefix_len = self._len(prefix)
+        self._sep_len = self._len(separator)
+        self._buf_len = self._prefix_len
+
+    def _len(self, text):
+        """Returns the encoded length of the given text."""
+        if text.isascii():
+            return len(text)
+        return len(text.encode(self.encoding, 'replace'))
+
+    def fits(self, arg):
+        """
+        Returns whether the given argument fits on the current line. This is always True for
+        an empty line.
+        """
+        if not self._buf:
+            return True
+        if self.max_args_per_line and len(self._buf) >= self.max_args_per_line:
+            return False
+        return (not self.length) or self._buf_len + self._sep_len + self._len(arg) <= self.length
+
+    def add(self, arg):
+        """Adds an argument, starting a new line first if it doesn't fit on the current one."""
+        arglen = self._len(arg)
+        if self.length and self._prefix_len + arglen > self.length:
+            raise ValueError("LinePacker: Argument %r is too long for the given length %s" % (arg, self.length))
+
+        if self._buf:
+            if not self.fits(arg):
+                self.break_line()
+            else:
+                self._buf_len += self._sep_len
+
+        self._buf.append(arg)
+        self._buf_len += arglen
+        self.count += 1
+
+    def break_line(self):
+        """Ends the current line, if it has any arguments."""
+        if self._buf:
+            self.lines.append(self.prefix + self.separator.join(self._buf))
+            self._buf = []
+            self._buf_len = self._prefix_len
+
+    def get_lines(self):
+        """Ends the current line and returns the list of packed lines."""
+        self.break_line()
+        return self.lines
+
+def pack_arguments(prefix, args, length, separator=' ', encoding='utf-8', max_args_per_line=0):
+    """
+    Takes a static prefix and a list of arguments, and returns a list of strings
+    with the arguments packed across as few lines as possible, each at most `length`
+    bytes long when encoded. This is a byte-length aware, linear time alternative to
+    wrap_arguments().
+    """
+    packer = LinePacker(prefix, length, separator=separator, encoding=encoding,
+                        max_args_per_line=max_args_per_line)
+    for arg in args:
+        packer.add(arg)
+    return packer.get_lines()
+
 class IRCParser(argparse.ArgumentParser):
     """
     Wrapper around argparse.ArgumentParser, without quitting on usage errors.
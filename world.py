@@ -4,19 +4,27 @@ world.py: Stores global variables for PyLink, including lists of active IRC obje
 
 import threading
 import time
-from collections import defaultdict, deque
+from collections import deque
 
 __all__ = ['testing', 'hooks', 'networkobjects', 'plugins', 'services',
            'exttarget_handlers', 'started', 'start_ts', 'shutting_down',
-           'source', 'fallback_hostname', 'daemon']
+           'source', 'fallback_hostname', 'daemon', 'driver', 'hook_profiling',
+           'slow_hook_threshold', 'hook_timing', 'hook_stats']
 
 # This indicates whether we're running in tests mode. What it actually does
 # though is control whether IRC connections should be threaded or not.
 testing = False
 
+class _HookTable(dict):
+    """Hook table where hook names with no handlers bound read as an empty tuple."""
+    def __missing__(self, key):
+        return ()
+
 # Statekeeping for our hooks list, IRC objects, loaded plugins, and initialized
-# service bots.
-hooks = defaultdict(list)
+# service bots. hooks maps hook names to immutable tuples of utils.HookHandler, sorted by
+# priority. It is read-only outside of utils.add_hook() and utils.remove_hooks(), which must be
+# used to change it.
+hooks = _HookTable()
 networkobjects = {}
 plugins = {}
 services = {}
@@ -48,3 +56,15 @@ _should_remove_pid = False
 
 # Determines whether we're daemonized.
 daemon = False
+
+# Hook profiling settings, from the pylink::hook_profiling and pylink::slow_hook_threshold options.
+# hook_timing is set whenever either is enabled, and makes call_hooks() time hook functions.
+hook_profiling = False
+slow_hook_threshold = 0
+hook_timing = False
+# Maps (plugin, hook name) pairs to structures.HookStats, filled in while hook profiling is enabled.
+hook_stats = {}
+
+# Socket driver module in use, set by the launcher from the pylink::driver option. None implies
+# the default (selectdriver).
+driver = None